@@ -0,0 +1,12 @@
+#!/bin/bash
+#local hot standby of mts_postgres for testing of read-replica routing, it listens on port 5433
+DATA=/var/lib/postgresql/data
+chown -R postgres:postgres $DATA
+if [ ! -s $DATA/PG_VERSION ]; then
+    until gosu postgres pg_basebackup -h 127.0.0.1 -p 5432 -U postgres -D $DATA -R -X stream; do
+        echo "waiting for the primary"
+        sleep 2
+    done
+fi
+chmod 700 $DATA
+exec gosu postgres postgres -D $DATA -p 5433 -c hot_standby=on
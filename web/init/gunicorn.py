@@ -1,9 +1,14 @@
+import os
+
 accesslog='/var/log/gunicorn/access.log'
 errorlog='/var/log/gunicorn/error.log'
 loglevel='debug'
 bind='unix:/var/www/money_transfer_system/gunicorn.sock'
 backlog=1000
-workers=2
-timeout=30
+#sync (default), gthread or uvicorn.workers.UvicornWorker for ASGI deployment
+worker_class=os.getenv('GUNICORN_WORKER_CLASS', 'sync')
+workers=int(os.getenv('GUNICORN_WORKERS', 2))
+#threads of every worker, used by gthread worker class
+threads=int(os.getenv('GUNICORN_THREADS', 1))
+timeout=int(os.getenv('GUNICORN_TIMEOUT', 30))
 keepalive=5
-
@@ -4,4 +4,15 @@ python manage.py makemigrations
 python manage.py migrate
 python manage.py collectstatic --noinput
 celery worker -A project --beat -l DEBUG -f /tmp/celery.log &
-gunicorn --preload -c /etc/gunicorn/gunicorn.py mts_django.wsgi:application
+#one worker per partition of asynchronous transfers keeps order of transfers of every account
+for i in $(seq 0 $((${TRANSFER_QUEUE_PARTITIONS:-4} - 1))); do
+    celery worker -A project -Q transfers.$i --concurrency=1 -n transfers$i@%h -l INFO -f /tmp/celery_transfers$i.log &
+done
+#long-lived streams of rate updates are served by the event loop
+uvicorn project.asgi:application --uds /var/www/money_transfer_system/uvicorn.sock --log-level info &
+if [ "$GUNICORN_WORKER_CLASS" = "uvicorn.workers.UvicornWorker" ]; then
+    #ASGI deployment: read-heavy views run in the thread pool of the event loop
+    ASYNC_VIEWS=1 gunicorn --preload -c /etc/gunicorn/gunicorn.py project.asgi:application
+else
+    gunicorn --preload -c /etc/gunicorn/gunicorn.py mts_django.wsgi:application
+fi
@@ -4,4 +4,8 @@ python manage.py makemigrations
 python manage.py migrate
 python manage.py collectstatic --noinput
 celery worker -A project --beat -l DEBUG -f /tmp/celery.log &
+#one worker per partition of asynchronous transfers keeps order of transfers of every account
+for i in $(seq 0 $((${TRANSFER_QUEUE_PARTITIONS:-4} - 1))); do
+    celery worker -A project -Q transfers.$i --concurrency=1 -n transfers$i@%h -l INFO -f /tmp/celery_transfers$i.log &
+done
 gunicorn -c /etc/gunicorn/gunicorn.py mts_django.wsgi:application
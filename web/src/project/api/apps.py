@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class ApiConfig(AppConfig):
     name = 'api'
+
+    def ready(self):
+        from celery.signals import task_prerun
+        from project.db import check_connections
+        #persistent connections of Celery workers are checked before every task like before every request
+        task_prerun.connect(check_connections, dispatch_uid='project.db.check_connections')
@@ -1,6 +1,16 @@
+import threading
+from django.conf import settings
+from django.test import override_settings
+from django.contrib.auth.models import update_last_login
+from django.contrib.auth.hashers import Argon2PasswordHasher, make_password, check_password
 from rest_framework.test import APITransactionTestCase, APIClient
 from money.models import Course, Currency, Transfer, Account
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
 from users.models import User
+from users.authentication import StatelessJWTAuthentication, ClaimsUser, revoke_token, revoke_user_tokens, is_revoked
+from money.streams import authenticate
+from users.serializers import TokenObtainPairWithClaimsSerializer
+from users.hashing import HashingPool, HashingPoolBusy, PooledModelBackend, hashing_pool
 
 class TestAPI(APITransactionTestCase):
     
@@ -14,4 +24,116 @@ class TestAPI(APITransactionTestCase):
 
     def test_create_user(self):
         users = User.objects.all()
-        self.assertEqual(len(users), 2, mag='Count of users must be 2!')
\ No newline at end of file
+        self.assertEqual(len(users), 2, mag='Count of users must be 2!')
+
+class TestStatelessAuthentication(APITransactionTestCase):
+    """Access token carries the user, revoked tokens are rejected"""
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user('stateless@server.org', 'wsx123qaz', username='stateless')
+
+    def test_claims(self):
+        token = TokenObtainPairWithClaimsSerializer.get_token(self.user).access_token
+        user = StatelessJWTAuthentication().get_user(token)
+        self.assertIsInstance(user, ClaimsUser)
+        self.assertEqual(user.pk, self.user.pk)
+        self.assertFalse(user.is_staff)
+        self.assertEqual(user.get_user(), self.user)
+
+    def test_revoked(self):
+        token = TokenObtainPairWithClaimsSerializer.get_token(self.user).access_token
+        revoke_token(token)
+        with self.assertRaises(AuthenticationFailed):
+            StatelessJWTAuthentication().get_user(token)
+        #the rates stream accepts the same tokens
+        self.assertIsNone(authenticate({'headers': [(b'authorization', ('Bearer %s' % token).encode())], 'query_string': b''}))
+
+    def test_revoked_user_tokens(self):
+        token = TokenObtainPairWithClaimsSerializer.get_token(self.user).access_token
+        token['iat'] -= 1
+        self.assertIsNotNone(authenticate({'headers': [(b'authorization', ('Bearer %s' % token).encode())], 'query_string': b''}))
+        revoke_user_tokens(self.user.pk)
+        self.assertTrue(is_revoked(token))
+        #tokens of the revocation second are issued after it
+        self.assertFalse(is_revoked(TokenObtainPairWithClaimsSerializer.get_token(self.user).access_token))
+
+    def test_rights_changed(self):
+        token = TokenObtainPairWithClaimsSerializer.get_token(self.user).access_token
+        token['iat'] -= 1
+        #saves without changes of rights (last login, name) keep tokens
+        update_last_login(None, self.user)
+        self.user.first_name = 'Stateless'
+        self.user.save()
+        self.assertFalse(is_revoked(token))
+        #token with the old is_staff claim is revoked, the same for deactivated users
+        self.user.is_staff = True
+        self.user.save()
+        self.assertTrue(is_revoked(token))
+        inactive = User.objects.create_user('inactive@server.org', 'wsx123qaz', username='inactive')
+        token = TokenObtainPairWithClaimsSerializer.get_token(inactive).access_token
+        token['iat'] -= 1
+        inactive.is_active = False
+        inactive.save(update_fields=['is_active'])
+        with self.assertRaises(AuthenticationFailed):
+            StatelessJWTAuthentication().get_user(token)
+
+class TestPasswordHashing(APITransactionTestCase):
+    """Logins rehash outdated hashes, checks of passwords over the capacity of the hashing pool get 503"""
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user('hashing@server.org', 'wsx123qaz', username='hashing')
+
+    def test_configured_hasher(self):
+        algorithm, variety, version, params, salt, data = self.user.password.split('$')
+        self.assertEqual(algorithm, 'argon2')
+        self.assertEqual(params, 'm=%s,t=%s,p=%s' % (settings.ARGON2_MEMORY_COST, settings.ARGON2_TIME_COST, settings.ARGON2_PARALLELISM))
+
+    def test_rehash_on_login(self):
+        #hashes of other hashers and of other argon2 parameters are updated
+        for encoded in (make_password('wsx123qaz', hasher='pbkdf2_sha256'), Argon2PasswordHasher().encode('wsx123qaz', 'salt12345678')):
+            User.objects.filter(pk=self.user.pk).update(password=encoded)
+            self.assertEqual(PooledModelBackend().authenticate(None, username='hashing@server.org', password='wsx123qaz'), self.user)
+            password = User.objects.get(pk=self.user.pk).password
+            self.assertNotEqual(password, encoded)
+            self.assertTrue(password.startswith('argon2$'))
+            self.assertTrue(check_password('wsx123qaz', password))
+        self.assertIsNone(PooledModelBackend().authenticate(None, username='hashing@server.org', password='wrong'))
+        self.assertEqual(User.objects.get(pk=self.user.pk).password, password)
+
+    def test_pool_busy(self):
+        pool = HashingPool(1, 0)
+        started, release = threading.Event(), threading.Event()
+        def hold():
+            started.set()
+            release.wait(5)
+        thread = threading.Thread(target=pool.run, args=(hold,))
+        thread.start()
+        started.wait(5)
+        try:
+            with override_settings(PASSWORD_HASHING_WAIT=0.01):
+                with self.assertRaises(HashingPoolBusy):
+                    pool.run(make_password, 'wsx123qaz')
+        finally:
+            release.set()
+            thread.join()
+        self.assertTrue(pool.run(check_password, 'wsx123qaz', self.user.password))
+
+    def test_busy_responses(self):
+        admin = User.objects.create_user('hashing2@server.org', 'wsx123qaz', username='hashing2', is_staff=True)
+        self.client.force_authenticate(user=admin)
+        taken = 0
+        while hashing_pool.slots.acquire(blocking=False):
+            taken += 1
+        try:
+            with override_settings(PASSWORD_HASHING_WAIT=0.01):
+                responses = [
+                    self.client.post('/api/token/', {'email': 'hashing@server.org', 'password': 'wsx123qaz'}, format='json'),
+                    self.client.patch('/api/users/%s/edit/' % self.user.pk, {'email': 'hashing@server.org', 'new_username': 'hashing',
+                        'current_password': 'wsx123qaz', 'new_password': 'edc456rfv'}, format='json'),
+                ]
+        finally:
+            for i in range(taken):
+                hashing_pool.slots.release()
+        for response in responses:
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], '1')
@@ -1,9 +1,14 @@
 from django.urls import path, include
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from rest_framework_simplejwt.views import TokenRefreshView
+from api.views import DatabaseStatsView
+from users.serializers import TokenObtainPairWithClaimsSerializer, TokenRefreshCheckedSerializer
+from users.views import TokenObtainView, TokenRevokeView
 
 urlpatterns = [
-    path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
-    path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('token/', TokenObtainView.as_view(serializer_class=TokenObtainPairWithClaimsSerializer), name='token_obtain_pair'),
+    path('token/refresh/', TokenRefreshView.as_view(serializer_class=TokenRefreshCheckedSerializer), name='token_refresh'),
+    path('token/revoke/', TokenRevokeView.as_view(), name='token_revoke'),
+    path('stats/db/', DatabaseStatsView.as_view(), name='database_stats'),
     path('users/', include('users.urls')),
     path('money/', include('money.urls'))
 ]
\ No newline at end of file
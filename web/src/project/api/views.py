@@ -0,0 +1,20 @@
+import logging
+import psycopg2
+from rest_framework import permissions, status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from project.db import get_connection_stats, get_pgbouncer_stats
+
+info_logger = logging.getLogger('info')
+
+class DatabaseStatsView(APIView):
+    """View for getting statistics of database connections of the worker process and pools of PgBouncer"""
+    permission_classes = [permissions.IsAdminUser]
+    def get(self, request):
+        data = {'process': get_connection_stats()}
+        try:
+            data['pgbouncer'] = get_pgbouncer_stats()
+        except psycopg2.Error as e:
+            info_logger.info('DatabaseStatsView: %s' % e)
+            data['pgbouncer'] = {'error': str(e)}
+        return Response(data=data, status=status.HTTP_200_OK)
@@ -0,0 +1,113 @@
+from decimal import Decimal, Context, MAX_PREC, MAX_EMAX, MIN_EMIN
+from django.conf import settings
+
+#decimal places of amount and balance columns, amounts with this scale convert to DecimalField losslessly
+MONEY_SCALE = 4
+
+#context without rounding, shifting the exponent in it is exact for amounts of any length
+EXACT_CONTEXT = Context(prec=MAX_PREC, Emax=MAX_EMAX, Emin=MIN_EMIN)
+
+def round_half_even(numerator, denominator):
+    """Quotient of integers rounded half to even (banker's rounding), denominator must be positive"""
+    quotient, remainder = divmod(numerator, denominator)
+    twice = 2 * remainder
+    if twice > denominator or (twice == denominator and quotient % 2):
+        quotient += 1
+    return quotient
+
+def to_decimal(units, scale=MONEY_SCALE):
+    """Decimal value of integer count of minor units, used where amounts leave integer arithmetic (SQL parameters, responses)"""
+    return Decimal(units).scaleb(-scale)
+
+def currency_scale(currency):
+    """Decimal places of the currency, CURRENCY_SCALES overrides MONEY_SCALE for currencies without minor units"""
+    return min(settings.CURRENCY_SCALES.get(getattr(currency, 'name', currency), MONEY_SCALE), MONEY_SCALE)
+
+class Money:
+    """Amount of money as integer count of minor units with fixed scale.
+
+    Arithmetic is exact integer arithmetic, rounding happens only in convert and from_decimal
+    and it is always half to even, so results do not depend on decimal context.
+    """
+    __slots__ = ('units', 'scale')
+
+    def __init__(self, units, scale=MONEY_SCALE):
+        self.units = units
+        self.scale = scale
+
+    @classmethod
+    def from_decimal(cls, value, scale=MONEY_SCALE, exact=True):
+        """Money from Decimal (or int, str) value
+
+        :param exact: raise ValueError if value has more decimal places than scale, otherwise round it
+        """
+        if not isinstance(value, Decimal):
+            value = Decimal(value)
+        #amounts with at most scale places are integers after the shift, only the rest needs rounding
+        scaled = value.scaleb(scale, EXACT_CONTEXT)
+        units = int(scaled)
+        if units == scaled:
+            return cls(units, scale)
+        numerator, denominator = value.as_integer_ratio()
+        units = round_half_even(numerator * 10 ** scale, denominator)
+        if exact and units * denominator != numerator * 10 ** scale:
+            raise ValueError('Amount %s has more than %s decimal places' % (value, scale))
+        return cls(units, scale)
+
+    def to_decimal(self):
+        return to_decimal(self.units, self.scale)
+
+    def convert(self, ratio, scale=MONEY_SCALE):
+        """Amount multiplied by rational rate (numerator, denominator) and rounded half to even to scale"""
+        numerator, denominator = ratio
+        numerator *= self.units
+        if scale > self.scale:
+            numerator *= 10 ** (scale - self.scale)
+        elif scale < self.scale:
+            denominator *= 10 ** (self.scale - scale)
+        return Money(round_half_even(numerator, denominator), scale)
+
+    def check_scale(self, other):
+        if self.scale != other.scale:
+            raise ValueError('Amounts have different scales')
+
+    def __add__(self, other):
+        self.check_scale(other)
+        return Money(self.units + other.units, self.scale)
+
+    def __sub__(self, other):
+        self.check_scale(other)
+        return Money(self.units - other.units, self.scale)
+
+    def __neg__(self):
+        return Money(-self.units, self.scale)
+
+    def __eq__(self, other):
+        if not isinstance(other, Money):
+            return False
+        if self.scale == other.scale:
+            return self.units == other.units
+        return self.units * 10 ** other.scale == other.units * 10 ** self.scale
+
+    def __lt__(self, other):
+        if self.scale == other.scale:
+            return self.units < other.units
+        return self.units * 10 ** other.scale < other.units * 10 ** self.scale
+
+    def __le__(self, other):
+        if self.scale == other.scale:
+            return self.units <= other.units
+        return self.units * 10 ** other.scale <= other.units * 10 ** self.scale
+
+    def __hash__(self):
+        return hash(self.to_decimal())
+
+    def __bool__(self):
+        return self.units != 0
+
+    def __repr__(self):
+        return 'Money(%s)' % self.to_decimal()
+
+def course_ratio(course):
+    """Course as exact fraction of integers"""
+    return Decimal(course).as_integer_ratio()
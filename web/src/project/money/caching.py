@@ -0,0 +1,112 @@
+import gzip
+import hashlib
+import logging
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.http import http_date, parse_http_date_safe
+from redis import RedisError
+from rest_framework.renderers import JSONRenderer
+from money.rates import RATES_VERSION_KEY, RATES_UPDATED_KEY
+from project.redis import get_redis
+
+info_logger = logging.getLogger('info')
+
+def cache_key(name, version, query):
+    """Responses of the old versions are never read again, they are removed by TTL"""
+    return 'money:cache:%s:%s:%s' % (name, version, query)
+
+def get_query_hash(request):
+    """Hash of query parameters, the same parameters in any order give the same hash"""
+    items = sorted((name, value) for name, values in request.query_params.lists() for value in values)
+    return hashlib.sha1(repr(items).encode()).hexdigest()[:16]
+
+def accepts_gzip(request):
+    return 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+
+def etag_matches(request, etag):
+    """Compares If-None-Match header with ETag, representations with and without gzip have the same base"""
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH', None)
+    if not if_none_match:
+        return False
+    tags = [tag.strip().replace('-gzip"', '"') for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags
+
+def rates_cached_response(request, name, build):
+    """Returns response of data depending only on currencies and courses, cached by the rates version.
+
+    Version and time of the last update_courses run are read from Redis by one MGET, so
+    revalidation by If-None-Match or If-Modified-Since costs one round-trip and no database queries.
+    The first request of the new version renders JSON, compresses it by gzip and stores the body
+    in Redis, so the other requests of this version neither query the database nor serialize.
+
+    :param name: name of the resource, part of the cache key
+    :param build: function build(request) returns (data, headers) or Response with error
+    """
+    try:
+        redis = get_redis()
+        version, updated = redis.mget(RATES_VERSION_KEY, RATES_UPDATED_KEY)
+    except RedisError:
+        info_logger.info('rates_cached_response: Redis is not available')
+        redis, version, updated = None, None, None
+    if version is None:
+        #rates were never published, nothing to cache against
+        return render_response(build(request))
+    query = get_query_hash(request)
+    etag = '"%s-%s"' % (int(version), query)
+    last_modified = http_date(int(float(updated))) if updated is not None else None
+    if etag_matches(request, etag) or (last_modified and 'HTTP_IF_NONE_MATCH' not in request.META and
+            (parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', '')) or 0) >= int(float(updated))):
+        response = HttpResponse(status=304)
+        return set_cache_headers(response, etag, last_modified, gzipped=accepts_gzip(request))
+    key = cache_key(name, int(version), query)
+    try:
+        cached = redis.hgetall(key)
+    except RedisError:
+        cached = None
+    if not cached:
+        result = build(request)
+        if isinstance(result, HttpResponse):
+            return result
+        data, headers = result
+        body = gzip.compress(JSONRenderer().render(data))
+        cached = {b'body': body}
+        cached.update((('header:' + header).encode(), value.encode()) for header, value in headers.items())
+        try:
+            pipeline = redis.pipeline()
+            pipeline.hmset(key, cached)
+            pipeline.expire(key, settings.RATES_CACHE_TTL)
+            pipeline.execute()
+        except RedisError:
+            info_logger.info('rates_cached_response: response is not cached')
+    return cached_to_response(request, cached, etag, last_modified)
+
+def cached_to_response(request, cached, etag, last_modified):
+    """Response with the pre-rendered body, it is decompressed only for clients not accepting gzip"""
+    gzipped = accepts_gzip(request)
+    body = cached[b'body']
+    response = HttpResponse(body if gzipped else gzip.decompress(body), content_type='application/json')
+    if gzipped:
+        response['Content-Encoding'] = 'gzip'
+    for field, value in cached.items():
+        if field.startswith(b'header:'):
+            response[field[len(b'header:'):].decode()] = value.decode()
+    return set_cache_headers(response, etag, last_modified, gzipped)
+
+def render_response(result):
+    """Uncached response, used when Redis is not available"""
+    if isinstance(result, HttpResponse):
+        return result
+    data, headers = result
+    response = HttpResponse(JSONRenderer().render(data), content_type='application/json')
+    for header, value in headers.items():
+        response[header] = value
+    return response
+
+def set_cache_headers(response, etag, last_modified, gzipped):
+    """Strong ETag differs for gzipped representation, as its bytes differ"""
+    response['ETag'] = etag[:-1] + '-gzip"' if gzipped else etag
+    if last_modified:
+        response['Last-Modified'] = last_modified
+    response['Cache-Control'] = 'private, no-cache'
+    response['Vary'] = 'Accept-Encoding, Authorization'
+    return response
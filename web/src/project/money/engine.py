@@ -0,0 +1,251 @@
+import logging
+from collections import defaultdict
+from decimal import Decimal
+from django.conf import settings
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Q, Case, When
+from money.models import Account, Transfer, TransferKey, LedgerEntry
+from money.rates import get_rate_table
+from money.amounts import Money, MONEY_SCALE, to_decimal
+from money.shards import lock_shards, debit, credit
+from money.summaries import summary_changed
+from project.routers import mark_written
+
+info_logger = logging.getLogger('info')
+
+class TransferError(Exception):
+    """Transfer is rejected, message of the exception is shown to the client"""
+
+class DuplicateTransferError(Exception):
+    """Transfer with the same idempotency key was already executed"""
+    def __init__(self, transfer):
+        super().__init__('Transfer %s has the same idempotency key' % transfer.pk)
+        self.transfer = transfer
+
+def lock_accounts(account_pks, sender_account_pk=None):
+    """Locks accounts by SELECT ... FOR UPDATE in ascending order of primary keys.
+
+    All transfers take locks in the same order, so two concurrent transfers
+    between the same pair of accounts wait for each other instead of deadlocking.
+    Only rows of Account table are locked, joined users and currencies are not.
+    When sender's account is passed, sharded receivers are read without lock,
+    they are credited through their shards.
+    """
+    account_list = Account.objects.select_related('user', 'currency')\
+        .select_for_update(of=('self',))\
+        .filter(pk__in=account_pks)\
+        .order_by('pk')
+    if sender_account_pk is None:
+        return {account.pk: account for account in account_list}
+    accounts = {account.pk: account for account in account_list.filter(Q(shards=0) | Q(pk=sender_account_pk))}
+    sharded_pks = set(account_pks) - set(accounts)
+    if sharded_pks:
+        accounts.update((account.pk, account) for account in Account.objects.select_related('user', 'currency').filter(pk__in=sharded_pks, shards__gt=0))
+    return accounts
+
+def execute_transfer(owner, sender_account_pk, receiver_account_pk, amount, idempotency_key=None):
+    """Moves money between accounts in one short transaction: SELECT ... FOR UPDATE of both accounts,
+    one UPDATE of both balances, INSERT of the transfer and INSERT of its ledger entries.
+
+    :param owner: authenticated user, must be the owner of sender's account
+    :param sender_account_pk: primary key of sender's account
+    :param receiver_account_pk: primary key of receiver's account
+    :param amount: amount of money in currency of sender's account
+    :param idempotency_key: Idempotency-Key of the client's request, unique for sender's account
+    :returns: new Transfer object
+    :raises DuplicateTransferError: transfer with the same idempotency key already exists
+    """
+    if sender_account_pk == receiver_account_pk:
+        raise TransferError('Accounts must be different')
+    if amount <= 0:
+        raise TransferError('Transfer amount must be greater than zero!')
+    amount = to_money(amount)
+    rates = get_rate_table()
+    try:
+        new_transfer, accounts, deltas = apply_transfer(owner, sender_account_pk, receiver_account_pk, amount, idempotency_key, rates)
+    except IntegrityError:
+        #the whole transaction is rolled back, balances are not changed
+        if idempotency_key is None:
+            raise
+        key = TransferKey.objects.filter(sender_account_id=sender_account_pk, idempotency_key=idempotency_key).first()
+        if key is None:
+            raise
+        #date of the transfer limits the lookup to its partition
+        duplicate = Transfer.objects.filter(pk=key.transfer_id, created=key.transfer_created).first()
+        if duplicate is None:
+            raise
+        raise DuplicateTransferError(duplicate)
+    for account_pk, delta in deltas.items():
+        accounts[account_pk].balance += to_decimal(delta)
+    return new_transfer
+
+def apply_transfer(owner, sender_account_pk, receiver_account_pk, amount, idempotency_key, rates):
+    """Transaction of execute_transfer, returns new transfer, locked accounts and deltas of their balances"""
+    with transaction.atomic():
+        accounts = lock_accounts([sender_account_pk, receiver_account_pk], sender_account_pk)
+        sender_account = accounts.get(sender_account_pk)
+        if sender_account is None:
+            raise TransferError('There is no account with id = %s' % sender_account_pk)
+        #User can not send money from other's account
+        if sender_account.user_id != owner.pk:
+            raise TransferError('It is not yours account!')
+        receiver_account = accounts.get(receiver_account_pk)
+        shards = lock_shards(sender_account)
+        available = available_money(sender_account, shards)
+        converted_amount, rate = check_transfer(sender_account, receiver_account, receiver_account_pk, amount, available, rates)
+        #balances are changed in minor units, amounts become Decimal only as parameters of the statements
+        deltas = defaultdict(int)
+        debit(sender_account, shards, amount.units, deltas)
+        credit(receiver_account, balance_units(converted_amount), deltas)
+        #balances of regular accounts are changed by one UPDATE statement
+        update_balances(deltas)
+        new_transfer = Transfer.objects.create(sender_account=sender_account, receiver_account=receiver_account, amount=amount.to_decimal())
+        LedgerEntry.objects.bulk_create(ledger_entries(new_transfer, converted_amount.to_decimal(), rate))
+        if idempotency_key is not None:
+            TransferKey.objects.create(sender_account=sender_account, idempotency_key=idempotency_key,
+                transfer=new_transfer, transfer_created=new_transfer.created)
+        #the owner reads from the primary until the replica catches up
+        mark_written(owner.pk)
+        summary_changed({owner.pk, receiver_account.user_id})
+    return new_transfer, accounts, deltas
+
+def to_money(amount):
+    """Amount of the transfer as Money, amounts with more decimal places than balances are rejected"""
+    try:
+        return Money.from_decimal(amount)
+    except (ValueError, ArithmeticError):
+        raise TransferError('Transfer amount must have at most %s decimal places' % MONEY_SCALE)
+
+def balance_units(amount):
+    """Minor units of Money in scale of balances, converted amounts have scale of the receiver's currency"""
+    return amount.units * 10 ** (MONEY_SCALE - amount.scale)
+
+def available_money(account, shards):
+    """Available balance of locked account and its locked shards"""
+    return Money.from_decimal(account.balance + sum((shard.balance for shard in shards), Decimal(0)))
+
+def check_transfer(sender_account, receiver_account, receiver_account_pk, amount, balance, rates):
+    """Checks transfer between locked accounts and returns amount in receiver's currency and rate of convertation
+
+    :param amount: Money in currency of sender's account
+    :param balance: available balance of sender's account, Money
+    :returns: tuple (converted Money, Decimal rate)
+    """
+    if receiver_account is None:
+        raise TransferError('There is no account with id = %s' % receiver_account_pk)
+    if sender_account.pk == receiver_account.pk:
+        raise TransferError('Accounts must be different')
+    if amount.units <= 0:
+        raise TransferError('Transfer amount must be greater than zero!')
+    #balance is checked under the lock, so concurrent transfers can not overdraw the account
+    if balance < amount:
+        raise TransferError('Unsufficient balance!')
+    try:
+        converted_amount = rates.convert_money(sender_account.currency, receiver_account.currency, amount)
+        rate = rates.rate(sender_account.currency, receiver_account.currency)
+    except Exception as e:
+        raise TransferError(str(e))
+    return converted_amount, rate
+
+def ledger_entries(transfer, converted_amount, rate):
+    """Debit entry of sender's account and credit entry of receiver's account"""
+    return [
+        LedgerEntry(account_id=transfer.sender_account_id, transfer=transfer, amount=-transfer.amount, rate=rate, created=transfer.created),
+        LedgerEntry(account_id=transfer.receiver_account_id, transfer=transfer, amount=converted_amount, rate=rate, created=transfer.created),
+    ]
+
+def update_balances(deltas):
+    """Applies {account_pk: delta in minor units} to balances of locked accounts by one UPDATE statement"""
+    if not deltas:
+        return
+    Account.objects.filter(pk__in=list(deltas)).update(balance=Case(
+        *[When(pk=account_pk, then=F('balance') + to_decimal(delta)) for account_pk, delta in deltas.items()],
+        output_field=models.DecimalField(max_digits=18, decimal_places=4),
+    ))
+
+class TransferBatchError(Exception):
+    """Batch in all-or-nothing mode is rolled back because of failed transfers"""
+    def __init__(self, results):
+        super().__init__('Batch is rolled back')
+        self.results = results
+
+def execute_transfer_batch(owner, sender_account_pk, items, atomic=True, chunk_size=None):
+    """Applies many transfers from one sender's account.
+
+    Transfers are processed by chunks: accounts of the chunk are locked by one
+    SELECT ... FOR UPDATE, balances are changed by one UPDATE and transfers are
+    inserted together with their ledger entries by bulk INSERTs. All chunks share one rate table snapshot.
+
+    :param owner: authenticated user, must be the owner of sender's account
+    :param sender_account_pk: primary key of sender's account
+    :param items: list of tuples (receiver_account_pk, amount)
+    :param atomic: all-or-nothing mode, when it is False every chunk is committed
+        in its own transaction and failed transfers are skipped (best-effort mode)
+    :param chunk_size: count of transfers per chunk
+    :returns: list of Transfer objects or TransferError exceptions in order of items
+    :raises TransferBatchError: in all-or-nothing mode if any transfer failed
+    """
+    chunk_size = chunk_size or settings.TRANSFER_BATCH_CHUNK_SIZE
+    rates = get_rate_table()
+    results = [None] * len(items)
+    chunks = [range(i, min(i + chunk_size, len(items))) for i in range(0, len(items), chunk_size)]
+    if atomic:
+        with transaction.atomic():
+            for chunk in chunks:
+                if apply_chunk(owner, sender_account_pk, items, chunk, rates, results):
+                    raise TransferBatchError(results)
+    else:
+        for chunk in chunks:
+            with transaction.atomic():
+                apply_chunk(owner, sender_account_pk, items, chunk, rates, results)
+    return results
+
+def apply_chunk(owner, sender_account_pk, items, chunk, rates, results):
+    """Applies transfers items[i] for i in chunk, results are written to results[i]
+
+    :returns: count of failed transfers
+    """
+    accounts = lock_accounts([sender_account_pk] + [items[i][0] for i in chunk], sender_account_pk)
+    sender_account = accounts.get(sender_account_pk)
+    if sender_account is None or sender_account.user_id != owner.pk:
+        error = TransferError('There is no account with id = %s' % sender_account_pk if sender_account is None else 'It is not yours account!')
+        for i in chunk:
+            results[i] = error
+        return len(chunk)
+    shards = lock_shards(sender_account)
+    balance = available_money(sender_account, shards)
+    total = Money(0)
+    credits = {}
+    new_transfers = []
+    conversions = []
+    failed = 0
+    for i in chunk:
+        receiver_account_pk, amount = items[i]
+        try:
+            amount = to_money(amount)
+            converted_amount, rate = check_transfer(sender_account, accounts.get(receiver_account_pk), receiver_account_pk, amount, balance, rates)
+        except TransferError as e:
+            results[i] = e
+            failed += 1
+            continue
+        balance -= amount
+        total += amount
+        credits[receiver_account_pk] = credits[receiver_account_pk] + converted_amount if receiver_account_pk in credits else converted_amount
+        results[i] = Transfer(sender_account=sender_account, receiver_account=accounts[receiver_account_pk], amount=amount.to_decimal())
+        new_transfers.append(results[i])
+        conversions.append((converted_amount.to_decimal(), rate))
+    if new_transfers:
+        deltas = defaultdict(int)
+        debit(sender_account, shards, total.units, deltas)
+        #shards of receivers are credited in order of primary keys like accounts are locked
+        for receiver_account_pk in sorted(credits):
+            credit(accounts[receiver_account_pk], balance_units(credits[receiver_account_pk]), deltas)
+        update_balances(deltas)
+        Transfer.objects.bulk_create(new_transfers)
+        entries = []
+        for new_transfer, (converted_amount, rate) in zip(new_transfers, conversions):
+            entries.extend(ledger_entries(new_transfer, converted_amount, rate))
+        LedgerEntry.objects.bulk_create(entries)
+        mark_written(owner.pk)
+        summary_changed({owner.pk} | {accounts[receiver_account_pk].user_id for receiver_account_pk in credits})
+    return failed
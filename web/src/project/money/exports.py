@@ -0,0 +1,123 @@
+import csv
+import zlib
+from decimal import Decimal
+from django.conf import settings
+from django.db.models import F, Sum, OuterRef, Subquery, DecimalField
+from django.db.models.functions import Coalesce
+from rest_framework.utils.encoders import JSONEncoder
+from money.models import Account, AccountShard, Transfer
+
+#exported columns and fields of values_list, the first column is the primary key used as resume position
+ACCOUNT_COLUMNS = [('id', 'pk'), ('user_id', 'user_id'), ('email', 'user__email'), ('currency', 'currency__name'),
+    ('balance', 'total'), ('created', 'created')]
+TRANSFER_COLUMNS = [('id', 'pk'), ('created', 'created'), ('sender_account_id', 'sender_account_id'),
+    ('sender_user_id', 'sender_account__user_id'), ('receiver_account_id', 'receiver_account_id'),
+    ('receiver_user_id', 'receiver_account__user_id'), ('currency', 'sender_account__currency__name'), ('amount', 'amount')]
+
+OUTPUTS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+def account_queryset():
+    #sharded accounts keep part of the balance in their shards
+    shards_total = AccountShard.objects.filter(account=OuterRef('pk'))\
+        .order_by().values('account').annotate(total=Sum('balance')).values('total')
+    return Account.objects.annotate(total=F('balance') + Coalesce(Subquery(shards_total,
+        output_field=DecimalField(max_digits=18, decimal_places=4)), Decimal(0)))
+
+EXPORTS = {
+    'accounts': (account_queryset, ACCOUNT_COLUMNS),
+    'transfers': (Transfer.objects.all, TRANSFER_COLUMNS),
+}
+
+def export_rows(name, date_from=None, date_to=None, after=None, using='default'):
+    """Rows of the export in order of primary keys
+
+    :param name: accounts or transfers
+    :param date_from: rows created on this date and later
+    :param date_to: rows created before this date
+    :param after: primary key of the last exported row, export resumes after it
+    :param using: alias of the database
+    :returns: column names and queryset of tuples
+    """
+    if name not in EXPORTS:
+        raise ValueError('Unknown export "%s"' % name)
+    queryset, columns = EXPORTS[name]
+    queryset = queryset().using(using)
+    if date_from is not None:
+        queryset = queryset.filter(created__gte=date_from)
+    if date_to is not None:
+        queryset = queryset.filter(created__lt=date_to)
+    if after is not None:
+        queryset = queryset.filter(pk__gt=after)
+    return [column for column, _ in columns], queryset.order_by('pk').values_list(*[field for _, field in columns])
+
+def iterate_rows(queryset, chunk_size):
+    """Fetches rows by chunks from server-side cursor, behind PgBouncer by keyset chunks of primary keys,
+    so only one chunk is held in memory"""
+    if not settings.PGBOUNCER:
+        yield from queryset.iterator(chunk_size=chunk_size)
+        return
+    last_pk = None
+    while True:
+        rows = list((queryset if last_pk is None else queryset.filter(pk__gt=last_pk))[:chunk_size])
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        last_pk = rows[-1][0]
+
+class Echo:
+    """File-like object returning written value, csv.writer formats one row per call"""
+    def write(self, value):
+        return value
+
+def render_csv(columns, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow(row)
+
+def render_ndjson(columns, rows):
+    encoder = JSONEncoder()
+    for row in rows:
+        yield encoder.encode(dict(zip(columns, row))) + '\n'
+
+def buffered(lines, size):
+    """Joins lines into chunks of about size characters, so the response is not written line by line"""
+    chunk = []
+    length = 0
+    for line in lines:
+        chunk.append(line)
+        length += len(line)
+        if length >= size:
+            yield ''.join(chunk)
+            chunk = []
+            length = 0
+    if chunk:
+        yield ''.join(chunk)
+
+def gzipped(chunks):
+    """gzip stream of text chunks"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+def export_stream(name, output, compress=False, **filters):
+    """Generator of the export body with constant memory usage and its content type
+
+    :param output: csv or ndjson
+    :param compress: gzip the body
+    :param filters: date_from, date_to, after and using of export_rows
+    """
+    if output not in OUTPUTS:
+        raise ValueError('Unknown output "%s"' % output)
+    columns, queryset = export_rows(name, **filters)
+    render = render_csv if output == 'csv' else render_ndjson
+    body = buffered(render(columns, iterate_rows(queryset, settings.EXPORT_CHUNK_SIZE)), settings.EXPORT_BUFFER_SIZE)
+    if compress:
+        return gzipped(body), 'application/gzip'
+    return body, OUTPUTS[output]
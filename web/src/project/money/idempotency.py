@@ -0,0 +1,82 @@
+import json
+import time
+import hashlib
+import logging
+from django.conf import settings
+from redis import RedisError
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+from project.redis import get_redis
+
+info_logger = logging.getLogger('info')
+
+PENDING = 'pending'
+
+def store_key(user_pk, idempotency_key):
+    return 'money:idempotency:%s:%s' % (user_pk, hashlib.sha1(idempotency_key.encode()).hexdigest())
+
+def get_fingerprint(data):
+    """Fingerprint of request's payload, the same key can not be reused for another payload"""
+    return hashlib.sha1(json.dumps(data, sort_keys=True, cls=JSONEncoder).encode()).hexdigest()
+
+def idempotent_response(request, handle):
+    """Calls handle(request) once per Idempotency-Key header of the user.
+
+    The first request saves marker "pending" in Redis by SET NX for IDEMPOTENCY_PENDING_TTL seconds and,
+    when it is done, replaces the marker by the response for IDEMPOTENCY_KEY_TTL seconds. Repeated requests
+    get the saved response without running the handler, concurrent duplicates wait for it.
+    Responses of server errors are not saved, so the client can retry.
+    Requests without the header are not deduplicated.
+    """
+    idempotency_key = request.META.get('HTTP_IDEMPOTENCY_KEY', None)
+    if not idempotency_key:
+        return handle(request)
+    if len(idempotency_key) > 64:
+        return Response(data={'error': 'Idempotency-Key must be up to 64 characters'}, status=status.HTTP_400_BAD_REQUEST)
+    key = store_key(request.user.pk, idempotency_key)
+    fingerprint = get_fingerprint(request.data)
+    try:
+        redis = get_redis()
+        deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT
+        while not redis.set(key, json.dumps({'state': PENDING, 'fingerprint': fingerprint}), nx=True, ex=settings.IDEMPOTENCY_PENDING_TTL):
+            saved = redis.get(key)
+            if saved is None:
+                continue
+            saved = json.loads(saved)
+            if saved['fingerprint'] != fingerprint:
+                return Response(data={'error': 'Idempotency-Key was already used for another request'}, status=status.HTTP_409_CONFLICT)
+            if saved['state'] != PENDING:
+                response = Response(data=saved['data'], status=saved['status'])
+                response['Idempotent-Replayed'] = 'true'
+                return response
+            if time.monotonic() > deadline:
+                return Response(data={'error': 'Request with this Idempotency-Key is in progress'}, status=status.HTTP_409_CONFLICT)
+            time.sleep(0.05)
+    except RedisError:
+        #unique constraint of the database still prevents double execution
+        info_logger.info('idempotent_response: Redis is not available')
+        return handle(request)
+    try:
+        response = handle(request)
+    except:
+        forget_response(redis, key)
+        raise
+    if response.status_code >= 500:
+        forget_response(redis, key)
+    else:
+        save_response(redis, key, fingerprint, response)
+    return response
+
+def save_response(redis, key, fingerprint, response):
+    saved = {'state': 'done', 'fingerprint': fingerprint, 'status': response.status_code, 'data': response.data}
+    try:
+        redis.set(key, json.dumps(saved, cls=JSONEncoder), ex=settings.IDEMPOTENCY_KEY_TTL)
+    except RedisError:
+        info_logger.info('save_response: Redis is not available')
+
+def forget_response(redis, key):
+    try:
+        redis.delete(key)
+    except RedisError:
+        info_logger.info('forget_response: Redis is not available')
@@ -0,0 +1,107 @@
+import re
+import logging
+import threading
+from datetime import datetime
+from decimal import Decimal
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from django.conf import settings
+from django.db import connection, transaction
+from money.models import Currency, Course
+
+info_logger = logging.getLogger('info')
+
+#HTTP session is shared by all fetches of the worker process, connections to providers are kept alive
+session = requests.Session()
+adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=Retry(total=2, backoff_factor=0.5, status_forcelist=[502, 503, 504]))
+session.mount('http://', adapter)
+session.mount('https://', adapter)
+
+#ETag and Last-Modified of the last response of every provider, for conditional requests
+validators = {}
+validators_lock = threading.Lock()
+
+def fetch_rates(url):
+    """Fetches rates json-data of the provider
+
+    :returns: payload and validators (ETag, Last-Modified) of the response, None if data was not changed since the last fetch
+    """
+    headers = {}
+    with validators_lock:
+        etag, last_modified = validators.get(url, (None, None))
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    response = session.get(url, headers=headers, timeout=settings.FETCH_COURSES_TIMEOUT)
+    if response.status_code == 304:
+        return None
+    response.raise_for_status()
+    payload = response.json(parse_float=Decimal)
+    return payload, (response.headers.get('ETag', None), response.headers.get('Last-Modified', None))
+
+def save_validators(url, response_validators):
+    """Validators are saved only after the rates are stored, otherwise the next conditional request
+    gets 304 and rates which were not stored are never fetched again"""
+    with validators_lock:
+        validators[url] = response_validators
+
+def parse_rates(payload):
+    """Returns name of base currency, date of rates and rates {currency_name: Decimal},
+    raises ValueError if payload has unexpected format"""
+    try:
+        m = re.search(r'(\d{4})-(\d{2})-(\d{2})', payload['date'])
+        if not m:
+            raise ValueError('Date format "yyyy-mm-dd" was changed in json!')
+        dt = datetime(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+        rates = {currency_name: Decimal(str(course)) for currency_name, course in payload['rates'].items()}
+        return payload['base'], dt, rates
+    except (KeyError, TypeError, AttributeError, ArithmeticError) as e:
+        raise ValueError('Unexpected format of rates: %r' % e)
+
+def store_rates(base_currency_name, dt, rates):
+    """Saves currencies and courses by three statements:
+    bulk INSERT of currencies ignoring existing ones, SELECT of their ids
+    and INSERT ... ON CONFLICT of all courses.
+
+    :returns: names of currencies whose courses were inserted or changed
+    """
+    names = set(rates) | {base_currency_name}
+    with transaction.atomic():
+        Currency.objects.bulk_create([Currency(name=name) for name in names], ignore_conflicts=True)
+        currency_ids = dict(Currency.objects.filter(name__in=names).values_list('name', 'pk'))
+        if not rates:
+            return set()
+        base_currency_id = currency_ids[base_currency_name]
+        params = []
+        for currency_name, course in rates.items():
+            params.extend([base_currency_id, currency_ids[currency_name], dt, course])
+        sql = ('INSERT INTO {table} (base_currency_id, currency_id, date, course) VALUES {values} '
+            'ON CONFLICT (base_currency_id, currency_id, date) DO UPDATE SET course = EXCLUDED.course '
+            'WHERE {table}.course IS DISTINCT FROM EXCLUDED.course '
+            'RETURNING currency_id').format(table=Course._meta.db_table, values=', '.join(['(%s, %s, %s, %s)'] * len(rates)))
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            changed_ids = set(row[0] for row in cursor.fetchall())
+    return set(name for name, pk in currency_ids.items() if pk in changed_ids)
+
+def ingest_rates(urls):
+    """Fetches and stores rates of all providers, failure of one provider does not stop the others
+
+    :returns: names of currencies whose courses were changed
+    """
+    changed = set()
+    for url in urls:
+        try:
+            fetched = fetch_rates(url)
+            if fetched is None:
+                continue
+            payload, response_validators = fetched
+            rates = parse_rates(payload)
+        except (requests.RequestException, ValueError) as e:
+            info_logger.info('ingest_rates: %s - %s' % (url, e))
+            continue
+        changed |= store_rates(*rates)
+        save_validators(url, response_validators)
+    return changed
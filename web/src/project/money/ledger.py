@@ -0,0 +1,84 @@
+import logging
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum, Max, OuterRef, Subquery, Exists, DecimalField
+from django.db.models.functions import Coalesce
+from money.models import Account, AccountShard, LedgerEntry, BalanceCheckpoint
+from money.engine import lock_accounts
+from money.shards import lock_all_shards
+
+info_logger = logging.getLogger('info')
+
+def balance_at(account, moment):
+    """Balance of the account at the moment.
+
+    Reads the last checkpoint created before the moment and sums only ledger entries written after it.
+    Without such checkpoint, entries written after the moment are subtracted from the materialized balance.
+
+    :param account: Account object
+    :param moment: datetime
+    :returns: Decimal
+    """
+    checkpoint = BalanceCheckpoint.objects.filter(account=account, created__lte=moment).order_by('-created', '-id').first()
+    if checkpoint is not None:
+        total = LedgerEntry.objects.filter(account=account, id__gt=checkpoint.entry_id, created__lte=moment)\
+            .aggregate(total=Sum('amount'))['total']
+        return checkpoint.balance + (total or Decimal(0))
+    #balance, sub-balances and entries are read by one statement to see the same snapshot of data
+    entries_after = LedgerEntry.objects.filter(account=OuterRef('pk'), created__gt=moment)\
+        .order_by().values('account').annotate(total=Sum('amount')).values('total')
+    shards_total = AccountShard.objects.filter(account=OuterRef('pk'))\
+        .order_by().values('account').annotate(total=Sum('balance')).values('total')
+    balance, shards, total = Account.objects.filter(pk=account.pk)\
+        .annotate(shards_total=Coalesce(Subquery(shards_total, output_field=DecimalField(max_digits=18, decimal_places=4)), Decimal(0)))\
+        .annotate(entries_after=Coalesce(Subquery(entries_after, output_field=DecimalField(max_digits=18, decimal_places=4)), Decimal(0)))\
+        .values_list('balance', 'shards_total', 'entries_after').get()
+    return balance + shards - total
+
+def get_changed_accounts():
+    """Primary keys of accounts having ledger entries after their last checkpoint.
+
+    The checkpoint is taken under the lock of the account, so later entries of the account are written
+    by transactions which have locked it after the checkpoint: their ids are greater than entry_id of the checkpoint
+    and they are created after it (LEDGER_CLOCK_SKEW allows for clocks of the hosts).
+    Global maximum of entry ids is not a boundary: entry of another account with a lower id may be committed later.
+    """
+    last_checkpoint = BalanceCheckpoint.objects.filter(account=OuterRef('pk')).order_by('-created', '-id')
+    accounts = Account.objects.annotate(checkpoint_entry_id=Subquery(last_checkpoint.values('entry_id')[:1]),
+        checkpoint_created=Subquery(last_checkpoint.values('created')[:1]))
+    new_entries = LedgerEntry.objects.filter(account=OuterRef('pk'), id__gt=OuterRef('checkpoint_entry_id'),
+        created__gte=OuterRef('checkpoint_created') - timedelta(seconds=settings.LEDGER_CLOCK_SKEW))
+    changed = set(accounts.filter(checkpoint_entry_id__isnull=False).filter(Exists(new_entries)).values_list('pk', flat=True))
+    #accounts without checkpoints
+    changed.update(accounts.filter(checkpoint_entry_id__isnull=True)\
+        .filter(Exists(LedgerEntry.objects.filter(account=OuterRef('pk')))).values_list('pk', flat=True))
+    return sorted(changed)
+
+def create_checkpoints(chunk_size=500):
+    """Creates checkpoints of accounts having ledger entries after their last checkpoint.
+
+    Accounts are locked by chunks in ascending order of primary keys like transfers do,
+    so balance and the last ledger entry of the checkpoint are consistent.
+
+    :returns: count of created checkpoints
+    """
+    account_pks = get_changed_accounts()
+    created = 0
+    for i in range(0, len(account_pks), chunk_size):
+        chunk = account_pks[i:i + chunk_size]
+        with transaction.atomic():
+            accounts = lock_accounts(chunk)
+            #credits of sharded account do not lock the account, so its shards are locked too
+            #before the last entries are read
+            balances = {account.pk: account.balance + sum(shard.balance for shard in lock_all_shards(account)) if account.shards else account.balance
+                for account in accounts.values()}
+            last_entries = dict(LedgerEntry.objects.filter(account__in=chunk).order_by()\
+                .values('account').annotate(last_entry_id=Max('id')).values_list('account', 'last_entry_id'))
+            checkpoints = [BalanceCheckpoint(account_id=account_pk, balance=balances[account_pk], entry_id=last_entry_id)
+                for account_pk, last_entry_id in last_entries.items() if account_pk in balances]
+            BalanceCheckpoint.objects.bulk_create(checkpoints)
+        created += len(checkpoints)
+    info_logger.info('create_checkpoints: %s checkpoints' % created)
+    return created
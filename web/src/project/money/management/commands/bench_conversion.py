@@ -0,0 +1,50 @@
+import time
+import random
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from money.rates import RateTable
+from money.amounts import Money
+
+CURRENCIES = ['EUR', 'USD', 'RUB', 'GBP', 'JPY', 'CNY']
+
+class Command(BaseCommand):
+    help = ('Micro-benchmark of currency conversion: Decimal arithmetic quantized to balance scale '
+        'against scaled-integer Money with precomputed rational rates, with and without conversion of amounts '
+        'from and to Decimal (the transfer engine converts them once per transfer). Does not use the database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=200000, help='Count of conversions of every path')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rnd = random.Random(options['seed'])
+        table = RateTable.from_pairs({('EUR', currency): (None, Decimal(rnd.randint(1, 10 ** 6)).scaleb(-4))
+            for currency in CURRENCIES[1:]})
+        items = [(rnd.choice(CURRENCIES), rnd.choice(CURRENCIES), Decimal(rnd.randint(1, 10 ** 9)).scaleb(-4))
+            for i in range(options['count'])]
+        quantum = Decimal('0.0001')
+        money_items = [(currency_from, currency_to, Money.from_decimal(amount)) for currency_from, currency_to, amount in items]
+
+        def decimal_path():
+            for currency_from, currency_to, amount in items:
+                course_from, course_to = table.course(currency_from), table.course(currency_to)
+                (course_to / course_from * amount).quantize(quantum)
+
+        def money_path():
+            for currency_from, currency_to, amount in items:
+                table.convert_money(currency_from, currency_to, Money.from_decimal(amount)).to_decimal()
+
+        def units_path():
+            for currency_from, currency_to, amount in money_items:
+                table.convert_money(currency_from, currency_to, amount).units
+
+        #Decimal division is rounded to context precision, so results may differ in the last place
+        mismatches = sum(1 for currency_from, currency_to, amount in items
+            if (table.course(currency_to) / table.course(currency_from) * amount).quantize(quantum)
+            != table.convert_money(currency_from, currency_to, Money.from_decimal(amount)).to_decimal())
+        for name, path in (('decimal', decimal_path), ('money', money_path), ('units', units_path)):
+            started = time.perf_counter()
+            path()
+            elapsed = time.perf_counter() - started
+            self.stdout.write('%-8s %10.0f conversions/s' % (name, len(items) / elapsed))
+        self.stdout.write('results differing in the last place: %s of %s' % (mismatches, len(items)))
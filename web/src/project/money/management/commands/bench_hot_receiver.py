@@ -0,0 +1,63 @@
+import time
+import uuid
+import threading
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from money.models import Currency, Account
+from money.engine import execute_transfer
+from money.shards import enable_sharding
+from users.models import User
+
+class Command(BaseCommand):
+    help = ('Benchmark of transfer throughput to a single hot receiver with regular and sharded account. '
+        'It creates its own users and accounts, run it against a disposable database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--senders', type=int, default=16, help='Count of concurrent senders (threads)')
+        parser.add_argument('--transfers', type=int, default=200, help='Count of transfers of every sender')
+        parser.add_argument('--shards', type=int, default=16, help='Count of shards of the receiver in sharded mode')
+        parser.add_argument('--currency', default='USD', help='Currency of all accounts, it must have a course')
+
+    def handle(self, *args, **options):
+        try:
+            currency = Currency.objects.get(name=options['currency'])
+        except Currency.DoesNotExist:
+            raise CommandError('There is no currency "%s"' % options['currency'])
+        run = uuid.uuid4().hex[:8]
+        receiver = User.objects.create_user('bench-%s-receiver@bench.local' % run, uuid.uuid4().hex, username='bench-%s-receiver' % run)
+        receiver_account = Account.objects.create(user=receiver, currency=currency, balance=0)
+        senders = []
+        for i in range(options['senders']):
+            user = User.objects.create_user('bench-%s-sender%s@bench.local' % (run, i), uuid.uuid4().hex, username='bench-%s-sender%s' % (run, i))
+            senders.append((user, Account.objects.create(user=user, currency=currency, balance=Decimal(10 ** 9))))
+        for shards in (0, options['shards']):
+            enable_sharding(receiver_account.pk, shards)
+            elapsed, errors = self.run_transfers(senders, receiver_account.pk, options['transfers'])
+            count = len(senders) * options['transfers']
+            self.stdout.write('shards=%-3s transfers=%s errors=%s elapsed=%.2fs throughput=%.1f transfers/s' % (
+                shards, count, errors, elapsed, count / elapsed))
+        enable_sharding(receiver_account.pk, 0)
+
+    def run_transfers(self, senders, receiver_account_pk, transfers):
+        """Every sender makes transfers in its own thread and database connection"""
+        errors = []
+        start = threading.Barrier(len(senders) + 1)
+        def send(user, account):
+            start.wait()
+            try:
+                for _ in range(transfers):
+                    try:
+                        execute_transfer(user, account.pk, receiver_account_pk, Decimal('1.00'))
+                    except Exception as e:
+                        errors.append(e)
+            finally:
+                connection.close()
+        threads = [threading.Thread(target=send, args=sender) for sender in senders]
+        for thread in threads:
+            thread.start()
+        start.wait()
+        started = time.monotonic()
+        for thread in threads:
+            thread.join()
+        return time.monotonic() - started, len(errors)
@@ -0,0 +1,70 @@
+import time
+import threading
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+#read-heavy endpoints having async variants
+ENDPOINTS = [
+    '/api/money/currencies/',
+    '/api/money/courses/?latest=true',
+    '/api/money/transfers/',
+    '/api/users/accounts/',
+    '/api/users/',
+]
+
+class Command(BaseCommand):
+    help = ('Load test of read endpoints by concurrent HTTP clients. Run it against the sync deployment '
+        '(GUNICORN_WORKER_CLASS=sync or gthread) and against the ASGI one (uvicorn.workers.UvicornWorker) '
+        'on the same hardware with the same workers count to compare them.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help='Base URL of the service, for example http://127.0.0.1:8000')
+        parser.add_argument('--email', required=True, help='Email of the user obtaining JWT token')
+        parser.add_argument('--password', required=True, help='Password of the user')
+        parser.add_argument('--clients', type=int, default=32, help='Count of concurrent clients (threads)')
+        parser.add_argument('--duration', type=float, default=30, help='Duration of the test in seconds')
+        parser.add_argument('--endpoint', action='append', help='Path of tested endpoint, all read endpoints by default')
+
+    def handle(self, *args, **options):
+        base_url = options['url'].rstrip('/')
+        r = requests.post(base_url + '/api/token/', json={'email': options['email'], 'password': options['password']})
+        if r.status_code != 200:
+            raise CommandError('Token is not obtained: %s %s' % (r.status_code, r.text))
+        headers = {'Authorization': 'Bearer %s' % r.json()['access'], 'Accept-Encoding': 'gzip'}
+        for endpoint in options['endpoint'] or ENDPOINTS:
+            latencies, errors, elapsed = self.run_clients(base_url + endpoint, headers, options['clients'], options['duration'])
+            latencies.sort()
+            count = len(latencies)
+            if not count:
+                self.stdout.write('%-40s no successful requests, errors=%s' % (endpoint, errors))
+                continue
+            self.stdout.write('%-40s requests=%s errors=%s throughput=%.1f req/s p50=%.1fms p95=%.1fms p99=%.1fms' % (
+                endpoint, count, errors, count / elapsed,
+                latencies[count // 2] * 1000, latencies[int(count * 0.95)] * 1000, latencies[int(count * 0.99)] * 1000))
+
+    def run_clients(self, url, headers, clients, duration):
+        """Every client sends requests one by one through its own keep-alive session until the deadline"""
+        latencies = []
+        errors = [0]
+        lock = threading.Lock()
+        deadline = time.monotonic() + duration
+        def client():
+            session = requests.Session()
+            while time.monotonic() < deadline:
+                started = time.monotonic()
+                try:
+                    ok = session.get(url, headers=headers, timeout=60).status_code == 200
+                except requests.RequestException:
+                    ok = False
+                with lock:
+                    if ok:
+                        latencies.append(time.monotonic() - started)
+                    else:
+                        errors[0] += 1
+        started = time.monotonic()
+        threads = [threading.Thread(target=client) for _ in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return latencies, errors[0], time.monotonic() - started
@@ -0,0 +1,38 @@
+import sys
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from money.exports import export_stream, EXPORTS, OUTPUTS
+
+def parse_date_option(value):
+    if value is None:
+        return None
+    parsed = parse_date(value)
+    if parsed is None:
+        raise CommandError('Bad date %s' % value)
+    return datetime(parsed.year, parsed.month, parsed.day)
+
+class Command(BaseCommand):
+    help = 'Exports all accounts or transfers as CSV or NDJSON with constant memory usage, rows are sorted by id'
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=sorted(EXPORTS))
+        parser.add_argument('--output', choices=sorted(OUTPUTS), default='csv')
+        parser.add_argument('--gzip', action='store_true', help='Compress the export by gzip')
+        parser.add_argument('--date-from', help='Rows created on this date yyyy-mm-dd and later')
+        parser.add_argument('--date-to', help='Rows created before this date yyyy-mm-dd')
+        parser.add_argument('--after', type=int, help='Id of the last exported row, resumes interrupted export')
+        parser.add_argument('--file', help='Output file, stdout by default')
+
+    def handle(self, *args, **options):
+        body, _ = export_stream(options['name'], options['output'], compress=options['gzip'],
+            date_from=parse_date_option(options['date_from']), date_to=parse_date_option(options['date_to']), after=options['after'])
+        out = open(options['file'], 'wb') if options['file'] else sys.stdout.buffer
+        try:
+            for chunk in body:
+                out.write(chunk if options['gzip'] else chunk.encode())
+        finally:
+            if options['file']:
+                out.close()
+            else:
+                out.flush()
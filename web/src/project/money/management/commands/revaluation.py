@@ -0,0 +1,33 @@
+import time
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from money.revaluation import revaluation
+
+class Command(BaseCommand):
+    help = 'Holdings of all accounts revalued into the reporting currency, totals per currency and overall with elapsed time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--currency', default='EUR', help='Reporting currency')
+        parser.add_argument('--date', help='Date of historical courses yyyy-mm-dd, the current rates by default')
+        parser.add_argument('--users', action='store_true', help='Compute totals per user too')
+
+    def handle(self, *args, **options):
+        date = None
+        if options['date']:
+            parsed = parse_date(options['date'])
+            if parsed is None:
+                raise CommandError('Bad date %s' % options['date'])
+            date = datetime(parsed.year, parsed.month, parsed.day)
+        started = time.perf_counter()
+        try:
+            data = revaluation(options['currency'], date=date, by_user=options['users'])
+        except Exception as e:
+            raise CommandError(str(e))
+        elapsed = time.perf_counter() - started
+        for name, totals in sorted(data['currencies'].items()):
+            self.stdout.write('%-6s %10s accounts %22s %22s %s' % (name, totals['accounts'], totals['balance'], totals['converted'], data['currency']))
+        self.stdout.write('total %s %s' % (data['total'], data['currency']))
+        if options['users']:
+            self.stdout.write('users %s' % len(data['users']))
+        self.stdout.write('elapsed %.3f s' % elapsed)
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+from money.models import Account
+from money.shards import enable_sharding
+
+class Command(BaseCommand):
+    help = 'Splits balance of the hot account into N sub-balances (sharded mode), N = 0 turns sharded mode off'
+
+    def add_arguments(self, parser):
+        parser.add_argument('account', type=int, help='Primary key of the account')
+        parser.add_argument('shards', type=int, help='Count of sub-balances')
+
+    def handle(self, *args, **options):
+        if options['shards'] < 0:
+            raise CommandError('Count of shards must not be negative')
+        if not Account.objects.filter(pk=options['account']).exists():
+            raise CommandError('There is no account with id = %s' % options['account'])
+        enable_sharding(options['account'], options['shards'])
+        self.stdout.write('Account %s has %s shards' % (options['account'], options['shards']))
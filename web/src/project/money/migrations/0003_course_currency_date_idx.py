@@ -0,0 +1,17 @@
+# Generated by Django 2.2.7 on 2020-03-02 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('money', '0002_auto_20200215_1458'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['currency', 'date'], name='money_course_currency_date_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.7 on 2020-03-05 09:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('money', '0003_course_currency_date_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transfer',
+            index=models.Index(fields=['sender_account', 'created', 'id'], name='money_transfer_sender_created'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.7 on 2020-03-06 16:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('money', '0004_transfer_sender_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transfer',
+            index=models.Index(fields=['receiver_account', 'created', 'id'], name='money_transfer_recv_created'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 2.2.7 on 2020-03-19 10:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('money', '0006_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='shards',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='AccountShard',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveSmallIntegerField()),
+                ('balance', models.DecimalField(decimal_places=4, default=0, max_digits=18)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shard_balances', to='money.Account')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='accountshard',
+            constraint=models.UniqueConstraint(fields=('account', 'index'), name='unique_account_and_shard_index'),
+        ),
+    ]
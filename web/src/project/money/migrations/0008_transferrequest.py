@@ -0,0 +1,36 @@
+# Generated by Django 2.2.7 on 2020-03-26 15:48
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('money', '0007_account_shards'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransferRequest',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('idempotency_key', models.CharField(max_length=64)),
+                ('sender_account_pk', models.IntegerField()),
+                ('receiver_account_pk', models.IntegerField()),
+                ('amount', models.DecimalField(decimal_places=4, max_digits=18)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=16)),
+                ('error', models.CharField(blank=True, default='', max_length=255)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='transfer_requests', to=settings.AUTH_USER_MODEL)),
+                ('transfer', models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='money.Transfer')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='transferrequest',
+            constraint=models.UniqueConstraint(fields=('owner', 'idempotency_key'), name='unique_owner_and_idempotency_key'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 2.2.7 on 2020-04-02 12:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('money', '0008_transferrequest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transfer',
+            name='idempotency_key',
+            field=models.CharField(max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='transfer',
+            constraint=models.UniqueConstraint(fields=('sender_account', 'idempotency_key'), name='unique_sender_account_and_idempotency_key'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.7 on 2020-04-06 10:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('money', '0009_transfer_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['date', 'id'], name='money_course_date_idx'),
+        ),
+    ]
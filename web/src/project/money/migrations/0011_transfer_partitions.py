@@ -0,0 +1,138 @@
+# Generated by Django 3.1.7 on 2020-04-09 11:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+#money_transfer is rebuilt as a table partitioned by month of "created", it needs PostgreSQL 12:
+#primary key and indexes of partitioned table include the partition key, rows out of the monthly partitions
+#go to the default partition. money.partitions creates partitions of the next months and detaches old ones.
+#Idempotency keys are copied to TransferKey before, the partitioned table has no idempotency_key column.
+PARTITION_TRANSFERS = [
+    'ALTER TABLE money_transfer RENAME TO money_transfer_old',
+    '''CREATE TABLE money_transfer (
+        id integer NOT NULL DEFAULT nextval('money_transfer_id_seq'::regclass),
+        amount numeric(18, 4) NOT NULL,
+        created timestamp with time zone NOT NULL,
+        receiver_account_id integer NOT NULL,
+        sender_account_id integer NOT NULL
+    ) PARTITION BY RANGE (created)''',
+    'ALTER SEQUENCE money_transfer_id_seq OWNED BY money_transfer.id',
+    'CREATE TABLE money_transfer_default PARTITION OF money_transfer DEFAULT',
+    '''DO $$
+    DECLARE
+        month timestamp with time zone := date_trunc('month', LEAST(COALESCE((SELECT min(created) FROM money_transfer_old), now()), now()));
+    BEGIN
+        WHILE month < date_trunc('month', now()) + interval '4 months' LOOP
+            EXECUTE format('CREATE TABLE %I PARTITION OF money_transfer FOR VALUES FROM (%L) TO (%L)',
+                'money_transfer_' || to_char(month, 'YYYY_MM'), month, month + interval '1 month');
+            month := month + interval '1 month';
+        END LOOP;
+    END $$''',
+    '''INSERT INTO money_transfer (id, amount, created, receiver_account_id, sender_account_id)
+        SELECT id, amount, created, receiver_account_id, sender_account_id FROM money_transfer_old''',
+    'DROP TABLE money_transfer_old',
+    #indexes are built after the copy, they are created on every partition
+    'ALTER TABLE money_transfer ADD CONSTRAINT money_transfer_pkey PRIMARY KEY (id, created)',
+    'CREATE INDEX money_transfer_sender_created ON money_transfer (sender_account_id, created, id)',
+    'CREATE INDEX money_transfer_recv_created ON money_transfer (receiver_account_id, created, id)',
+    '''ALTER TABLE money_transfer ADD CONSTRAINT money_transfer_sender_account_id_fk_money_account_id
+        FOREIGN KEY (sender_account_id) REFERENCES money_account (id) DEFERRABLE INITIALLY DEFERRED''',
+    '''ALTER TABLE money_transfer ADD CONSTRAINT money_transfer_receiver_account_id_fk_money_account_id
+        FOREIGN KEY (receiver_account_id) REFERENCES money_account (id) DEFERRABLE INITIALLY DEFERRED''',
+]
+
+#rows of detached partitions are not returned to the table, idempotency keys are restored from TransferKey
+UNPARTITION_TRANSFERS = [
+    '''CREATE TABLE money_transfer_plain (
+        id integer NOT NULL DEFAULT nextval('money_transfer_id_seq'::regclass),
+        amount numeric(18, 4) NOT NULL,
+        created timestamp with time zone NOT NULL,
+        receiver_account_id integer NOT NULL,
+        sender_account_id integer NOT NULL,
+        idempotency_key varchar(64) NULL
+    )''',
+    '''INSERT INTO money_transfer_plain (id, amount, created, receiver_account_id, sender_account_id, idempotency_key)
+        SELECT t.id, t.amount, t.created, t.receiver_account_id, t.sender_account_id, k.idempotency_key FROM money_transfer t
+        LEFT JOIN money_transferkey k ON k.transfer_id = t.id''',
+    'ALTER SEQUENCE money_transfer_id_seq OWNED BY money_transfer_plain.id',
+    'DROP TABLE money_transfer',
+    'ALTER TABLE money_transfer_plain RENAME TO money_transfer',
+    'ALTER TABLE money_transfer ADD CONSTRAINT money_transfer_pkey PRIMARY KEY (id)',
+    'CREATE INDEX money_transfer_sender_created ON money_transfer (sender_account_id, created, id)',
+    'CREATE INDEX money_transfer_recv_created ON money_transfer (receiver_account_id, created, id)',
+    'CREATE INDEX money_trans_sender__79e09e_idx ON money_transfer (sender_account_id)',
+    'CREATE INDEX money_transfer_receiver_account_id_idx ON money_transfer (receiver_account_id)',
+    '''ALTER TABLE money_transfer ADD CONSTRAINT money_transfer_sender_account_id_fk_money_account_id
+        FOREIGN KEY (sender_account_id) REFERENCES money_account (id) DEFERRABLE INITIALLY DEFERRED''',
+    '''ALTER TABLE money_transfer ADD CONSTRAINT money_transfer_receiver_account_id_fk_money_account_id
+        FOREIGN KEY (receiver_account_id) REFERENCES money_account (id) DEFERRABLE INITIALLY DEFERRED''',
+]
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('money', '0010_course_date_idx'),
+    ]
+
+    operations = [
+        #unique constraint of partitioned table must include "created", keys move to TransferKey
+        migrations.CreateModel(
+            name='TransferKey',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('idempotency_key', models.CharField(max_length=64)),
+                ('transfer_created', models.DateTimeField()),
+                ('sender_account', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='money.Account')),
+                ('transfer', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='money.Transfer')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='transferkey',
+            constraint=models.UniqueConstraint(fields=('sender_account', 'idempotency_key'), name='unique_transfer_key_sender_account'),
+        ),
+        migrations.RunSQL(
+            '''INSERT INTO money_transferkey (sender_account_id, idempotency_key, transfer_id, transfer_created)
+                SELECT sender_account_id, idempotency_key, id, created FROM money_transfer WHERE idempotency_key IS NOT NULL''',
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.RemoveConstraint(
+            model_name='transfer',
+            name='unique_sender_account_and_idempotency_key',
+        ),
+        #foreign keys can not reference partitioned table by id only
+        migrations.AlterField(
+            model_name='ledgerentry',
+            name='transfer',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='ledger_entries', to='money.Transfer'),
+        ),
+        migrations.AlterField(
+            model_name='transferrequest',
+            name='transfer',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='money.Transfer'),
+        ),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(PARTITION_TRANSFERS, reverse_sql=UNPARTITION_TRANSFERS),
+            ],
+            state_operations=[
+                migrations.RemoveField(
+                    model_name='transfer',
+                    name='idempotency_key',
+                ),
+                migrations.RemoveIndex(
+                    model_name='transfer',
+                    name='money_trans_sender__79e09e_idx',
+                ),
+                migrations.AlterField(
+                    model_name='transfer',
+                    name='sender_account',
+                    field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='sender_account', to='money.Account'),
+                ),
+                migrations.AlterField(
+                    model_name='transfer',
+                    name='receiver_account',
+                    field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='receiver_account', to='money.Account'),
+                ),
+            ],
+        ),
+    ]
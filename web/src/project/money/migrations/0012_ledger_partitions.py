@@ -0,0 +1,77 @@
+# Generated by Django 3.1.7 on 2020-04-10 09:45
+
+from django.db import migrations, models
+
+#money_ledgerentry is partitioned by month of "created" like money_transfer, entries have the date of their transfer,
+#so partitions of the same month are detached together (money.partitions). Partitions of the ledger are created
+#for the months of the attached partitions of transfers.
+PARTITION_LEDGER = [
+    'ALTER TABLE money_ledgerentry RENAME TO money_ledgerentry_old',
+    '''CREATE TABLE money_ledgerentry (
+        id integer NOT NULL DEFAULT nextval('money_ledgerentry_id_seq'::regclass),
+        amount numeric(18, 4) NOT NULL,
+        rate numeric(30, 12) NOT NULL,
+        created timestamp with time zone NOT NULL,
+        account_id integer NOT NULL,
+        transfer_id integer NULL
+    ) PARTITION BY RANGE (created)''',
+    'ALTER SEQUENCE money_ledgerentry_id_seq OWNED BY money_ledgerentry.id',
+    'CREATE TABLE money_ledgerentry_default PARTITION OF money_ledgerentry DEFAULT',
+    r'''DO $$
+    DECLARE
+        month timestamp with time zone;
+    BEGIN
+        FOR month IN SELECT to_timestamp(substring(c.relname from 16), 'YYYY_MM') FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'money_transfer'::regclass AND c.relname ~ '^money_transfer_\d{4}_\d{2}$' LOOP
+            EXECUTE format('CREATE TABLE %I PARTITION OF money_ledgerentry FOR VALUES FROM (%L) TO (%L)',
+                'money_ledgerentry_' || to_char(month, 'YYYY_MM'), month, month + interval '1 month');
+        END LOOP;
+    END $$''',
+    '''INSERT INTO money_ledgerentry (id, amount, rate, created, account_id, transfer_id)
+        SELECT id, amount, rate, created, account_id, transfer_id FROM money_ledgerentry_old''',
+    'DROP TABLE money_ledgerentry_old',
+    'ALTER TABLE money_ledgerentry ADD CONSTRAINT money_ledgerentry_pkey PRIMARY KEY (id, created)',
+    'CREATE INDEX money_ledger_account_created ON money_ledgerentry (account_id, created, id)',
+    'CREATE INDEX money_ledgerentry_account_id_9fca7549 ON money_ledgerentry (account_id)',
+    'CREATE INDEX money_ledgerentry_transfer_id_dcd12fc8 ON money_ledgerentry (transfer_id)',
+    '''ALTER TABLE money_ledgerentry ADD CONSTRAINT money_ledgerentry_account_id_9fca7549_fk_money_account_id
+        FOREIGN KEY (account_id) REFERENCES money_account (id) DEFERRABLE INITIALLY DEFERRED''',
+]
+
+#entries of detached partitions are not returned to the table
+UNPARTITION_LEDGER = [
+    '''CREATE TABLE money_ledgerentry_plain (
+        id integer NOT NULL DEFAULT nextval('money_ledgerentry_id_seq'::regclass),
+        amount numeric(18, 4) NOT NULL,
+        rate numeric(30, 12) NOT NULL,
+        created timestamp with time zone NOT NULL,
+        account_id integer NOT NULL,
+        transfer_id integer NULL
+    )''',
+    '''INSERT INTO money_ledgerentry_plain (id, amount, rate, created, account_id, transfer_id)
+        SELECT id, amount, rate, created, account_id, transfer_id FROM money_ledgerentry''',
+    'ALTER SEQUENCE money_ledgerentry_id_seq OWNED BY money_ledgerentry_plain.id',
+    'DROP TABLE money_ledgerentry',
+    'ALTER TABLE money_ledgerentry_plain RENAME TO money_ledgerentry',
+    'ALTER TABLE money_ledgerentry ADD CONSTRAINT money_ledgerentry_pkey PRIMARY KEY (id)',
+    'CREATE INDEX money_ledger_account_created ON money_ledgerentry (account_id, created, id)',
+    'CREATE INDEX money_ledgerentry_account_id_9fca7549 ON money_ledgerentry (account_id)',
+    'CREATE INDEX money_ledgerentry_transfer_id_dcd12fc8 ON money_ledgerentry (transfer_id)',
+    '''ALTER TABLE money_ledgerentry ADD CONSTRAINT money_ledgerentry_account_id_9fca7549_fk_money_account_id
+        FOREIGN KEY (account_id) REFERENCES money_account (id) DEFERRABLE INITIALLY DEFERRED''',
+]
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('money', '0011_transfer_partitions'),
+    ]
+
+    operations = [
+        migrations.RunSQL(PARTITION_LEDGER, reverse_sql=UNPARTITION_LEDGER),
+        #keys of the month are archived together with its partitions
+        migrations.AddIndex(
+            model_name='transferkey',
+            index=models.Index(fields=['transfer_created'], name='money_transferkey_created'),
+        ),
+    ]
@@ -1,7 +1,7 @@
 from datetime import datetime
 from decimal import Decimal
 from django.db import models
-from django.db.models import Q
+from django.db.models import Sum
 from users.models import User
 
 class Currency(models.Model):
@@ -13,6 +13,12 @@ class Course(models.Model):
     """Exchange rate course"""
     class Meta:
         constraints = [models.UniqueConstraint(fields=['base_currency', 'currency', 'date'], name='unique__base_currency__currency___date')]
+        #as-of lookups "the latest course of the currency before date"
+        indexes = [
+            models.Index(fields=['currency', 'date'], name='money_course_currency_date_idx'),
+            #keyset pagination of course list in order (-date, -pk)
+            models.Index(fields=['date', 'id'], name='money_course_date_idx'),
+        ]
     currency = models.ForeignKey(Currency, related_name='currency', null=False, on_delete = models.CASCADE)  
     base_currency = models.ForeignKey(Currency, related_name='base_currency', null=False, on_delete = models.CASCADE)  
     course = models.DecimalField(max_digits=18, decimal_places=4, null=False)
@@ -31,10 +37,32 @@ class Account(models.Model):
     currency = models.ForeignKey(Currency, null=False, on_delete=models.PROTECT)
     balance = models.DecimalField(max_digits=18, decimal_places=4, null=False, default=0)
     created = models.DateTimeField(auto_now_add=True)
+    #count of sub-balances of the sharded account, 0 for regular accounts
+    shards = models.PositiveSmallIntegerField(null=False, default=0)
     @classmethod
     def create(cls, user, currency, balance):
         account = cls(user=user, currency=currency, balance=balance)
         return account
+    @property
+    def total_balance(self):
+        """Balance of the account including sub-balances of sharded account"""
+        if not self.shards:
+            return self.balance
+        #list views prefetch shards of all accounts by one query
+        if 'shard_balances' in getattr(self, '_prefetched_objects_cache', {}):
+            return self.balance + sum(shard.balance for shard in self.shard_balances.all())
+        return self.balance + (self.shard_balances.aggregate(total=Sum('balance'))['total'] or 0)
+
+class AccountShard(models.Model):
+    """Sub-balance of the sharded account.
+    Credits of the sharded account go to random shard instead of the row of the account,
+    so concurrent transfers to the hot account do not wait for each other.
+    """
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['account', 'index'], name='unique_account_and_shard_index')]
+    account = models.ForeignKey(Account, related_name='shard_balances', null=False, on_delete=models.CASCADE)
+    index = models.PositiveSmallIntegerField(null=False)
+    balance = models.DecimalField(max_digits=18, decimal_places=4, null=False, default=0)
 
 class Transfer(models.Model):
     """Transfer entity is described by 4 fields: 
@@ -45,11 +73,19 @@ class Transfer(models.Model):
     
     The currency of transfer is a currency of sender's account.
     Date of transfer is fullfilled in run-time by current datetime value.
+    Table is partitioned by month of "created" (migration 0011, money.partitions), primary key of the table is (id, created),
+    so queries filtered by "created" read only partitions of their dates.
     """
     class Meta:
-        indexes = [models.Index(fields=['sender_account', ])]
-    sender_account = models.ForeignKey(Account, related_name='sender_account', null=False, on_delete=models.PROTECT)
-    receiver_account = models.ForeignKey(Account, related_name='receiver_account', null=False, on_delete=models.PROTECT)
+        indexes = [
+            #keyset pagination of sender's transfers in order (-created, -pk)
+            models.Index(fields=['sender_account', 'created', 'id'], name='money_transfer_sender_created'),
+            #account statements, incoming transfers
+            models.Index(fields=['receiver_account', 'created', 'id'], name='money_transfer_recv_created'),
+        ]
+    #accounts are the leading columns of the indexes above, separate indexes are not needed
+    sender_account = models.ForeignKey(Account, related_name='sender_account', null=False, on_delete=models.PROTECT, db_index=False)
+    receiver_account = models.ForeignKey(Account, related_name='receiver_account', null=False, on_delete=models.PROTECT, db_index=False)
     amount = models.DecimalField(max_digits=18, decimal_places=4, null=False)
     created = models.DateTimeField(auto_now_add=True)
     @classmethod
@@ -57,41 +93,111 @@ class Transfer(models.Model):
         transfer = cls(sender_account=sender_acc, receiver_account=receiver_acc, amount=amount)
         return transfer
 
-def convert_amount(currency_from: Currency, currency_to: Currency, amount: Decimal, date=datetime.now()) -> Decimal:
+class TransferKey(models.Model):
+    """Idempotency-Key of the transfer, retries of the client with the same key can not move money twice.
+    Unique constraint of partitioned Transfer table would have to include "created", so keys are kept in this table.
+    """
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['sender_account', 'idempotency_key'], name='unique_transfer_key_sender_account')]
+        #keys of the month are archived with its partitions
+        indexes = [models.Index(fields=['transfer_created'], name='money_transferkey_created')]
+    sender_account = models.ForeignKey(Account, related_name='+', null=False, on_delete=models.PROTECT)
+    idempotency_key = models.CharField(max_length=64, null=False)
+    #foreign keys can not reference partitioned table by id only
+    transfer = models.ForeignKey(Transfer, related_name='+', null=False, on_delete=models.PROTECT, db_constraint=False)
+    #date of the transfer, its partition
+    transfer_created = models.DateTimeField(null=False)
+
+class LedgerEntry(models.Model):
+    """Immutable record of the change of account's balance.
+
+    Every transfer writes two entries: debit of sender's account in sender's currency
+    and credit of receiver's account in receiver's currency with the rate used.
+    Entries are never updated or deleted. Table is partitioned by month of "created" like Transfer (migration 0012),
+    entries of the month are detached together with its transfers.
+    """
+    class Meta:
+        indexes = [models.Index(fields=['account', 'created', 'id'], name='money_ledger_account_created')]
+    account = models.ForeignKey(Account, related_name='ledger_entries', null=False, on_delete=models.PROTECT)
+    transfer = models.ForeignKey(Transfer, related_name='ledger_entries', null=True, on_delete=models.PROTECT, db_constraint=False)
+    #positive for credit, negative for debit
+    amount = models.DecimalField(max_digits=18, decimal_places=4, null=False)
+    #rate of convertation from sender's currency to receiver's currency
+    rate = models.DecimalField(max_digits=30, decimal_places=12, null=False, default=1)
+    created = models.DateTimeField()
+
+class BalanceCheckpoint(models.Model):
+    """Balance of the account including all ledger entries up to entry_id"""
+    class Meta:
+        indexes = [models.Index(fields=['account', 'created'], name='money_checkpoint_account_date')]
+    account = models.ForeignKey(Account, related_name='checkpoints', null=False, on_delete=models.PROTECT)
+    balance = models.DecimalField(max_digits=18, decimal_places=4, null=False)
+    entry_id = models.BigIntegerField(null=False)
+    created = models.DateTimeField(auto_now_add=True)
+
+class TransferRequest(models.Model):
+    """Transfer submitted for asynchronous execution by Celery worker.
+    Client gets primary key of the request right away and polls its status.
+    """
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (DONE, 'Done'), (FAILED, 'Failed')]
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['owner', 'idempotency_key'], name='unique_owner_and_idempotency_key')]
+    owner = models.ForeignKey(User, related_name='transfer_requests', null=False, on_delete=models.PROTECT)
+    idempotency_key = models.CharField(max_length=64, null=False)
+    sender_account_pk = models.IntegerField(null=False)
+    receiver_account_pk = models.IntegerField(null=False)
+    amount = models.DecimalField(max_digits=18, decimal_places=4, null=False)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, null=False, default=PENDING)
+    error = models.CharField(max_length=255, null=False, blank=True, default='')
+    transfer = models.ForeignKey(Transfer, related_name='+', null=True, on_delete=models.PROTECT, db_constraint=False)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+def convert_amount(currency_from: Currency, currency_to: Currency, amount: Decimal, date=None) -> Decimal:
     """Function for convertation money from one currency to anoter using rates of courses from database
     
     :param currency_from: source currency may be of types str of Currency model
     :param currency_to: destination currency may be of types str of Currency model
     :param amount: amount of money of currency_from
-    :param date: date of courses
+    :param date: date of courses, the latest courses are taken from in-memory rate table if date is omitted
     :returns: converted amount
     """
-    if isinstance(currency_from, Currency):
-        course_list_from = Course.objects.filter(Q(currency=currency_from)&Q(date__lt=date)).order_by('-date')
-    elif isinstance(currency_from, str):
-        course_list_from = Course.objects.filter(Q(currency__name=currency_from)&Q(date__lt=date)).order_by('-date')
-    if course_list_from:
-        course_from = course_list_from[0].course
-    else:
-        course_list_from = Course.objects.filter(Q(base_currency__name=currency_from)&Q(date__lt=date)).order_by('-date')
-        if course_list_from:
-            course_from = 1
-        else:
-            raise Exception('There is no course for the currency %s on date %s' % (currency_from, date))
-    if isinstance(currency_to, Currency):
-        course_list_to = Course.objects.filter(Q(currency=currency_to)&Q(date__lt=date)).order_by('-date')
-    elif isinstance(currency_to, str):
-        course_list_to = Course.objects.filter(Q(currency__name=currency_to)&Q(date__lt=date)).order_by('-date')
-    if course_list_to:
-        course_to = course_list_to[0].course
-    else:
-        course_list_to = Course.objects.filter(Q(base_currency=currency_to)&Q(date__lt=date)).order_by('-date')
-        if course_list_to:
-            course_to = 1
-        else:
-            raise Exception('There is no course for the currency %s on date %s' % (currency_to, date))
-    return (course_from, course_to, course_to/course_from * Decimal(amount))
-
-
+    if date is None:
+        from money.rates import get_rate_table
+        return get_rate_table().convert(currency_from, currency_to, amount)
+    #both courses are taken against the base of the latest course of currency_from
+    course_from = course_on_date(currency_from, date)
+    if course_from is None:
+        raise Exception('There is no course for the currency %s on date %s' % (currency_from, date))
+    course_to = course_on_date(currency_to, date, base_currency=course_from[1])
+    if course_to is None:
+        #currencies quoted by providers with different bases are converted by courses normalised to one base
+        from money.rates import RateTimeline
+        names = {getattr(currency_from, 'name', currency_from), getattr(currency_to, 'name', currency_to)}
+        return RateTimeline.load(names, until=date).convert(currency_from, currency_to, amount, date)
+    return (course_from[0], course_to[0], course_to[0]/course_from[0] * Decimal(amount))
 
+def course_on_date(currency, date, base_currency=None):
+    """The latest course of the currency against base_currency strictly before date, the base currency has course 1.
+    Without base_currency the base of the latest course of the currency is taken.
+    Lookup is one index range scan over (currency, date) with LIMIT 1.
 
+    :returns: tuple (course, base currency name) or None if there is no such course
+    """
+    name = getattr(currency, 'name', currency)
+    base_name = getattr(base_currency, 'name', base_currency)
+    if name != base_name:
+        course_list = Course.objects.filter(currency__name=name, date__lt=date)
+        if base_name is not None:
+            course_list = course_list.filter(base_currency__name=base_name)
+        course = course_list.order_by('-date').values_list('course', 'base_currency__name').first()
+        if course is not None:
+            return course
+        if base_name is not None:
+            return None
+    if Course.objects.filter(base_currency__name=name, date__lt=date).exists():
+        return (Decimal(1), name)
+    return None
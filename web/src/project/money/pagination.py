@@ -0,0 +1,74 @@
+import json
+import base64
+from datetime import datetime
+from django.db.models import Q
+from rest_framework.utils.encoders import JSONEncoder
+
+def encode_cursor(created, pk):
+    """Cursor is opaque for clients, it keeps position (created, pk) of the last row of the page"""
+    return base64.urlsafe_b64encode(('%s|%s' % (created.isoformat(), pk)).encode()).decode()
+
+def decode_cursor(cursor):
+    """Returns position (created, pk) kept in the cursor, raises ValueError for bad cursors"""
+    try:
+        created, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(created), int(pk)
+    except (TypeError, UnicodeError, ValueError):
+        raise ValueError('Bad cursor value')
+
+def after_cursor(queryset, cursor, field='created'):
+    """Filters rows following the cursor position in order (-field, -pk).
+    Redundant condition field <= value makes it a range condition of the index.
+    """
+    if not cursor:
+        return queryset
+    created, pk = decode_cursor(cursor)
+    return queryset.filter(Q(**{field + '__lte': created}) & (Q(**{field + '__lt': created}) | Q(pk__lt=pk)))
+
+def keyset_page(queryset, cursor, limit, field='created'):
+    """Returns one page of rows in order (-field, -pk) and cursor of the next page (None for the last page).
+    Page is found by index range scan, so its cost does not depend on the depth of the page.
+    """
+    rows = list(after_cursor(queryset, cursor, field).order_by('-' + field, '-pk')[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(getattr(rows[-1], field), rows[-1].pk)
+    return rows, next_cursor
+
+def iterate_keyset(queryset, chunk_size, field='created'):
+    """Iterates all rows in order (-field, -pk) by keyset pages of chunk_size rows.
+    Used instead of server-side cursor, which is not available through PgBouncer in transaction mode.
+    """
+    cursor = None
+    while True:
+        rows, cursor = keyset_page(queryset, cursor, chunk_size, field)
+        yield from rows
+        if cursor is None:
+            return
+
+def get_page_size(request, default, maximum):
+    """Page size from query parameter "limit" """
+    try:
+        limit = int(request.query_params.get('limit', default))
+    except ValueError:
+        raise ValueError('Bad limit value')
+    if limit <= 0:
+        raise ValueError('Bad limit value')
+    return min(limit, maximum)
+
+def stream_ndjson(rows, serialize):
+    """Generator of NDJSON lines for StreamingHttpResponse"""
+    encoder = JSONEncoder()
+    for row in rows:
+        yield encoder.encode(serialize(row)) + '\n'
+
+def stream_json_array(rows, serialize):
+    """Generator of JSON array chunks for StreamingHttpResponse"""
+    encoder = JSONEncoder()
+    yield '['
+    separator = ''
+    for row in rows:
+        yield separator + encoder.encode(serialize(row))
+        separator = ','
+    yield ']'
@@ -0,0 +1,21 @@
+import json
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+class NDJSONParser(BaseParser):
+    """Parses newline delimited JSON, one object per line, into list of objects"""
+    media_type = 'application/x-ndjson'
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        data = []
+        for line_number, line in enumerate(stream, start=1):
+            line = line.decode(encoding).strip()
+            if not line:
+                continue
+            try:
+                data.append(json.loads(line))
+            except ValueError as e:
+                raise ParseError('NDJSON parse error in line %s - %s' % (line_number, e))
+        return data
@@ -0,0 +1,100 @@
+import re
+import logging
+from datetime import datetime
+from django.conf import settings
+from django.db import connection, transaction
+from money.models import Transfer, TransferKey, LedgerEntry, TransferRequest
+from money.ledger import create_checkpoints
+
+info_logger = logging.getLogger('info')
+
+#tables partitioned by month of "created", ledger entries have the date of their transfer
+PARTITIONED_MODELS = [Transfer, LedgerEntry]
+
+#monthly partitions are named money_transfer_yyyy_mm, bounds are months in TIME_ZONE of the database connection
+PARTITION_NAME = re.compile(r'^%s_(\d{4})_(\d{2})$' % Transfer._meta.db_table)
+
+def add_months(month, count):
+    """The first day of the month count months after month"""
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1)
+
+def partition_name(month, model=Transfer):
+    return '%s_%04d_%02d' % (model._meta.db_table, month.year, month.month)
+
+def get_partitions():
+    """Monthly partitions attached to the transfer table {name: the first day of the month}"""
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+            'WHERE i.inhparent = %s::regclass', [Transfer._meta.db_table])
+        names = [row[0] for row in cursor.fetchall()]
+    partitions = {}
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            partitions[name] = datetime(int(match.group(1)), int(match.group(2)), 1)
+    return partitions
+
+def create_partition(month):
+    """Creates partitions of the month of transfers and ledger entries.
+    Rows of the month written to the default partitions meanwhile are moved to the new partitions before they are attached.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        for model in PARTITIONED_MODELS:
+            name, table = partition_name(month, model), model._meta.db_table
+            #rows of the month written to the default partition meanwhile would be left there and fail ATTACH
+            cursor.execute('LOCK TABLE {table}_default IN ACCESS EXCLUSIVE MODE'.format(table=table))
+            cursor.execute('CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'.format(name=name, table=table))
+            cursor.execute('WITH moved AS (DELETE FROM {table}_default WHERE created >= %s AND created < %s RETURNING *) '
+                'INSERT INTO {name} SELECT * FROM moved'.format(name=name, table=table), [month, add_months(month, 1)])
+            #indexes of the table are created on the partition when it is attached
+            cursor.execute('ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)'.format(name=name, table=table),
+                [month, add_months(month, 1)])
+
+def archive_rows(cursor, model, month, condition, params):
+    """Moves rows of the model matching condition to the standalone table named like partitions of the month"""
+    name, table = partition_name(month, model), model._meta.db_table
+    cursor.execute('CREATE TABLE {name} (LIKE {table})'.format(name=name, table=table))
+    cursor.execute('WITH moved AS (DELETE FROM {table} r WHERE {condition} RETURNING r.*) '
+        'INSERT INTO {name} SELECT * FROM moved'.format(name=name, table=table, condition=condition), params)
+
+def detach_partition(month):
+    """Detaches partitions of the month from transfer and ledger tables, they stay in the database as standalone tables
+    for archiving. Idempotency keys and asynchronous requests of the month's transfers are moved to standalone tables
+    of the month too, so no rows are left referencing the detached transfers.
+    Balances before the month are not available afterwards, checkpoints of later balances must already exist.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        archive_rows(cursor, TransferKey, month, 'transfer_created >= %s AND transfer_created < %s', [month, add_months(month, 1)])
+        #requests are created before their transfers, so they are matched by the transfers of the partition
+        archive_rows(cursor, TransferRequest, month, 'r.transfer_id IN (SELECT id FROM {name})'.format(name=partition_name(month)), [])
+        for model in PARTITIONED_MODELS:
+            cursor.execute('ALTER TABLE {table} DETACH PARTITION {name}'.format(table=model._meta.db_table, name=partition_name(month, model)))
+
+def manage_partitions(now=None):
+    """Creates partitions of the current month and TRANSFER_PARTITIONS_AHEAD next months,
+    detaches partitions older than TRANSFER_PARTITIONS_KEEP_MONTHS months (0 keeps all partitions).
+    Checkpoints of balances are created before, balance_at of later moments does not need the detached entries.
+
+    :returns: names of created and detached partitions of the transfer table
+    """
+    now = now or datetime.now()
+    current = datetime(now.year, now.month, 1)
+    partitions = get_partitions()
+    created = []
+    for i in range(settings.TRANSFER_PARTITIONS_AHEAD + 1):
+        month = add_months(current, i)
+        if partition_name(month) not in partitions:
+            create_partition(month)
+            created.append(partition_name(month))
+    detached = []
+    if settings.TRANSFER_PARTITIONS_KEEP_MONTHS:
+        oldest = add_months(current, -settings.TRANSFER_PARTITIONS_KEEP_MONTHS)
+        old = [(name, month) for name, month in sorted(partitions.items()) if month < oldest]
+        if old:
+            create_checkpoints()
+        for name, month in old:
+            detach_partition(month)
+            detached.append(name)
+    info_logger.info('manage_partitions: created %s, detached %s' % (created, detached))
+    return created, detached
@@ -0,0 +1,74 @@
+import logging
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from redis import RedisError
+from money.models import TransferRequest
+from money.engine import execute_transfer, TransferError
+from project.celery import app
+from project.redis import get_redis
+from users.models import User
+
+info_logger = logging.getLogger('info')
+
+def transfer_queue(sender_account_pk):
+    """Celery queue of transfers of the sender's account.
+    Every queue is consumed by one worker process, so transfers of one account are applied in order.
+    """
+    return 'transfers.%s' % (sender_account_pk % settings.TRANSFER_QUEUE_PARTITIONS)
+
+def done_key(transfer_request_pk):
+    """Redis list used to wake up clients waiting for the result of the transfer request"""
+    return 'money:transfer_request:%s:done' % transfer_request_pk
+
+def submit_transfer(owner, idempotency_key, sender_account_pk, receiver_account_pk, amount):
+    """Saves transfer request and sends it to the queue of sender's account.
+    Repeated submission with the same idempotency key returns the existing request.
+
+    :returns: tuple (TransferRequest object, created flag)
+    """
+    try:
+        with transaction.atomic():
+            transfer_request = TransferRequest.objects.create(owner_id=owner.pk, idempotency_key=idempotency_key,
+                sender_account_pk=sender_account_pk, receiver_account_pk=receiver_account_pk, amount=amount)
+    except IntegrityError:
+        return TransferRequest.objects.get(owner_id=owner.pk, idempotency_key=idempotency_key), False
+    transaction.on_commit(lambda: app.send_task('money.tasks.apply_transfer_request', args=[transfer_request.pk],
+        queue=transfer_queue(sender_account_pk)))
+    return transfer_request, True
+
+def process_transfer_request(transfer_request_pk):
+    """Applies pending transfer request, repeated delivery of the same request does nothing"""
+    with transaction.atomic():
+        transfer_request = TransferRequest.objects.select_for_update().get(pk=transfer_request_pk)
+        if transfer_request.status != TransferRequest.PENDING:
+            return transfer_request
+        try:
+            #savepoint keeps the request row when the transfer is rolled back
+            with transaction.atomic():
+                transfer_request.transfer = execute_transfer(User(pk=transfer_request.owner_id), transfer_request.sender_account_pk,
+                    transfer_request.receiver_account_pk, transfer_request.amount)
+            transfer_request.status = TransferRequest.DONE
+        except TransferError as e:
+            transfer_request.status = TransferRequest.FAILED
+            transfer_request.error = str(e)[:255]
+        transfer_request.save(update_fields=['transfer', 'status', 'error', 'updated'])
+        transaction.on_commit(lambda: notify_transfer_request(transfer_request_pk))
+    return transfer_request
+
+def notify_transfer_request(transfer_request_pk):
+    """Wakes up clients waiting for the result of the transfer request"""
+    try:
+        redis = get_redis()
+        redis.pipeline().rpush(done_key(transfer_request_pk), 1).expire(done_key(transfer_request_pk), 60).execute()
+    except RedisError:
+        info_logger.info('notify_transfer_request: Redis is not available')
+
+def wait_for_transfer_request(transfer_request_pk, timeout):
+    """Blocks until the transfer request is processed or timeout (seconds) expires"""
+    try:
+        redis = get_redis()
+        if redis.blpop(done_key(transfer_request_pk), timeout=timeout):
+            #token is returned for other clients waiting for the same request
+            notify_transfer_request(transfer_request_pk)
+    except RedisError:
+        info_logger.info('wait_for_transfer_request: Redis is not available')
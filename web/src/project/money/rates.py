@@ -0,0 +1,267 @@
+import json
+import time
+import logging
+import threading
+from bisect import bisect_left
+from decimal import Decimal
+from django.conf import settings
+from django.db.models import Q
+from redis import RedisError
+from money.models import Course
+from money.amounts import course_ratio, currency_scale
+from project.redis import get_redis
+
+info_logger = logging.getLogger('info')
+
+#Redis key holding version of the rates, it is increased by update_courses task
+RATES_VERSION_KEY = 'money:rates:version'
+#Redis key holding snapshot of the latest courses built by update_courses task
+RATES_SNAPSHOT_KEY = 'money:rates:snapshot'
+#Redis key holding unix time of the last change of the rates, Last-Modified of cached responses
+RATES_UPDATED_KEY = 'money:rates:updated'
+
+def normalise_courses(pairs):
+    """Courses of all providers normalised to one reference base, the base currency quoting the most currencies.
+
+    Currencies quoted by the reference base keep their courses, the others are converted
+    by the course of the base currency which quotes them (the latest course if several bases do).
+
+    :param pairs: the latest courses {(base_currency_name, currency_name): (date, course)}
+    :returns: {currency_name: course}, the reference base has course 1
+    """
+    quoted = {}
+    for base_currency_name, _ in pairs:
+        quoted[base_currency_name] = quoted.get(base_currency_name, 0) + 1
+    if not quoted:
+        return {}
+    reference = min(quoted, key=lambda name: (-quoted[name], name))
+    courses = {reference: Decimal(1)}
+    remaining = dict(pairs)
+    while remaining:
+        #currencies reachable in one more step from the currencies with known courses
+        found = {}
+        for (base_currency_name, currency_name), (date, course) in remaining.items():
+            if base_currency_name in courses and currency_name not in courses:
+                name, normalised = currency_name, courses[base_currency_name] * course
+            elif currency_name in courses and base_currency_name not in courses:
+                name, normalised = base_currency_name, courses[currency_name] / course
+            else:
+                continue
+            if name not in found or (date is not None and found[name][0] is not None and found[name][0] < date):
+                found[name] = (date, normalised)
+        if not found:
+            break
+        for name, (_, course) in found.items():
+            courses[name] = course
+        remaining = {pair: value for pair, value in remaining.items() if pair[0] not in courses or pair[1] not in courses}
+    if remaining:
+        info_logger.info('normalise_courses: courses %s are not connected to the base currency %s' % (sorted(remaining), reference))
+    return courses
+
+class RateTable:
+    """In-memory snapshot of the latest courses with precomputed cross-rate matrix.
+
+    Currencies are numbered in alphabetical order, rate of convertation from currency i
+    to currency j is matrix[i * N + j], so convertation of any pair is one index lookup.
+    Snapshot is never changed after creation, so it can be shared between threads of the worker without locking.
+    """
+    def __init__(self, courses, version=None, matrix=None):
+        #{currency_name: course}, base currencies have course 1
+        self.courses = courses
+        self.version = version
+        self.currencies = sorted(courses)
+        self.index = {name: i for i, name in enumerate(self.currencies)}
+        if matrix is None:
+            course_list = [courses[name] for name in self.currencies]
+            matrix = [course_to/course_from for course_from in course_list for course_to in course_list]
+        self.matrix = matrix
+        #exact rates (numerator, denominator) for convertation of Money without decimal context
+        fractions = [course_ratio(courses[name]) for name in self.currencies]
+        self.ratios = [(n_to * d_from, d_to * n_from) for n_from, d_from in fractions for n_to, d_to in fractions]
+        #decimal places of converted amounts, CURRENCY_SCALES is read once per snapshot
+        self.scales = [currency_scale(name) for name in self.currencies] * len(self.currencies)
+
+    @classmethod
+    def from_pairs(cls, pairs, version=None):
+        """Builds snapshot from the latest courses {(base_currency_name, currency_name): (date, course)}"""
+        return cls(normalise_courses(pairs), version)
+
+    @classmethod
+    def load(cls, version=None):
+        """Builds snapshot from database using DISTINCT ON (base_currency, currency)"""
+        rows = Course.objects.order_by('base_currency_id', 'currency_id', '-date')\
+            .distinct('base_currency_id', 'currency_id')\
+            .values_list('base_currency__name', 'currency__name', 'date', 'course')
+        pairs = {(base_currency_name, currency_name): (date, course) for base_currency_name, currency_name, date, course in rows}
+        return cls.from_pairs(pairs, version)
+
+    def as_dict(self):
+        """Serializable form of the snapshot, decimals are strings"""
+        return {
+            'version': self.version,
+            'currencies': self.currencies,
+            'courses': [str(self.courses[name]) for name in self.currencies],
+            'matrix': [str(rate) for rate in self.matrix],
+        }
+
+    def to_json(self):
+        return json.dumps(self.as_dict())
+
+    @classmethod
+    def from_json(cls, data):
+        """Restores snapshot published by bump_rates_version without recomputing the matrix"""
+        data = json.loads(data)
+        courses = {name: Decimal(course) for name, course in zip(data['currencies'], data['courses'])}
+        return cls(courses, data['version'], [Decimal(rate) for rate in data['matrix']])
+
+    def course(self, currency):
+        """Returns the latest course of the currency, base currencies have course 1"""
+        name = getattr(currency, 'name', currency)
+        course = self.courses.get(name)
+        if course is None:
+            raise Exception('There is no course for the currency %s' % name)
+        return course
+
+    def position(self, currency_from, currency_to):
+        """Index of the pair in matrix and ratios"""
+        i = self.index.get(getattr(currency_from, 'name', currency_from))
+        j = self.index.get(getattr(currency_to, 'name', currency_to))
+        if i is None or j is None:
+            raise Exception('There is no course for the currency %s' % (currency_from if i is None else currency_to))
+        return i * len(self.currencies) + j
+
+    def rate(self, currency_from, currency_to):
+        """Cross-rate of convertation from currency_from to currency_to"""
+        return self.matrix[self.position(currency_from, currency_to)]
+
+    def convert_money(self, currency_from, currency_to, amount):
+        """Converts Money by exact rate, result is rounded half to even to the scale of currency_to"""
+        position = self.position(currency_from, currency_to)
+        return amount.convert(self.ratios[position], self.scales[position])
+
+    def convert(self, currency_from, currency_to, amount):
+        """Same result as convert_amount, but without database queries"""
+        rate = self.rate(currency_from, currency_to)
+        return (self.course(currency_from), self.course(currency_to), rate * Decimal(amount))
+
+class RateTimeline:
+    """Chronological courses of currency pairs for point-in-time (as-of) lookups.
+
+    Courses of every pair (base currency, currency) are kept in date order, so "the latest course strictly
+    before date" is found by bisect instead of a database query per lookup. The latest courses of the pairs
+    are normalised to one base like in RateTable, so courses of providers with different bases are not mixed.
+    """
+    def __init__(self, rows):
+        #rows are (base_currency_name, currency_name, date, course) sorted by date
+        self.dates = {}
+        self.courses = {}
+        #{date: normalised courses}
+        self.normalised = {}
+        for base_currency_name, currency_name, date, course in rows:
+            self.dates.setdefault((base_currency_name, currency_name), []).append(date)
+            self.courses.setdefault((base_currency_name, currency_name), []).append(course)
+
+    @classmethod
+    def load(cls, currencies=None, until=None):
+        """Loads history of the currencies (all currencies by default) in one query.
+        Courses of base currencies are loaded too, they connect bases of different providers.
+
+        :param currencies: names of currencies
+        :param until: courses on this date and later are not needed
+        """
+        course_list = Course.objects.order_by('date')
+        if currencies is not None:
+            course_list = course_list.filter(Q(currency__name__in=currencies) | Q(base_currency__name__in=currencies)
+                | Q(currency__in=Course.objects.values('base_currency')))
+        if until is not None:
+            course_list = course_list.filter(date__lt=until)
+        return cls(course_list.values_list('base_currency__name', 'currency__name', 'date', 'course').iterator())
+
+    def courses_on(self, date):
+        """Normalised latest courses {currency_name: course} strictly before date"""
+        courses = self.normalised.get(date)
+        if courses is None:
+            pairs = {}
+            for pair, dates in self.dates.items():
+                i = bisect_left(dates, date)
+                if i:
+                    pairs[pair] = (dates[i - 1], self.courses[pair][i - 1])
+            courses = self.normalised[date] = normalise_courses(pairs)
+        return courses
+
+    def course(self, currency, date):
+        """The latest course of the currency strictly before date, the reference base currency has course 1"""
+        name = getattr(currency, 'name', currency)
+        course = self.courses_on(date).get(name)
+        if course is None:
+            raise Exception('There is no course for the currency %s on date %s' % (name, date))
+        return course
+
+    def convert(self, currency_from, currency_to, amount, date):
+        """Same result as convert_amount with date parameter"""
+        course_from = self.course(currency_from, date)
+        course_to = self.course(currency_to, date)
+        return (course_from, course_to, course_to/course_from * Decimal(amount))
+
+def convert_amounts(items):
+    """Bulk historical convertation
+
+    :param items: list of tuples (currency_from, currency_to, amount, date)
+    :returns: list of converted amounts in the same order
+    """
+    if not items:
+        return []
+    currencies = set()
+    for currency_from, currency_to, _, _ in items:
+        currencies.add(getattr(currency_from, 'name', currency_from))
+        currencies.add(getattr(currency_to, 'name', currency_to))
+    timeline = RateTimeline.load(currencies, until=max(item[3] for item in items))
+    return [timeline.convert(currency_from, currency_to, amount, date)[2] for currency_from, currency_to, amount, date in items]
+
+_table = None
+_checked_at = 0
+_lock = threading.Lock()
+
+def get_rate_table() -> RateTable:
+    """Returns snapshot of the rates of the current worker process.
+
+    Version stamp in Redis is checked not more often than once per RATES_VERSION_CHECK_INTERVAL seconds.
+    When the version was changed, snapshot published by update_courses is loaded from Redis,
+    database is queried only if there is no snapshot of this version.
+    """
+    global _table, _checked_at
+    if _table is not None and time.monotonic() - _checked_at < settings.RATES_VERSION_CHECK_INTERVAL:
+        return _table
+    with _lock:
+        if _table is not None and time.monotonic() - _checked_at < settings.RATES_VERSION_CHECK_INTERVAL:
+            return _table
+        try:
+            redis = get_redis()
+            version = redis.get(RATES_VERSION_KEY)
+            version = int(version) if version is not None else None
+            if version is not None and (_table is None or _table.version != version):
+                snapshot = redis.get(RATES_SNAPSHOT_KEY)
+                table = RateTable.from_json(snapshot) if snapshot is not None else None
+                _table = table if table is not None and table.version == version else RateTable.load(version)
+        except RedisError:
+            #without Redis we can not know whether rates were changed, so snapshot is rebuilt
+            info_logger.info('get_rate_table: Redis is not available')
+            version = None
+        if _table is None or version is None:
+            _table = RateTable.load(version)
+        _checked_at = time.monotonic()
+    return _table
+
+def bump_rates_version():
+    """Marks snapshots of all workers as stale and publishes the new snapshot,
+    must be called after Course rows were written"""
+    global _checked_at
+    _checked_at = 0
+    redis = get_redis()
+    version = redis.incr(RATES_VERSION_KEY)
+    table = RateTable.load(version)
+    pipeline = redis.pipeline()
+    pipeline.set(RATES_SNAPSHOT_KEY, table.to_json())
+    pipeline.set(RATES_UPDATED_KEY, int(time.time()))
+    pipeline.execute()
+    return table
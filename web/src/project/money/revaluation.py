@@ -0,0 +1,134 @@
+from django.db import connections
+from money.models import Currency, Account, AccountShard
+from money.rates import get_rate_table, RateTimeline
+from money.amounts import Money, MONEY_SCALE, course_ratio, currency_scale
+from project.routers import read_alias
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def balances_query(by_user):
+    """Aggregate of balances in minor units, sub-balances of sharded accounts are added to their accounts.
+    Balances have MONEY_SCALE decimal places, so scaled sums are exact integers.
+    """
+    group = 'a.user_id, a.currency_id' if by_user else 'a.currency_id'
+    return ('SELECT {group}, COUNT(*), (SUM(a.balance + COALESCE(s.total, 0)) * {factor})::bigint FROM {account} a '
+        'LEFT JOIN (SELECT account_id, SUM(balance) AS total FROM {shard} GROUP BY account_id) s ON s.account_id = a.id '
+        'GROUP BY {group}').format(group=group, factor=10 ** MONEY_SCALE,
+        account=Account._meta.db_table, shard=AccountShard._meta.db_table)
+
+def load_balances(by_user=False):
+    """Balances of all accounts grouped by currency (and by user) in one query
+
+    :returns: list of rows (currency_id, accounts count, units) or (user_id, currency_id, accounts count, units)
+    """
+    with connections[read_alias.get() or 'default'].cursor() as cursor:
+        cursor.execute(balances_query(by_user))
+        return cursor.fetchall()
+
+def get_ratios(currency_names, currency, date=None):
+    """Exact rates (numerator, denominator) from every currency to the reporting currency
+
+    :param currency_names: {currency_id: name}
+    :param date: rates are the latest courses before date, the current rates by default
+    """
+    if date is None:
+        course = get_rate_table().course
+    else:
+        timeline = RateTimeline.load(set(currency_names.values()) | {currency}, until=date)
+        course = lambda name: timeline.course(name, date)
+    n_to, d_to = course_ratio(course(currency))
+    ratios = {}
+    for pk, name in currency_names.items():
+        n_from, d_from = course_ratio(course(name))
+        ratios[pk] = (n_to * d_from, d_to * n_from)
+    return ratios
+
+def sum_by_currency(rows):
+    """Rows per user and currency summed per currency
+
+    :param rows: rows (user_id, currency_id, accounts count, units), list or numpy array
+    :returns: list of rows (currency_id, accounts count, units)
+    """
+    if numpy is not None and isinstance(rows, numpy.ndarray):
+        currency_ids, positions = numpy.unique(rows[:, 1], return_inverse=True)
+        counts = numpy.zeros(len(currency_ids), dtype=numpy.int64)
+        units = numpy.zeros(len(currency_ids), dtype=numpy.int64)
+        numpy.add.at(counts, positions, rows[:, 2])
+        numpy.add.at(units, positions, rows[:, 3])
+        return [(int(currency_id), int(count), int(total)) for currency_id, count, total in zip(currency_ids, counts, units)]
+    totals = {}
+    for user_id, currency_id, count, units in rows:
+        accounts, total = totals.get(currency_id, (0, 0))
+        totals[currency_id] = (accounts + count, total + units)
+    return [(currency_id, count, units) for currency_id, (count, units) in totals.items()]
+
+def revalue_currencies(rows, ratios, scale):
+    """Totals per currency converted exactly with banker's rounding
+
+    :returns: {currency_id: (accounts count, Money balance, Money converted)}
+    """
+    totals = {}
+    for currency_id, count, units in rows:
+        balance = Money(units)
+        totals[currency_id] = (count, balance, balance.convert(ratios[currency_id], scale))
+    return totals
+
+def revalue_users(rows, ratios, scale):
+    """Totals per user in the reporting currency.
+
+    With numpy balances are converted as one vector operation: units of every account are multiplied
+    by float rate of its currency and summed per user, totals are rounded half to even to scale.
+    Float products are exact to a minor unit for balances under 2**53 units.
+    Without numpy every balance is converted exactly by Money.
+
+    :param rows: rows (user_id, currency_id, accounts count, units), list or numpy array
+    :returns: {user_id: Decimal}
+    """
+    if not len(rows):
+        return {}
+    if numpy is None or not isinstance(rows, numpy.ndarray):
+        totals = {}
+        for user_id, currency_id, count, units in rows:
+            converted = Money(units).convert(ratios[currency_id], scale)
+            totals[user_id] = totals[user_id] + converted if user_id in totals else converted
+        return {user_id: total.to_decimal() for user_id, total in totals.items()}
+    currency_ids = sorted(ratios)
+    rates = numpy.array([ratios[pk][0] / ratios[pk][1] for pk in currency_ids], dtype=numpy.float64)
+    converted = rows[:, 3] * rates[numpy.searchsorted(currency_ids, rows[:, 1])] / 10 ** (MONEY_SCALE - scale)
+    user_ids, positions = numpy.unique(rows[:, 0], return_inverse=True)
+    totals = numpy.rint(numpy.bincount(positions, weights=converted)).astype(numpy.int64)
+    return {int(user_id): Money(int(units), scale).to_decimal() for user_id, units in zip(user_ids, totals)}
+
+def revaluation(currency, date=None, by_user=False):
+    """Holdings of all accounts revalued into the reporting currency.
+
+    Balances are read by one aggregate query, they are current balances even with date,
+    date chooses historical courses (the latest courses before date).
+    Overall total and totals per currency are exact, see revalue_users for totals per user.
+
+    :param currency: name of the reporting currency
+    :param date: datetime of the courses, the current rates by default
+    :param by_user: add totals per user
+    :returns: dict with total, currencies and users totals
+    """
+    scale = currency_scale(currency)
+    rows = load_balances(by_user)
+    if by_user and numpy is not None:
+        rows = numpy.array(rows, dtype=numpy.int64).reshape(-1, 4)
+    currency_rows = sum_by_currency(rows) if by_user else rows
+    currency_names = dict(Currency.objects.filter(pk__in=[row[0] for row in currency_rows]).values_list('pk', 'name'))
+    ratios = get_ratios(currency_names, currency, date)
+    totals = revalue_currencies(currency_rows, ratios, scale)
+    data = {
+        'currency': currency,
+        'date': date,
+        'total': sum((converted for _, _, converted in totals.values()), Money(0, scale)).to_decimal(),
+        'currencies': {currency_names[currency_id]: {'accounts': count, 'balance': balance.to_decimal(), 'converted': converted.to_decimal()}
+            for currency_id, (count, balance, converted) in totals.items()},
+    }
+    if by_user:
+        data['users'] = revalue_users(rows, ratios, scale)
+    return data
@@ -4,7 +4,9 @@ from django.core.exceptions import ObjectDoesNotExist
 from django.db.models import Q
 from django.db import transaction, IntegrityError
 from rest_framework import serializers
-from money.models import Currency, Course, Account, Transfer, convert_amount
+from money.models import Currency, Course, Account, Transfer, TransferRequest
+from money.engine import execute_transfer, TransferError, DuplicateTransferError
+from money.summaries import summary_changed
 from users.models import User
 from users.serializers import UserSerializer
 
@@ -28,6 +30,8 @@ class AccountForOwnerSerializer(serializers.ModelSerializer):
     """Owner's accounts with confidential data (balance, date of creation)"""
     created = serializers.DateTimeField(read_only=True)
     currency = CurrencySerializer()
+    #sharded accounts keep part of the balance in their shards
+    balance = serializers.DecimalField(max_digits=18, decimal_places=4, source='total_balance', read_only=True)
     class Meta:
         model = Account
         fields = ['pk', 'user', 'currency', 'balance', 'created']
@@ -53,20 +57,23 @@ class AccountCreateSerializer(serializers.Serializer):
         try:
             currency = Currency.objects.get(name=currency_name)
         except ObjectDoesNotExist:
-            return serializers.ValidationError('There is no currency "%s"' % currency_name)
+            raise serializers.ValidationError('There is no currency "%s"' % currency_name)
         #User can not have 2 or more accounts with the same currency 
         try:
             Account.objects.get(Q(currency__name=currency_name) & Q(user=owner))
-            return serializers.ValidationError('%s account is already exists!' % currency_name)
+            raise serializers.ValidationError('%s account is already exists!' % currency_name)
         except ObjectDoesNotExist:
             pass
         if balance_value < 0:
-            return serializers.ValidationError('Bad balance value')
+            raise serializers.ValidationError('Bad balance value')
         data['currency'] = currency
         data['owner'] = owner
         return data
     def create(self, validated_data):
-        return Account.create(validated_data['owner'], validated_data['currency'], validated_data['balance'])
+        account = Account.create(validated_data['owner'], validated_data['currency'], validated_data['balance'])
+        account.save()
+        summary_changed([account.user_id])
+        return account
 
 class UserAccountListSerializer(serializers.ModelSerializer):
     """User's and theirs accounts"""
@@ -81,56 +88,24 @@ class TransferCreateSerializer(serializers.Serializer):
     receiver_account = serializers.IntegerField(write_only=True)
     amount = serializers.DecimalField(max_digits=18, decimal_places=4, default=0)
     def validate(self, data):
-        #authenticated user is account's owner
-        owner = self.context['owner']
-        sender_account_pk = data.get('sender_account', None)
-        receiver_account_pk = data.get('receiver_account', None)
-        amount = data.get('amount', None)
-        #all user's accounts
-        owner_accounts = Account.objects.filter(user=owner)
-        if owner_accounts:
-            #User can not send money from other's account
-            if sender_account_pk not in [account.pk for account in owner_accounts]:
-                raise serializers.ValidationError('It is not yours account!')
-        else:
-            raise serializers.ValidationError('You do not have any accounts! Please update account list!')
-        if sender_account_pk == receiver_account_pk:
+        #checks of accounts and balance are done by transfer engine under row locks
+        if data.get('sender_account', None) == data.get('receiver_account', None):
             raise serializers.ValidationError('Accounts must be different')
-        try:
-            sender_account = Account.objects.get(pk=sender_account_pk)
-        except ObjectDoesNotExist:
-            raise serializers.ValidationError('There is no account with id = %s' % sender_account_pk)
-        try:
-            receiver_account = Account.objects.get(pk=receiver_account_pk)
-        except ObjectDoesNotExist:
-            raise serializers.ValidationError('There is no account with id = %s' % receiver_account_pk)
-        if amount <= 0:
+        if data.get('amount', 0) <= 0:
             raise serializers.ValidationError('Transfer amount must be greater than zero!')
-        if sender_account.balance < amount:
-            raise serializers.ValidationError('Unsufficient balance!')
-        try:
-            _, _, converted_amount = convert_amount(sender_account.currency, receiver_account.currency, amount)
-        except:
-            raise serializers.ValidationError(sys.exc_info()[0])
-        data['sender_account'] = sender_account
-        data['receiver_account'] = receiver_account
-        data['converted_amount'] = converted_amount
         return data
         
     def create(self, validated_data):
-        sender_account = validated_data.get('sender_account', None)
-        receiver_account = validated_data.get('receiver_account', None)
-        amount = validated_data.get('amount', None)
-        with transaction.atomic():
-            converted_amount = validated_data.get('converted_amount', None)
-            #sender's balance reduced on amount
-            sender_account.balance -= amount
-            sender_account.save()
-            #receiver's balance increased on converted_amount
-            receiver_account.balance += converted_amount
-            receiver_account.save()
-            new_transfer = Transfer.create(sender_account, receiver_account, amount)
-        return new_transfer
+        #authenticated user is account's owner
+        owner = self.context['owner']
+        try:
+            return execute_transfer(owner, validated_data['sender_account'], validated_data['receiver_account'], validated_data['amount'],
+                idempotency_key=self.context.get('idempotency_key', None))
+        except TransferError as e:
+            raise serializers.ValidationError(str(e))
+        except DuplicateTransferError as e:
+            #retry of already executed transfer gets the original transfer
+            return e.transfer
 
 class TransferSerializer(serializers.ModelSerializer):
     """List of transfers"""
@@ -138,4 +113,19 @@ class TransferSerializer(serializers.ModelSerializer):
     receiver_account = AccountSerializer()
     class Meta:
         model = Transfer
-        fields = ['pk', 'sender_account', 'receiver_account', 'amount', 'created']
\ No newline at end of file
+        fields = ['pk', 'sender_account', 'receiver_account', 'amount', 'created']
+
+class StatementSerializer(TransferSerializer):
+    """Transfers of account statement, direction is "in" or "out" for the account passed in context"""
+    direction = serializers.SerializerMethodField()
+    class Meta:
+        model = Transfer
+        fields = ['pk', 'direction', 'sender_account', 'receiver_account', 'amount', 'created']
+    def get_direction(self, transfer):
+        return 'out' if transfer.sender_account_id == self.context['account'].pk else 'in'
+
+class TransferRequestSerializer(serializers.ModelSerializer):
+    """Status of asynchronous transfer"""
+    class Meta:
+        model = TransferRequest
+        fields = ['pk', 'status', 'error', 'sender_account_pk', 'receiver_account_pk', 'amount', 'transfer', 'created', 'updated']
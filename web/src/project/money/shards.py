@@ -0,0 +1,96 @@
+import random
+import logging
+from decimal import Decimal
+from django.db import models, transaction
+from django.db.models import F, Case, When
+from money.models import Account, AccountShard
+from money.amounts import Money, to_decimal
+
+info_logger = logging.getLogger('info')
+
+def lock_shards(account):
+    """Locks sub-balances of the sharded account for debit, account itself must be locked before.
+
+    Shards being credited by concurrent transfers are skipped (SKIP LOCKED): debit never waits
+    for credits, so two sharded accounts sending money to each other can not deadlock.
+    Available balance is underestimated at most by credits which are not committed yet.
+    """
+    if not account.shards:
+        return []
+    return list(AccountShard.objects.select_for_update(skip_locked=True).filter(account_id=account.pk).order_by('index'))
+
+def lock_all_shards(account):
+    """Locks all sub-balances of the account waiting for concurrent credits, account itself must be locked before"""
+    return list(AccountShard.objects.select_for_update().filter(account_id=account.pk).order_by('index'))
+
+def debit(account, shards, amount, deltas):
+    """Debits locked account. Balance of the account is used first, the rest is pulled
+    from locked shards starting from the largest one.
+
+    :param amount: integer count of minor units (Money.units)
+    :param shards: locked shards of the account, empty list for regular accounts
+    :param deltas: {account_pk: delta in minor units} for update_balances, delta of the account is added to it
+    """
+    if not shards:
+        deltas[account.pk] -= amount
+        return
+    from_balance = min(max(Money.from_decimal(account.balance).units, 0), amount)
+    deltas[account.pk] -= from_balance
+    rest = amount - from_balance
+    shard_deltas = {}
+    for shard in sorted(shards, key=lambda shard: shard.balance, reverse=True):
+        if rest <= 0:
+            break
+        taken = min(Money.from_decimal(shard.balance).units, rest)
+        if taken > 0:
+            shard_deltas[shard.pk] = -taken
+            shard.balance -= to_decimal(taken)
+            rest -= taken
+    if rest > 0:
+        raise ValueError('Unsufficient balance of shards of account %s' % account.pk)
+    if shard_deltas:
+        update_shards(shard_deltas)
+
+def credit(account, amount, deltas):
+    """Credits account. Sharded account is credited through its random shard without locking the account.
+
+    :param amount: integer count of minor units (Money.units)
+    :param deltas: {account_pk: delta in minor units} for update_balances, delta of regular account is added to it
+    """
+    if not account.shards:
+        deltas[account.pk] += amount
+        return
+    AccountShard.objects.filter(account_id=account.pk, index=random.randrange(account.shards))\
+        .update(balance=F('balance') + to_decimal(amount))
+
+def update_shards(deltas):
+    """Applies {shard_pk: delta in minor units} to locked shards by one UPDATE statement"""
+    AccountShard.objects.filter(pk__in=list(deltas)).update(balance=Case(
+        *[When(pk=shard_pk, then=F('balance') + to_decimal(delta)) for shard_pk, delta in deltas.items()],
+        output_field=models.DecimalField(max_digits=18, decimal_places=4),
+    ))
+
+def enable_sharding(account_pk, count):
+    """Splits balance of the account into count sub-balances, count 0 turns sharding off"""
+    with transaction.atomic():
+        account = Account.objects.select_for_update().get(pk=account_pk)
+        consolidate(account)
+        AccountShard.objects.filter(account=account).delete()
+        AccountShard.objects.bulk_create([AccountShard(account=account, index=index) for index in range(count)])
+        Account.objects.filter(pk=account.pk).update(shards=count)
+    info_logger.info('enable_sharding: account %s has %s shards' % (account_pk, count))
+
+def consolidate(account):
+    """Moves sub-balances of locked account to its balance"""
+    shards = lock_all_shards(account)
+    total = sum((shard.balance for shard in shards), Decimal(0))
+    if total:
+        AccountShard.objects.filter(account_id=account.pk).update(balance=0)
+        Account.objects.filter(pk=account.pk).update(balance=F('balance') + total)
+    return total
+
+def consolidate_all():
+    """Periodic consolidation of all sharded accounts, every account in its own short transaction"""
+    for account_pk in Account.objects.filter(shards__gt=0).order_by('pk').values_list('pk', flat=True):
+        with transaction.atomic():
+            consolidate(Account.objects.select_for_update().get(pk=account_pk))
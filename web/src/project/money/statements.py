@@ -0,0 +1,39 @@
+from money.models import Transfer
+from money.pagination import after_cursor, encode_cursor
+
+def statement_page(account, cursor, limit, date_from=None, date_to=None, counterparty=None):
+    """One page of incoming and outgoing transfers of the account in order (-created, -pk).
+
+    Outgoing and incoming transfers are found by separate index range scans over
+    (sender_account, created, id) and (receiver_account, created, id), each limited
+    by the page size, and merged by UNION ALL, so the page is read from indexes only.
+
+    :param account: Account object
+    :param cursor: cursor of the page, None for the first page
+    :param limit: page size
+    :param date_from: transfers created on this date and later
+    :param date_to: transfers created before this date
+    :param counterparty: primary key of the other account of transfers
+    :returns: list of transfers and cursor of the next page (None for the last page)
+    """
+    outgoing = Transfer.objects.filter(sender_account=account)
+    incoming = Transfer.objects.filter(receiver_account=account)
+    if counterparty is not None:
+        outgoing = outgoing.filter(receiver_account=counterparty)
+        incoming = incoming.filter(sender_account=counterparty)
+    branches = []
+    for transfers in (outgoing, incoming):
+        if date_from is not None:
+            transfers = transfers.filter(created__gte=date_from)
+        if date_to is not None:
+            transfers = transfers.filter(created__lt=date_to)
+        transfers = after_cursor(transfers, cursor)
+        branches.append(transfers.order_by('-created', '-id').values_list('id', 'created')[:limit + 1])
+    positions = list(branches[0].union(branches[1], all=True).order_by('-created', '-id')[:limit + 1])
+    next_cursor = None
+    if len(positions) > limit:
+        positions = positions[:limit]
+        next_cursor = encode_cursor(positions[-1][1], positions[-1][0])
+    transfers = Transfer.objects.select_related('sender_account__user', 'sender_account__currency', 'receiver_account__user', 'receiver_account__currency')\
+        .in_bulk([pk for pk, _ in positions])
+    return [transfers[pk] for pk, _ in positions], next_cursor
@@ -0,0 +1,193 @@
+import json
+import time
+import asyncio
+import logging
+import threading
+from urllib.parse import parse_qs
+from django.conf import settings
+from redis import RedisError
+from rest_framework_simplejwt.tokens import AccessToken
+from rest_framework_simplejwt.exceptions import TokenError
+from project.redis import get_redis
+from users.authentication import is_revoked
+
+info_logger = logging.getLogger('info')
+
+#Redis pub/sub channel of rate updates, live events for connected clients
+RATES_CHANNEL = 'money:rates:updates'
+#Redis stream keeping the last rate updates, clients resume from it by Last-Event-ID
+RATES_EVENTS_KEY = 'money:rates:events'
+
+def publish_rates_update(table, changed):
+    """Publishes compact diff of the rates: version and the new courses of changed currencies.
+    Event is appended to the capped stream first, its id is the SSE event id.
+
+    :param table: RateTable of the new version
+    :param changed: names of currencies whose courses were changed
+    """
+    data = json.dumps({'version': table.version, 'courses': {name: str(table.courses[name]) for name in sorted(changed) if name in table.courses}})
+    redis = get_redis()
+    event_id = redis.xadd(RATES_EVENTS_KEY, {'data': data}, maxlen=settings.RATES_EVENTS_MAXLEN, approximate=True)
+    redis.publish(RATES_CHANNEL, json.dumps({'id': event_id.decode(), 'data': data}))
+    return event_id
+
+def read_events_after(event_id):
+    """Events of the stream following event_id, the oldest first"""
+    rows = get_redis().xrange(RATES_EVENTS_KEY, min='(' + event_id, max='+')
+    return [(row_id.decode(), fields[b'data'].decode()) for row_id, fields in rows]
+
+def parse_event_id(event_id):
+    """Stream id "<ms>-<seq>" as a comparable tuple, None for bad ids"""
+    try:
+        ms, seq = event_id.split('-')
+        return int(ms), int(seq)
+    except (AttributeError, ValueError):
+        return None
+
+class RatesHub:
+    """Fan-out of the Redis channel to asyncio queues of connected clients.
+
+    One thread per process listens to the channel with one Redis connection, however
+    many clients are connected. Events are passed to the event loop by call_soon_threadsafe.
+    A client which does not read its queue is marked as lagging and disconnected,
+    it resumes from its last event id after reconnection.
+    """
+    def __init__(self):
+        self.clients = set()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def subscribe(self, loop):
+        queue = asyncio.Queue(maxsize=settings.RATES_STREAM_QUEUE_SIZE)
+        queue.lagging = False
+        with self.lock:
+            self.clients.add((loop, queue))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.listen, name='rates-hub', daemon=True)
+                self.thread.start()
+        return queue
+
+    def unsubscribe(self, loop, queue):
+        with self.lock:
+            self.clients.discard((loop, queue))
+
+    def listen(self):
+        while True:
+            try:
+                pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(RATES_CHANNEL)
+                for message in pubsub.listen():
+                    event = json.loads(message['data'])
+                    with self.lock:
+                        clients = list(self.clients)
+                    for loop, queue in clients:
+                        loop.call_soon_threadsafe(deliver, queue, event)
+            except RedisError as e:
+                info_logger.info('RatesHub: %s' % e)
+                time.sleep(1)
+
+def deliver(queue, event):
+    try:
+        queue.put_nowait(event)
+    except asyncio.QueueFull:
+        queue.lagging = True
+
+hub = RatesHub()
+
+def authenticate(scope):
+    """Validates JWT access token from header "Authorization: Bearer <token>" or from query parameter
+    "token" (EventSource of browsers can not set headers). Token is checked without database queries,
+    revoked tokens are rejected by the revocation list in Redis.
+
+    :returns: AccessToken or None
+    """
+    headers = dict(scope.get('headers', []))
+    token = None
+    authorization = headers.get(b'authorization', b'').decode('latin-1').split()
+    if len(authorization) == 2 and authorization[0] in settings.SIMPLE_JWT.get('AUTH_HEADER_TYPES', ('Bearer',)):
+        token = authorization[1]
+    if token is None:
+        token = parse_qs(scope.get('query_string', b'').decode()).get('token', [None])[0]
+    if not token:
+        return None
+    try:
+        token = AccessToken(token)
+    except TokenError:
+        return None
+    if settings.SIMPLE_JWT.get('USER_ID_CLAIM', 'user_id') not in token or is_revoked(token):
+        return None
+    return token
+
+def format_event(event_id, data):
+    return ('id: %s\nevent: rates\ndata: %s\n\n' % (event_id, data)).encode()
+
+async def send_error(send, status, message):
+    await send({'type': 'http.response.start', 'status': status, 'headers': [(b'content-type', b'application/json')]})
+    await send({'type': 'http.response.body', 'body': json.dumps({'error': message}).encode()})
+
+async def rates_stream_app(scope, receive, send):
+    """ASGI application streaming rate updates as server-sent events.
+
+    Client passes id of the last received event in header Last-Event-ID (or query parameter last_event_id),
+    missed events are replayed from the Redis stream before live ones. Comment lines are sent
+    every RATES_STREAM_HEARTBEAT seconds so that proxies keep the connection open.
+    Stream is closed when the access token expires, client reconnects with a fresh token.
+    """
+    if scope['method'] != 'GET':
+        await send_error(send, 405, 'Method not allowed')
+        return
+    loop = asyncio.get_event_loop()
+    #revocation list is checked by a blocking Redis request
+    token = await loop.run_in_executor(None, authenticate, scope)
+    if token is None:
+        await send_error(send, 401, 'Authentication credentials were not provided or are not valid')
+        return
+    expires = token['exp']
+    headers = dict(scope.get('headers', []))
+    last_event_id = headers.get(b'last-event-id', b'').decode() or \
+        parse_qs(scope.get('query_string', b'').decode()).get('last_event_id', [''])[0]
+    #client is subscribed before replay, so events published during replay are not lost
+    queue = hub.subscribe(loop)
+    disconnected = asyncio.ensure_future(wait_disconnect(receive))
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ]})
+        last = parse_event_id(last_event_id)
+        if last is not None:
+            try:
+                events = await loop.run_in_executor(None, read_events_after, last_event_id)
+            except RedisError:
+                events = []
+            for event_id, data in events:
+                await send({'type': 'http.response.body', 'body': format_event(event_id, data), 'more_body': True})
+                last = parse_event_id(event_id)
+        while not disconnected.done() and not queue.lagging and time.time() < expires:
+            getter = asyncio.ensure_future(queue.get())
+            timeout = min(settings.RATES_STREAM_HEARTBEAT, max(expires - time.time(), 0))
+            await asyncio.wait([getter, disconnected], timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not getter.done():
+                getter.cancel()
+                if not disconnected.done():
+                    await send({'type': 'http.response.body', 'body': b': ping\n\n', 'more_body': True})
+                continue
+            event = getter.result()
+            event_key = parse_event_id(event['id'])
+            if last is not None and event_key <= last:
+                #already replayed from the stream
+                continue
+            last = event_key
+            await send({'type': 'http.response.body', 'body': format_event(event['id'], event['data']), 'more_body': True})
+        if not disconnected.done():
+            await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        hub.unsubscribe(loop, queue)
+        disconnected.cancel()
+
+async def wait_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
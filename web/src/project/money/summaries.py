@@ -0,0 +1,112 @@
+import json
+import logging
+from decimal import Decimal
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch
+from redis import RedisError
+from money.models import Account
+from money.rates import get_rate_table
+from money.amounts import Money, currency_scale
+from project.redis import get_redis
+from project.routers import read_alias
+from users.models import User
+
+info_logger = logging.getLogger('info')
+
+#version of the summary is read together with the summary of this version in one round trip
+READ_SUMMARY_SCRIPT = """
+local version = redis.call('GET', KEYS[1]) or '0'
+return {version, redis.call('GET', KEYS[2] .. version)}
+"""
+
+def version_key(user_pk):
+    return 'money:summary:version:%s' % user_pk
+
+def summary_key(user_pk, version=''):
+    return 'money:summary:%s:%s' % (user_pk, version)
+
+def build_summaries(user_pks):
+    """Summaries {user_pk: {'user': ..., 'accounts': [...]}} of existing users read from the primary by three queries.
+    Accounts have the same fields as AccountForOwnerSerializer gives.
+    """
+    #serializers import the transfer engine which updates summaries
+    from money.serializers import AccountForOwnerSerializer
+    from users.serializers import UserSerializer
+    #the replica may not have the last transfer yet
+    token = read_alias.set(None)
+    try:
+        users = User.objects.filter(pk__in=user_pks).prefetch_related(Prefetch('accounts',
+            queryset=Account.objects.select_related('currency').prefetch_related('shard_balances').order_by('pk')))
+        return {user.pk: {'user': UserSerializer(user).data, 'accounts': AccountForOwnerSerializer(user.accounts.all(), many=True).data}
+            for user in users}
+    finally:
+        read_alias.reset(token)
+
+def refresh_summaries(user_pks):
+    """Write-through of summaries after commit of the change of accounts.
+
+    Versions are increased before summaries are read, so the new version is never visible with older data:
+    a summary read after the increase contains every commit made before it, a later commit increases the version again.
+    Until the increase the previous version stays current, see summary_changed for the stale window.
+    """
+    user_pks = sorted(set(user_pks))
+    try:
+        redis = get_redis()
+        with redis.pipeline() as pipe:
+            for user_pk in user_pks:
+                pipe.incr(version_key(user_pk))
+            versions = pipe.execute()
+        summaries = build_summaries(user_pks)
+        with redis.pipeline(transaction=False) as pipe:
+            for user_pk, version in zip(user_pks, versions):
+                if user_pk in summaries:
+                    pipe.set(summary_key(user_pk, version), json.dumps(summaries[user_pk]), ex=settings.ACCOUNT_SUMMARY_TTL)
+            pipe.execute()
+    except RedisError:
+        #summaries of the old version expire in ACCOUNT_SUMMARY_TTL seconds
+        info_logger.info('refresh_summaries: summaries of users %s are not updated' % user_pks)
+
+def summary_changed(user_pks):
+    """Accounts of the users are changed by the current transaction, summaries are rewritten after commit.
+
+    The version is increased by on_commit, not in the transaction, so between COMMIT and the INCR of refresh_summaries
+    (one Redis round trip, the callback runs in the same request right after COMMIT) get_summary of other requests
+    still returns the summary of the previous version without this change. A synchronous request making the change
+    answers after the callback, so its client reads its own change (asynchronous transfers give no such guarantee).
+    If Redis is not available at that moment the previous version stays current until it expires
+    in ACCOUNT_SUMMARY_TTL seconds or the next change of the user.
+    """
+    user_pks = list(user_pks)
+    transaction.on_commit(lambda: refresh_summaries(user_pks))
+
+def get_summary(user_pk):
+    """Summary of the user's accounts, cache hit is one Redis round trip without SQL queries
+
+    :returns: summary dict or None if there is no such user
+    """
+    try:
+        redis = get_redis()
+        version, cached = redis.register_script(READ_SUMMARY_SCRIPT)(keys=[version_key(user_pk), summary_key(user_pk)])
+    except RedisError:
+        info_logger.info('get_summary: Redis is not available')
+        return build_summaries([user_pk]).get(user_pk)
+    if cached is not None:
+        return json.loads(cached)
+    summary = build_summaries([user_pk]).get(user_pk)
+    if summary is not None:
+        #a transfer committed meanwhile has increased the version, so this summary is never read
+        try:
+            redis.set(summary_key(user_pk, version.decode()), json.dumps(summary), ex=settings.ACCOUNT_SUMMARY_TTL)
+        except RedisError:
+            pass
+    return summary
+
+def summary_total(summary, currency):
+    """Total balance of the summary's accounts in the currency by the current rates"""
+    rates = get_rate_table()
+    scale = currency_scale(currency)
+    total = Money(0, scale)
+    for account in summary['accounts']:
+        total += rates.convert_money(account['currency']['name'], currency, Money.from_decimal(Decimal(account['balance'])))
+    return total.to_decimal()
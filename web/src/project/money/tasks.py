@@ -1,30 +1,46 @@
-import re
-from datetime import date
-import requests
-from django.core.exceptions import ObjectDoesNotExist
-from django.db.models import Q
 from django.conf import settings
 from project.celery import app
-from money.models import Currency, Course
+from money.rates import bump_rates_version
+from money.streams import publish_rates_update
+from money.ingestion import ingest_rates
+from money.ledger import create_checkpoints
+from money.shards import consolidate_all
+from money.pipeline import process_transfer_request
+from money.partitions import manage_partitions
 
 @app.task(bind = True, expires = 120, acks_late = True)
-def update_courses(self, fetch_courses_url = settings.FETCH_COURSES_URL):
+def update_courses(self, fetch_courses_url = None):
     """Celery task function is intended for periodic fetching currency courses"""
-    response = requests.get(fetch_courses_url)
-    response = response.json()
-    rates = response['rates']
-    base_currency_name = response['base']
-    date_str = response['date']
-    m = re.search(r'(\d{4})-(\d{2})-(\d{2})', date_str)
-    if m:
-        dt = date(int(m.group(1)), int(m.group(2)), int(m.group(3)))
-    else:
-        raise Exception('Date format "yyyy-mm-dd" was changed in json!')
+    urls = [fetch_courses_url] if fetch_courses_url else settings.FETCH_COURSES_URLS
+    changed = ingest_rates(urls)
+    if changed:
+        #cross-rate matrix is built once and published, workers load it on the next version check
+        table = bump_rates_version()
+        #connected clients of the rates stream get the diff
+        publish_rates_update(table, changed)
+    return sorted(changed)
 
-    base_currency, created = Currency.objects.get_or_create(name=base_currency_name)
-    for currency_name in rates:
-        currency = Currency.objects.get_or_create(name=currency_name)
-        Course.objects.get_or_create(Q(base_currency=base_currency) & Q(currency=currency) & Q(date=dt), defaults={'course': rates[currency_name]})
+@app.task(bind = True, expires = 3600, acks_late = True)
+def checkpoint_balances(self):
+    """Celery task function is intended for periodic checkpoints of account balances"""
+    return create_checkpoints()
+
+@app.task(bind = True, expires = 60, acks_late = True)
+def consolidate_shards(self):
+    """Celery task function is intended for periodic moving of sub-balances of sharded accounts to their balances"""
+    consolidate_all()
+
+@app.task(bind = True, acks_late = True)
+def apply_transfer_request(self, transfer_request_pk):
+    """Celery task function applies transfer submitted asynchronously,
+    it is routed to the queue of sender's account by money.pipeline.transfer_queue"""
+    return process_transfer_request(transfer_request_pk).status
+
+@app.task(bind = True, expires = 3600, acks_late = True)
+def manage_transfer_partitions(self):
+    """Celery task function is intended for periodic creation of partitions of the next months and detaching of old ones"""
+    created, detached = manage_partitions()
+    return {'created': created, 'detached': detached}
 
 #Config dictionary for periodic Celery task
 app.conf.beat_schedule = {
@@ -32,4 +48,16 @@ app.conf.beat_schedule = {
         'task': 'money.tasks.update_courses',
         'schedule': settings.FETCH_COURSES_FREQUENCY_IN_SECONDS
     },
+    'balance-checkpoints': {
+        'task': 'money.tasks.checkpoint_balances',
+        'schedule': settings.BALANCE_CHECKPOINT_FREQUENCY_IN_SECONDS
+    },
+    'shard-consolidation': {
+        'task': 'money.tasks.consolidate_shards',
+        'schedule': settings.SHARD_CONSOLIDATION_FREQUENCY_IN_SECONDS
+    },
+    'transfer-partitions': {
+        'task': 'money.tasks.manage_transfer_partitions',
+        'schedule': settings.TRANSFER_PARTITIONS_FREQUENCY_IN_SECONDS
+    },
 }
\ No newline at end of file
@@ -1,14 +1,49 @@
 import os
 import json
+import gzip
+import base64
 import logging
 import random
+import asyncio
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
 from decimal import Decimal
 from datetime import datetime
 import requests
-from django.test import TestCase
-from rest_framework.test import APIRequestFactory
+from django.conf import settings
+from django.test import TestCase, SimpleTestCase, override_settings
+from django.db import connection, connections
+from django.db.models import Sum
+from django.http import StreamingHttpResponse
+from asgiref.sync import sync_to_async
+from rest_framework.test import APIRequestFactory, APIClient
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.parsers import JSONParser
 from project.settings import DATABASES
 from money.models import *
+from money import rates as rates_module
+from money.rates import RateTable, RateTimeline, bump_rates_version, convert_amounts
+from money.amounts import Money, round_half_even
+from money.pagination import encode_cursor, decode_cursor
+from money.caching import get_query_hash, etag_matches
+from money.streams import parse_event_id, authenticate
+from money.idempotency import idempotent_response, store_key
+from project.routers import ReplicaRouter, REPLICA, read_alias
+from project.querybudget import QueryBudgetMiddleware, QueryBudgetExceeded
+from project.redis import get_redis
+from project.async_views import StreamingASGIHandler, run_view
+from money.engine import execute_transfer, execute_transfer_batch, TransferError, TransferBatchError, DuplicateTransferError
+from money.statements import statement_page
+from money.ledger import balance_at, create_checkpoints
+from money.shards import enable_sharding, consolidate_all
+from money.pipeline import submit_transfer, process_transfer_request
+from money.ingestion import ingest_rates
+from money import revaluation as revaluation_module
+from money.revaluation import revaluation, revalue_users
+from money.summaries import get_summary, refresh_summaries
+from money.exports import export_stream
+from money.partitions import manage_partitions, add_months, partition_name
 from users.models import *
 
 info_logger = logging.getLogger('info')
@@ -216,3 +251,772 @@ class TestMoneyOperations(TestCase):
         user_list = r.json()
         new_user = list(filter(lambda user: user['username'] == new_username, user_list))
         self.assertIsNotNone(new_user, 'User %s was not updated!' % user['email'])
+
+class TestRateTable(SimpleTestCase):
+    """In-memory rate table must give the same results as convert_amount"""
+    def setUp(self):
+        self.table = RateTable.from_pairs({
+            ('EUR', 'USD'): (datetime(2020, 2, 14), Decimal('1.0836')),
+            ('EUR', 'RUB'): (datetime(2020, 2, 14), Decimal('69.0202')),
+        })
+
+    def test_convert(self):
+        course_from, course_to, converted_amount = self.table.convert('USD', 'RUB', 100)
+        self.assertEqual(converted_amount, Decimal('69.0202')/Decimal('1.0836') * Decimal(100))
+
+    def test_base_currency(self):
+        course_from, course_to, converted_amount = self.table.convert('EUR', 'USD', 10)
+        self.assertEqual(course_from, 1)
+        self.assertEqual(converted_amount, Decimal('10.836'))
+
+    def test_unknown_currency(self):
+        with self.assertRaises(Exception):
+            self.table.convert('XXX', 'USD', 1)
+
+    def test_matrix(self):
+        n = len(self.table.currencies)
+        self.assertEqual(len(self.table.matrix), n * n)
+        self.assertEqual(self.table.rate('RUB', 'RUB'), 1)
+        self.assertEqual(self.table.rate('USD', 'RUB'), Decimal('69.0202')/Decimal('1.0836'))
+
+    def test_json(self):
+        table = RateTable.from_json(self.table.to_json())
+        self.assertEqual(table.matrix, self.table.matrix)
+        self.assertEqual(table.convert('USD', 'RUB', 100), self.table.convert('USD', 'RUB', 100))
+
+    def test_convert_money(self):
+        converted_amount = self.table.convert_money('USD', 'RUB', Money.from_decimal(100))
+        self.assertEqual(converted_amount.to_decimal(), (Decimal('69.0202')/Decimal('1.0836') * Decimal(100)).quantize(Decimal('0.0001')))
+
+    def test_several_bases(self):
+        #courses of the second provider are normalised to EUR through its base currency
+        table = RateTable.from_pairs({
+            ('EUR', 'USD'): (datetime(2020, 2, 14), Decimal('1.0836')),
+            ('EUR', 'RUB'): (datetime(2020, 2, 14), Decimal('69.0202')),
+            ('USD', 'GBP'): (datetime(2020, 2, 15), Decimal('0.8')),
+        })
+        self.assertEqual(table.course('EUR'), 1)
+        self.assertEqual(table.course('GBP'), Decimal('1.0836') * Decimal('0.8'))
+        self.assertEqual(table.rate('USD', 'GBP'), Decimal('0.8'))
+        self.assertEqual(table.rate('EUR', 'RUB'), Decimal('69.0202'))
+
+class TestMoney(SimpleTestCase):
+    """Scaled-integer amounts must be lossless at the Decimal boundary and round half to even"""
+    def test_round_half_even(self):
+        self.assertEqual(round_half_even(5, 2), 2)
+        self.assertEqual(round_half_even(7, 2), 4)
+        self.assertEqual(round_half_even(-5, 2), -2)
+        self.assertEqual(round_half_even(11, 4), 3)
+
+    def test_decimal_roundtrip(self):
+        for value in ('0', '0.0001', '-12.5', '1234567890123.9999'):
+            self.assertEqual(Money.from_decimal(Decimal(value)).to_decimal(), Decimal(value))
+        with self.assertRaises(ValueError):
+            Money.from_decimal(Decimal('0.00001'))
+        self.assertEqual(Money.from_decimal(Decimal('0.00015'), exact=False), Money(2))
+        #digits beyond the precision of decimal context are not rounded away
+        with self.assertRaises(ValueError):
+            Money.from_decimal(Decimal('1.000000000000000000000000000001'))
+        self.assertEqual(Money.from_decimal('12.34'), Money(123400))
+
+    def test_arithmetic(self):
+        self.assertEqual(Money.from_decimal('1.1') + Money.from_decimal('2.2'), Money.from_decimal('3.3'))
+        self.assertTrue(Money.from_decimal('1') < Money.from_decimal('1.0001'))
+        self.assertEqual(sum([Money(1), Money(2)], Money(0)), Money(3))
+
+    def test_convert(self):
+        #0.0003 * 1/2 = 0.00015 is rounded to even 0.0002, 0.0005 * 1/2 to 0.0002
+        self.assertEqual(Money(3).convert((1, 2)), Money(2))
+        self.assertEqual(Money(5).convert((1, 2)), Money(2))
+        self.assertEqual(Money.from_decimal('10.5').convert((3, 1), 0), Money(32, 0))
+
+class TestRateTimeline(SimpleTestCase):
+    """As-of lookups must take the latest course strictly before date"""
+    def setUp(self):
+        self.timeline = RateTimeline([
+            ('EUR', 'USD', datetime(2020, 2, 13), Decimal('1.0800')),
+            ('EUR', 'USD', datetime(2020, 2, 14), Decimal('1.0836')),
+            ('EUR', 'USD', datetime(2020, 2, 17), Decimal('1.0841')),
+        ])
+
+    def test_course_before_date(self):
+        self.assertEqual(self.timeline.course('USD', datetime(2020, 2, 14)), Decimal('1.0800'))
+        self.assertEqual(self.timeline.course('USD', datetime(2020, 2, 16)), Decimal('1.0836'))
+        self.assertEqual(self.timeline.course('USD', datetime(2021, 1, 1)), Decimal('1.0841'))
+
+    def test_base_currency(self):
+        self.assertEqual(self.timeline.course('EUR', datetime(2020, 2, 14)), 1)
+        with self.assertRaises(Exception):
+            self.timeline.course('EUR', datetime(2020, 2, 13))
+
+    def test_no_course_yet(self):
+        with self.assertRaises(Exception):
+            self.timeline.course('USD', datetime(2020, 2, 13))
+
+    def test_several_bases(self):
+        #the second provider quotes RUB against USD, its course is not a course against EUR
+        timeline = RateTimeline([
+            ('EUR', 'USD', datetime(2020, 2, 13), Decimal('1.0800')),
+            ('EUR', 'GBP', datetime(2020, 2, 13), Decimal('0.8300')),
+            ('USD', 'RUB', datetime(2020, 2, 13), Decimal('70')),
+            ('EUR', 'USD', datetime(2020, 2, 14), Decimal('1.1000')),
+        ])
+        self.assertEqual(timeline.course('RUB', datetime(2020, 2, 14)), Decimal('75.6'))
+        self.assertEqual(timeline.course('RUB', datetime(2020, 2, 15)), Decimal('77'))
+        self.assertEqual(timeline.convert('EUR', 'RUB', Decimal('2'), datetime(2020, 2, 14))[2], Decimal('151.2'))
+
+class TestHistoricalConvertation(TestCase):
+    """Convertation on date must not mix courses of providers with different bases"""
+    def setUp(self):
+        eur, usd, gbp, rub = [Currency.objects.create(name=name) for name in ('EUR', 'USD', 'GBP', 'RUB')]
+        Course.objects.create(base_currency=eur, currency=usd, course=Decimal('1.08'), date=datetime(2020, 2, 13))
+        Course.objects.create(base_currency=eur, currency=gbp, course=Decimal('0.83'), date=datetime(2020, 2, 13))
+        Course.objects.create(base_currency=usd, currency=rub, course=Decimal('70'), date=datetime(2020, 2, 13))
+
+    def test_convert_amount(self):
+        date = datetime(2020, 2, 14)
+        self.assertEqual(convert_amount('EUR', 'RUB', Decimal('2'), date=date)[2], Decimal('151.2'))
+        self.assertEqual(convert_amount('USD', 'RUB', Decimal('2'), date=date)[2], Decimal('140'))
+        self.assertEqual(convert_amount('EUR', 'GBP', Decimal('100'), date=date)[2], Decimal('83'))
+        with self.assertRaises(Exception):
+            convert_amount('EUR', 'RUB', Decimal('2'), date=datetime(2020, 2, 13))
+
+    def test_convert_amounts(self):
+        date = datetime(2020, 2, 14)
+        self.assertEqual(convert_amounts([('EUR', 'RUB', Decimal('2'), date), ('GBP', 'RUB', Decimal('0.83'), date)]),
+            [Decimal('151.2'), Decimal('75.6')])
+
+class TestCursor(SimpleTestCase):
+    """Cursor of keyset pagination"""
+    def test_round_trip(self):
+        created = datetime(2020, 3, 5, 9, 41, 12, 345678)
+        self.assertEqual(decode_cursor(encode_cursor(created, 42)), (created, 42))
+
+    def test_bad_cursor(self):
+        with self.assertRaises(ValueError):
+            decode_cursor('not a cursor')
+
+class TestRatesCache(SimpleTestCase):
+    """Cache key and revalidation of responses cached by the rates version"""
+    def get_request(self, url, **headers):
+        return Request(APIRequestFactory().get(url, **headers))
+
+    def test_query_hash(self):
+        self.assertEqual(get_query_hash(self.get_request('/?latest=true&limit=5')), get_query_hash(self.get_request('/?limit=5&latest=true')))
+        self.assertNotEqual(get_query_hash(self.get_request('/?limit=5')), get_query_hash(self.get_request('/?limit=6')))
+
+    def test_etag_matches(self):
+        self.assertTrue(etag_matches(self.get_request('/', HTTP_IF_NONE_MATCH='"7-abc"'), '"7-abc"'))
+        self.assertTrue(etag_matches(self.get_request('/', HTTP_IF_NONE_MATCH='"6-abc", "7-abc-gzip"'), '"7-abc"'))
+        self.assertFalse(etag_matches(self.get_request('/', HTTP_IF_NONE_MATCH='"6-abc"'), '"7-abc"'))
+        self.assertFalse(etag_matches(self.get_request('/'), '"7-abc"'))
+
+class TestRatesStream(SimpleTestCase):
+    """Event ids of the rates stream"""
+    def test_event_id_order(self):
+        self.assertLess(parse_event_id('1586167200000-9'), parse_event_id('1586167200001-0'))
+        self.assertIsNone(parse_event_id('bad'))
+        self.assertIsNone(parse_event_id(None))
+
+    def test_authentication_required(self):
+        self.assertIsNone(authenticate({'headers': [], 'query_string': b''}))
+        self.assertIsNone(authenticate({'headers': [(b'authorization', b'Bearer bad')], 'query_string': b''}))
+
+class TestIdempotency(SimpleTestCase):
+    """Marker of the request in progress expires sooner than the saved response"""
+    def test_marker_ttl(self):
+        request = Request(APIRequestFactory().post('/', {'amount': '1'}, format='json', HTTP_IDEMPOTENCY_KEY='ttl-1'), parsers=[JSONParser()])
+        request.user = User(pk=-1)
+        redis = get_redis()
+        key = store_key(-1, 'ttl-1')
+        redis.delete(key)
+        ttls = []
+        def handle(request):
+            ttls.append(redis.ttl(key))
+            return Response(data={'id': 1}, status=201)
+        try:
+            self.assertEqual(idempotent_response(request, handle).status_code, 201)
+            self.assertLessEqual(ttls[0], settings.IDEMPOTENCY_PENDING_TTL)
+            self.assertGreater(redis.ttl(key), settings.IDEMPOTENCY_PENDING_TTL)
+        finally:
+            redis.delete(key)
+
+class TestStreamingASGIHandler(SimpleTestCase):
+    """Streamed body is read chunk by chunk by one thread outside of the event loop"""
+    def test_streamed_body(self):
+        threads = []
+        def body():
+            for i in range(3):
+                threads.append(threading.get_ident())
+                yield str(i)
+        messages = []
+        async def send(message):
+            messages.append(message)
+        asyncio.run(StreamingASGIHandler().send_response(StreamingHttpResponse(body()), send))
+        self.assertEqual(messages[0]['status'], 200)
+        self.assertEqual([message.get('body') for message in messages[1:]], [b'0', b'1', b'2', None])
+        self.assertEqual(len(set(threads)), 1)
+        self.assertNotEqual(threads[0], threading.get_ident())
+
+class TestReplicaRouter(SimpleTestCase):
+    """Reads go to the replica only inside views which have chosen it"""
+    def test_routing(self):
+        router = ReplicaRouter()
+        self.assertIsNone(router.db_for_read(Transfer))
+        token = read_alias.set(REPLICA)
+        try:
+            self.assertEqual(router.db_for_read(Transfer), REPLICA)
+            self.assertEqual(router.db_for_write(Transfer), 'default')
+        finally:
+            read_alias.reset(token)
+        self.assertFalse(router.allow_migrate(REPLICA, 'money'))
+        self.assertIsNone(router.allow_migrate('default', 'money'))
+
+class TestTransferEngine(TestCase):
+    """Transfer engine on test database"""
+    def setUp(self):
+        eur = Currency.objects.create(name='EUR')
+        usd = Currency.objects.create(name='USD')
+        Course.objects.create(base_currency=eur, currency=usd, course=Decimal('2'), date=datetime(2020, 2, 14))
+        self.sender = User.objects.create_user('engine1@server.org', 'wsx123qaz', username='engine1')
+        self.receiver = User.objects.create_user('engine2@server.org', 'wsx123qaz', username='engine2')
+        self.sender_account = Account.objects.create(user=self.sender, currency=usd, balance=Decimal('100'))
+        self.receiver_account = Account.objects.create(user=self.receiver, currency=eur, balance=Decimal('10'))
+
+    def test_transfer(self):
+        transfer = execute_transfer(self.sender, self.sender_account.pk, self.receiver_account.pk, Decimal('40'))
+        self.assertEqual(transfer.amount, Decimal('40'))
+        self.sender_account.refresh_from_db()
+        self.receiver_account.refresh_from_db()
+        self.assertEqual(self.sender_account.balance, Decimal('60'))
+        self.assertEqual(self.receiver_account.balance, Decimal('30'))
+
+    def test_rejected_transfers(self):
+        with self.assertRaises(TransferError):
+            execute_transfer(self.sender, self.sender_account.pk, self.receiver_account.pk, Decimal('100.01'))
+        with self.assertRaises(TransferError):
+            execute_transfer(self.receiver, self.sender_account.pk, self.receiver_account.pk, Decimal('1'))
+        with self.assertRaises(TransferError):
+            execute_transfer(self.sender, self.sender_account.pk, self.sender_account.pk, Decimal('1'))
+        self.assertEqual(Transfer.objects.count(), 0)
+
+    def test_batch_atomic(self):
+        items = [(self.receiver_account.pk, Decimal('30')), (self.receiver_account.pk, Decimal('80'))]
+        with self.assertRaises(TransferBatchError):
+            execute_transfer_batch(self.sender, self.sender_account.pk, items, atomic=True, chunk_size=1)
+        self.sender_account.refresh_from_db()
+        self.assertEqual(self.sender_account.balance, Decimal('100'))
+        self.assertEqual(Transfer.objects.count(), 0)
+
+    def test_batch_best_effort(self):
+        items = [(self.receiver_account.pk, Decimal('30')), (self.receiver_account.pk, Decimal('80')), (self.receiver_account.pk, Decimal('70'))]
+        results = execute_transfer_batch(self.sender, self.sender_account.pk, items, atomic=False, chunk_size=2)
+        self.assertIsInstance(results[0], Transfer)
+        self.assertIsInstance(results[1], TransferError)
+        self.assertIsInstance(results[2], Transfer)
+        self.sender_account.refresh_from_db()
+        self.receiver_account.refresh_from_db()
+        self.assertEqual(self.sender_account.balance, Decimal('0'))
+        self.assertEqual(self.receiver_account.balance, Decimal('60'))
+
+    def test_statement(self):
+        execute_transfer(self.sender, self.sender_account.pk, self.receiver_account.pk, Decimal('10'))
+        execute_transfer(self.receiver, self.receiver_account.pk, self.sender_account.pk, Decimal('5'))
+        execute_transfer(self.sender, self.sender_account.pk, self.receiver_account.pk, Decimal('20'))
+        transfers, next_cursor = statement_page(self.sender_account, None, 2)
+        self.assertEqual([transfer.amount for transfer in transfers], [Decimal('20'), Decimal('5')])
+        transfers, next_cursor = statement_page(self.sender_account, next_cursor, 2)
+        self.assertEqual([transfer.amount for transfer in transfers], [Decimal('10')])
+        self.assertIsNone(next_cursor)
+
+    def test_ledger(self):
+        first = execute_transfer(self.sender, self.sender_account.pk, self.receiver_account.pk, Decimal('10'))
+        self.assertEqual(LedgerEntry.objects.filter(transfer=first).aggregate(total=Sum('amount'))['total'], Decimal('-5'))
+        self.assertEqual(balance_at(self.sender_account, first.created), Decimal('90'))
+        self.assertEqual(create_checkpoints(), 2)
+        second = execute_transfer(self.sender, self.sender_account.pk, self.receiver_account.pk, Decimal('20'))
+        self.assertEqual(balance_at(self.sender_account, first.created), Decimal('90'))
+        self.assertEqual(balance_at(self.sender_account, second.created), Decimal('70'))
+        self.assertEqual(balance_at(self.receiver_account, second.created), Decimal('25'))
+        self.assertEqual(create_checkpoints(), 2)
+        self.assertEqual(create_checkpoints(), 0)
+
+    def test_checkpoint_of_late_commit(self):
+        #entry of the other account with a lower id is committed after the checkpoint of the sender
+        other = Account.objects.create(user=self.receiver, currency=self.sender_account.currency, balance=Decimal('0'))
+        late_id = LedgerEntry.objects.create(account=other, amount=0, created=datetime.now()).pk
+        LedgerEntry.objects.filter(pk=late_id).delete()
+        execute_transfer(self.sender, self.sender_account.pk, self.receiver_account.pk, Decimal('10'))
+        self.assertEqual(create_checkpoints(), 2)
+        LedgerEntry.objects.create(id=late_id, account=other, amount=0, created=datetime.now())
+        self.assertEqual(create_checkpoints(), 1)
+        self.assertEqual(BalanceCheckpoint.objects.get(account=other).entry_id, late_id)
+
+    def test_sharded_receiver(self):
+        enable_sharding(self.receiver_account.pk, 4)
+        execute_transfer(self.sender, self.sender_account.pk, self.receiver_account.pk, Decimal('40'))
+        self.receiver_account.refresh_from_db()
+        self.assertEqual(self.receiver_account.balance, Decimal('10'))
+        self.assertEqual(self.receiver_account.total_balance, Decimal('30'))
+        #debit of sharded account pulls money from shards
+        execute_transfer(self.receiver, self.receiver_account.pk, self.sender_account.pk, Decimal('25'))
+        self.receiver_account.refresh_from_db()
+        self.assertEqual(self.receiver_account.total_balance, Decimal('5'))
+        consolidate_all()
+        self.receiver_account.refresh_from_db()
+        self.assertEqual(self.receiver_account.balance, Decimal('5'))
+
+    def test_transfer_request(self):
+        transfer_request, created = submit_transfer(self.sender, 'key-1', self.sender_account.pk, self.receiver_account.pk, Decimal('10'))
+        self.assertTrue(created)
+        same_request, created = submit_transfer(self.sender, 'key-1', self.sender_account.pk, self.receiver_account.pk, Decimal('10'))
+        self.assertFalse(created)
+        self.assertEqual(same_request.pk, transfer_request.pk)
+        self.assertEqual(process_transfer_request(transfer_request.pk).status, TransferRequest.DONE)
+        #repeated delivery of the task does not move money again
+        process_transfer_request(transfer_request.pk)
+        self.sender_account.refresh_from_db()
+        self.assertEqual(self.sender_account.balance, Decimal('90'))
+        failed_request, _ = submit_transfer(self.sender, 'key-2', self.sender_account.pk, self.receiver_account.pk, Decimal('1000'))
+        self.assertEqual(process_transfer_request(failed_request.pk).status, TransferRequest.FAILED)
+
+    def test_idempotency_key(self):
+        transfer = execute_transfer(self.sender, self.sender_account.pk, self.receiver_account.pk, Decimal('10'), idempotency_key='retry-1')
+        with self.assertRaises(DuplicateTransferError) as context:
+            execute_transfer(self.sender, self.sender_account.pk, self.receiver_account.pk, Decimal('10'), idempotency_key='retry-1')
+        self.assertEqual(context.exception.transfer.pk, transfer.pk)
+        self.sender_account.refresh_from_db()
+        self.assertEqual(self.sender_account.balance, Decimal('90'))
+
+class TestTransferBatchView(TestCase):
+    """Batch endpoint: JSON and NDJSON bodies, atomic and best-effort modes, result of every item"""
+    def setUp(self):
+        eur = Currency.objects.create(name='EUR')
+        Course.objects.create(base_currency=eur, currency=Currency.objects.create(name='USD'), course=Decimal('2'), date=datetime(2020, 2, 14))
+        rates_module._table = None
+        self.sender = User.objects.create_user('batch1@server.org', 'wsx123qaz', username='batch1')
+        self.sender_account = Account.objects.create(user=self.sender, currency=eur, balance=Decimal('100'))
+        self.receiver_account = Account.objects.create(user=User.objects.create_user('batch2@server.org', 'wsx123qaz', username='batch2'),
+            currency=eur, balance=Decimal('0'))
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.sender)
+
+    def item(self, amount, sender_account_pk=None):
+        return {'sender_account': sender_account_pk or self.sender_account.pk, 'receiver_account': self.receiver_account.pk, 'amount': amount}
+
+    def balance(self):
+        self.sender_account.refresh_from_db()
+        return self.sender_account.balance
+
+    def test_atomic(self):
+        response = self.client.post('/api/money/transfers/batch/', [self.item('30'), self.item('20')], format='json')
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual([item['index'] for item in data], [0, 1])
+        self.assertEqual([item['status'] for item in data], ['created', 'created'])
+        self.assertEqual([Decimal(str(item['amount'])) for item in data], [Decimal('30'), Decimal('20')])
+        self.assertEqual(set(Transfer.objects.values_list('pk', flat=True)), {item['pk'] for item in data})
+        self.assertEqual(self.balance(), Decimal('50'))
+
+    def test_atomic_rolled_back(self):
+        response = self.client.post('/api/money/transfers/batch/', [self.item('30'), self.item('80')], format='json')
+        self.assertEqual(response.status_code, 400)
+        data = response.json()
+        self.assertEqual([item['status'] for item in data], ['rolled_back', 'error'])
+        self.assertEqual(data[1]['error'], 'Unsufficient balance!')
+        self.assertEqual(self.balance(), Decimal('100'))
+        self.assertEqual(Transfer.objects.count(), 0)
+
+    def test_best_effort_ndjson(self):
+        body = ''.join(json.dumps(item) + '\n' for item in [self.item('30'), self.item('80'), self.item('20')])
+        response = self.client.post('/api/money/transfers/batch/?mode=best_effort', body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual([item['status'] for item in data], ['created', 'error', 'created'])
+        self.assertEqual(Transfer.objects.count(), 2)
+        self.assertEqual(self.balance(), Decimal('50'))
+
+    def test_validation_errors(self):
+        url = '/api/money/transfers/batch/'
+        self.assertEqual(self.client.post(url + '?mode=all', [self.item('1')], format='json').status_code, 400)
+        self.assertEqual(self.client.post(url, [], format='json').status_code, 400)
+        self.assertEqual(self.client.post(url, '{"amount": 1}\nnot json\n', content_type='application/x-ndjson').status_code, 400)
+        other_account = Account.objects.create(user=self.sender, currency=Currency.objects.get(name='USD'), balance=Decimal('10'))
+        items = [self.item('1'), {'amount': '1'}, self.item('1', sender_account_pk=other_account.pk)]
+        response = self.client.post(url + '?mode=best_effort', items, format='json')
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual([item['status'] for item in data], ['created', 'error', 'error'])
+        self.assertIn('sender_account', data[1]['error'])
+        self.assertEqual(data[2]['error'], {'error': 'All transfers must be sent from the same account'})
+        #invalid items roll back the whole batch in atomic mode
+        response = self.client.post(url, items, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([item['status'] for item in response.json()], ['rolled_back', 'error', 'error'])
+        self.assertEqual(Transfer.objects.count(), 1)
+
+class TestTransferListView(TestCase):
+    """Keyset pages of the transfer list and streamed output"""
+    def setUp(self):
+        eur = Currency.objects.create(name='EUR')
+        self.owner = User.objects.create_user('list1@server.org', 'wsx123qaz', username='list1')
+        sender = Account.objects.create(user=self.owner, currency=eur, balance=Decimal('100'))
+        receiver = Account.objects.create(user=User.objects.create_user('list2@server.org', 'wsx123qaz', username='list2'), currency=eur, balance=0)
+        self.transfers = [Transfer.objects.create(sender_account=sender, receiver_account=receiver, amount=i + 1) for i in range(5)]
+        #rows with equal dates are ordered by primary key
+        Transfer.objects.filter(pk__in=[transfer.pk for transfer in self.transfers]).update(created=datetime(2020, 2, 14, 12))
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.owner)
+
+    def test_pages_of_equal_dates(self):
+        pks = []
+        url = '/api/money/transfers/?limit=2'
+        pages = 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pks.extend(transfer['pk'] for transfer in response.json())
+            pages += 1
+            url = response['Link'][1:response['Link'].index('>')] if response.has_header('Link') else None
+        self.assertEqual(pages, 3)
+        self.assertEqual(pks, sorted((transfer.pk for transfer in self.transfers), reverse=True))
+
+    def test_tampered_cursor(self):
+        for cursor in ('not-a-cursor', base64.urlsafe_b64encode(b'2020-02-14T12:00:00|x').decode()):
+            response = self.client.get('/api/money/transfers/', {'cursor': cursor})
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json(), {'error': 'Bad cursor value'})
+
+    def test_stream(self):
+        expected = sorted((transfer.pk for transfer in self.transfers), reverse=True)
+        response = self.client.get('/api/money/transfers/', {'stream': 'ndjson'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['pk'] for line in lines], expected)
+        response = self.client.get('/api/money/transfers/', {'stream': 'json', 'date_to': '2020-02-14'})
+        self.assertEqual(json.loads(b''.join(response.streaming_content)), [])
+        response = self.client.get('/api/money/transfers/', {'stream': 'json'})
+        self.assertEqual([transfer['pk'] for transfer in json.loads(b''.join(response.streaming_content))], expected)
+        self.assertEqual(self.client.get('/api/money/transfers/', {'stream': 'xml'}).status_code, 400)
+
+class TestQueryBudget(TestCase):
+    """Count of queries of list endpoints must not grow with count of rows"""
+    def setUp(self):
+        self.client = APIClient()
+        self.owner = User.objects.create_user('budget@server.org', 'wsx123qaz', username='budget')
+        self.client.force_authenticate(user=self.owner)
+        self.other = Account.objects.create(user=User.objects.create_user('budget2@server.org', 'wsx123qaz', username='budget2'),
+            currency=Currency.objects.create(name='EUR'), balance=0)
+
+    def add_accounts(self, count):
+        for i in range(count):
+            account = Account.objects.create(user=self.owner, currency=Currency.objects.create(name='C%s' % Account.objects.count()), balance=100)
+            Transfer.objects.create(sender_account=account, receiver_account=self.other, amount=1)
+
+    def test_list_endpoints(self):
+        urls = ['/api/users/accounts/', '/api/users/%s/accounts/' % self.owner.pk, '/api/money/transfers/', '/api/users/']
+        for count in (1, 20):
+            self.add_accounts(count)
+            for url in urls:
+                #QueryBudgetMiddleware raises QueryBudgetExceeded in tests
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200, url)
+
+    def test_budget_exceeded(self):
+        request = APIRequestFactory().get('/')
+        request.query_budget = 0
+        middleware = QueryBudgetMiddleware(lambda request: list(Currency.objects.all()))
+        with self.assertRaises(QueryBudgetExceeded):
+            middleware(request)
+
+    def test_async_view_queries(self):
+        #queries of async views are made in a thread of the pool, not in the thread of the middleware
+        def view(request):
+            try:
+                return list(Currency.objects.all())
+            finally:
+                connections.close_all()
+        async def get_response(request):
+            return await sync_to_async(run_view, thread_sensitive=False)(view, request)
+        request = APIRequestFactory().get('/')
+        request.query_budget = 0
+        middleware = QueryBudgetMiddleware(get_response)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        with self.assertRaises(QueryBudgetExceeded):
+            asyncio.run(middleware(request))
+
+class TestTransferPartitions(TestCase):
+    """Partitions of the next months must be created with rows written to the default partition before"""
+    def setUp(self):
+        eur = Currency.objects.create(name='EUR')
+        sender = Account.objects.create(user=User.objects.create_user('partitions@server.org', 'wsx123qaz', username='partitions'), currency=eur, balance=100)
+        receiver = Account.objects.create(user=User.objects.create_user('partitions2@server.org', 'wsx123qaz', username='partitions2'), currency=eur, balance=0)
+        self.transfer = Transfer.objects.create(sender_account=sender, receiver_account=receiver, amount=1)
+
+    def get_partition(self, transfer_pk):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT tableoid::regclass::text FROM money_transfer WHERE id = %s', [transfer_pk])
+            return cursor.fetchone()[0]
+
+    def test_add_months(self):
+        self.assertEqual(add_months(datetime(2020, 11, 1), 3), datetime(2021, 2, 1))
+        self.assertEqual(add_months(datetime(2020, 1, 1), -1), datetime(2019, 12, 1))
+
+    def test_rows_moved_from_default(self):
+        month = datetime(2040, 2, 1)
+        Transfer.objects.filter(pk=self.transfer.pk).update(created=datetime(2040, 2, 10))
+        self.assertEqual(self.get_partition(self.transfer.pk), 'money_transfer_default')
+        created, detached = manage_partitions(now=datetime(2040, 1, 15))
+        self.assertIn(partition_name(month), created)
+        self.assertEqual(self.get_partition(self.transfer.pk), partition_name(month))
+        self.assertEqual(manage_partitions(now=datetime(2040, 1, 15))[0], [])
+
+    def test_detach_with_ledger(self):
+        #transfer of the engine has ledger entries and idempotency key, they are archived with the partition
+        month = datetime(2040, 2, 1)
+        Course.objects.create(base_currency=self.transfer.sender_account.currency, currency=Currency.objects.create(name='USD'),
+            course=Decimal('2'), date=datetime(2020, 2, 14))
+        transfer = execute_transfer(self.transfer.sender_account.user, self.transfer.sender_account_id, self.transfer.receiver_account_id,
+            Decimal('10'), idempotency_key='partitions-1')
+        Transfer.objects.filter(pk=transfer.pk).update(created=datetime(2040, 2, 10))
+        LedgerEntry.objects.filter(transfer_id=transfer.pk).update(created=datetime(2040, 2, 10))
+        TransferKey.objects.filter(transfer_id=transfer.pk).update(transfer_created=datetime(2040, 2, 10))
+        manage_partitions(now=datetime(2040, 1, 15))
+        self.assertEqual(self.get_partition(transfer.pk), partition_name(month))
+        with override_settings(TRANSFER_PARTITIONS_KEEP_MONTHS=1):
+            created, detached = manage_partitions(now=datetime(2040, 4, 15))
+        self.assertIn(partition_name(month), detached)
+        self.assertFalse(Transfer.objects.filter(pk=transfer.pk).exists())
+        self.assertFalse(LedgerEntry.objects.filter(transfer_id=transfer.pk).exists())
+        self.assertFalse(TransferKey.objects.filter(transfer_id=transfer.pk).exists())
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM %s' % partition_name(month, LedgerEntry))
+            self.assertEqual(cursor.fetchone()[0], 2)
+            cursor.execute('SELECT idempotency_key FROM %s' % partition_name(month, TransferKey))
+            self.assertEqual(cursor.fetchone()[0], 'partitions-1')
+        #checkpoint created before detaching keeps the balance of the later moment
+        self.assertEqual(balance_at(self.transfer.sender_account, datetime(2040, 4, 15)), Decimal('90'))
+
+class TestExport(TestCase):
+    """Exports must be resumable from the last exported id and the same with gzip"""
+    def setUp(self):
+        eur = Currency.objects.create(name='EUR')
+        sender = Account.objects.create(user=User.objects.create_user('export@server.org', 'wsx123qaz', username='export'), currency=eur, balance=100)
+        receiver = Account.objects.create(user=User.objects.create_user('export2@server.org', 'wsx123qaz', username='export2'), currency=eur, balance=0)
+        self.transfers = [Transfer.objects.create(sender_account=sender, receiver_account=receiver, amount=i + 1) for i in range(3)]
+
+    def read(self, *args, **kwargs):
+        body, content_type = export_stream(*args, **kwargs)
+        return b''.join(body) if kwargs.get('compress') else ''.join(body)
+
+    def test_csv(self):
+        lines = self.read('transfers', 'csv').splitlines()
+        self.assertEqual(lines[0].split(',')[0], 'id')
+        self.assertEqual([int(line.split(',')[0]) for line in lines[1:]], [transfer.pk for transfer in self.transfers])
+
+    def test_resume(self):
+        lines = self.read('transfers', 'ndjson', after=self.transfers[0].pk).splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [transfer.pk for transfer in self.transfers[1:]])
+
+    def test_gzip(self):
+        self.assertEqual(gzip.decompress(self.read('accounts', 'csv', compress=True)).decode(), self.read('accounts', 'csv'))
+
+    def test_unknown_export(self):
+        with self.assertRaises(ValueError):
+            export_stream('users', 'csv')
+
+class TestAccountSummary(TestCase):
+    """Summary is served from Redis without queries and is rewritten with a new version after changes"""
+    def setUp(self):
+        self.owner = User.objects.create_user('summary@server.org', 'wsx123qaz', username='summary')
+        self.account = Account.objects.create(user=self.owner, currency=Currency.objects.create(name='EUR'), balance=Decimal('10.5'))
+        refresh_summaries([self.owner.pk])
+
+    def test_cache_hit(self):
+        with self.assertNumQueries(0):
+            summary = get_summary(self.owner.pk)
+        self.assertEqual(summary['user']['pk'], self.owner.pk)
+        self.assertEqual([account['pk'] for account in summary['accounts']], [self.account.pk])
+
+    def test_refresh(self):
+        Account.objects.filter(pk=self.account.pk).update(balance=Decimal('1'))
+        refresh_summaries([self.owner.pk])
+        self.assertEqual(Decimal(get_summary(self.owner.pk)['accounts'][0]['balance']), Decimal('1'))
+
+    def test_unknown_user(self):
+        self.assertIsNone(get_summary(0))
+
+class TestCourseList(TestCase):
+    """Date filters of lists include date_from and exclude date_to"""
+    def setUp(self):
+        eur = Currency.objects.create(name='EUR')
+        usd = Currency.objects.create(name='USD')
+        for day in (13, 14, 15):
+            Course.objects.create(base_currency=eur, currency=usd, course=Decimal(day), date=datetime(2020, 2, day))
+        bump_rates_version()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('courses@server.org', 'wsx123qaz', username='courses'))
+
+    def tearDown(self):
+        #snapshot of this test's courses must not be used by the other tests, Redis of the tests is REDIS_TEST
+        self.assertEqual(settings.REDIS0, settings.REDIS_TEST)
+        get_redis().flushdb()
+        rates_module._table = None
+
+    def test_date_to_excluded(self):
+        response = self.client.get('/api/money/courses/', {'date_from': '2020-02-14', 'date_to': '2020-02-15'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([course['date'] for course in response.json()], ['2020-02-14T00:00:00'])
+
+class TestRateMatrixView(TestCase):
+    """Matrix is revalidated by its ETag, the version of the rates"""
+    def setUp(self):
+        eur = Currency.objects.create(name='EUR')
+        Course.objects.create(base_currency=eur, currency=Currency.objects.create(name='USD'), course=Decimal('2'), date=datetime(2020, 2, 14))
+        self.table = bump_rates_version()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('matrix@server.org', 'wsx123qaz', username='matrix'))
+
+    def tearDown(self):
+        get_redis().flushdb()
+        rates_module._table = None
+
+    def test_not_modified(self):
+        response = self.client.get('/api/money/rates/matrix/')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertEqual(etag, '"%s"' % self.table.version)
+        self.assertEqual(response.json()['currencies'], ['EUR', 'USD'])
+        self.assertEqual(Decimal(response.json()['matrix'][1]), Decimal('2'))
+        response = self.client.get('/api/money/rates/matrix/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        #new version of the rates makes the old copy stale
+        bump_rates_version()
+        response = self.client.get('/api/money/rates/matrix/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+class TestRatesCachedResponse(TestCase):
+    """Currency and course lists are revalidated by ETag and served gzipped from Redis"""
+    def setUp(self):
+        eur = Currency.objects.create(name='EUR')
+        Course.objects.create(base_currency=eur, currency=Currency.objects.create(name='USD'), course=Decimal('2'), date=datetime(2020, 2, 14))
+        bump_rates_version()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('cached@server.org', 'wsx123qaz', username='cached'))
+
+    def tearDown(self):
+        get_redis().flushdb()
+        rates_module._table = None
+
+    def test_gzip(self):
+        response = self.client.get('/api/money/currencies/', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertTrue(response['ETag'].endswith('-gzip"'))
+        self.assertEqual([currency['name'] for currency in json.loads(gzip.decompress(response.content))], ['EUR', 'USD'])
+        #the same cached body is decompressed for clients without gzip, without queries
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/money/currencies/')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual([currency['name'] for currency in response.json()], ['EUR', 'USD'])
+
+    def test_not_modified(self):
+        for url in ('/api/money/currencies/', '/api/money/courses/'):
+            response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+            etag, last_modified = response['ETag'], response['Last-Modified']
+            with self.assertNumQueries(0):
+                #ETag of gzipped representation revalidates the plain one too
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag, HTTP_ACCEPT_ENCODING='gzip')
+                self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['ETag'], etag)
+            self.assertIn('Accept-Encoding', response['Vary'])
+            #new version of the rates makes the old copy stale
+            bump_rates_version()
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+class TestRevaluation(TestCase):
+    """Holdings revalued by one aggregate query must match convertation of every account"""
+    def setUp(self):
+        eur, usd = Currency.objects.create(name='EUR'), Currency.objects.create(name='USD')
+        Course.objects.create(base_currency=eur, currency=usd, course=Decimal('1.0836'), date=datetime(2020, 2, 14))
+        self.first = User.objects.create_user('revaluation@server.org', 'wsx123qaz', username='revaluation')
+        self.second = User.objects.create_user('revaluation2@server.org', 'wsx123qaz', username='revaluation2')
+        Account.objects.create(user=self.first, currency=eur, balance=Decimal('10.5'))
+        Account.objects.create(user=self.first, currency=usd, balance=Decimal('108.36'))
+        Account.objects.create(user=self.second, currency=usd, balance=Decimal('1.0836'))
+
+    def test_totals(self):
+        data = revaluation('EUR', date=datetime(2020, 2, 15), by_user=True)
+        self.assertEqual(data['currencies']['USD']['accounts'], 2)
+        self.assertEqual(data['currencies']['USD']['converted'], Decimal('101'))
+        self.assertEqual(data['total'], Decimal('111.5'))
+        self.assertEqual(data['users'], {self.first.pk: Decimal('110.5'), self.second.pk: Decimal('1')})
+
+    def test_unknown_currency(self):
+        with self.assertRaises(Exception):
+            revaluation('XXX', date=datetime(2020, 2, 15))
+
+    def test_vector_path(self):
+        if revaluation_module.numpy is None:
+            self.skipTest('numpy is not installed')
+        rows = [(1, 1, 1, 1083600), (1, 2, 1, 5), (2, 2, 1, 3)]
+        ratios = {1: (1, 1), 2: (1, 2)}
+        exact = revalue_users(rows, ratios, 4)
+        self.assertEqual(revalue_users(revaluation_module.numpy.array(rows), ratios, 4), exact)
+
+class RatesProviderStub(BaseHTTPRequestHandler):
+    """Local stub of the provider of courses supporting conditional requests"""
+    payload = {'base': 'EUR', 'date': '2020-02-14', 'rates': {'USD': 1.0836, 'RUB': 69.0202}}
+    etag = '"v1"'
+    def do_GET(self):
+        if self.headers.get('If-None-Match') == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = json.dumps(self.payload).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('ETag', self.etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    def log_message(self, *args):
+        pass
+
+class MalformedRatesProviderStub(RatesProviderStub):
+    payload = {'base': 'EUR', 'date': '2020-02-14', 'rates': None}
+
+class TestRateIngestion(TestCase):
+    """Ingestion of courses from local stub providers"""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = HTTPServer(('127.0.0.1', 0), RatesProviderStub)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = 'http://127.0.0.1:%s/latest' % cls.server.server_port
+        cls.malformed_server = HTTPServer(('127.0.0.1', 0), MalformedRatesProviderStub)
+        threading.Thread(target=cls.malformed_server.serve_forever, daemon=True).start()
+        cls.malformed_url = 'http://127.0.0.1:%s/latest' % cls.malformed_server.server_port
+
+    @classmethod
+    def tearDownClass(cls):
+        for server in (cls.server, cls.malformed_server):
+            server.shutdown()
+            server.server_close()
+        super().tearDownClass()
+
+    def test_ingest_rates(self):
+        #the other providers are not available or send malformed data, it must not stop ingestion
+        changed = ingest_rates([self.malformed_url, 'http://127.0.0.1:1/latest', self.url])
+        self.assertEqual(changed, {'USD', 'RUB'})
+        self.assertEqual(Course.objects.get(currency__name='USD').course, Decimal('1.0836'))
+        self.assertEqual(Course.objects.get(currency__name='RUB').base_currency.name, 'EUR')
+        #provider answers 304 Not Modified to the conditional request
+        self.assertEqual(ingest_rates([self.url]), set())
+        self.assertEqual(Course.objects.count(), 2)
@@ -1,10 +1,19 @@
 from django.urls import path, re_path, include
 from django.conf.urls import url
-from money.views import CurrencyListView, CourseListView, AccountListForOwnerView, AccountListView, TransferListView, TransferCreateView
+from project.async_views import async_view
+from money.views import CurrencyListView, CourseListView, AccountListForOwnerView, AccountListView, TransferListView, TransferCreateView, TransferBatchView, AccountStatementView, AccountBalanceView, TransferAsyncCreateView, TransferRequestView, RateMatrixView, RevaluationView, ExportView
 
 urlpatterns = [
-    path('currencies/', CurrencyListView.as_view(), name='currency_list'),
-    path('courses/', CourseListView.as_view(), name='course_list'),
+    path('currencies/', async_view(CurrencyListView), name='currency_list'),
+    path('courses/', async_view(CourseListView), name='course_list'),
+    path('rates/matrix/', RateMatrixView.as_view(), name='rate_matrix'),
+    path('export/<str:name>/', ExportView.as_view(), name='export'),
+    path('reports/revaluation/', RevaluationView.as_view(), name='revaluation'),
+    path('accounts/<int:pk>/balance/', AccountBalanceView.as_view(), name='account_balance'),
+    path('accounts/<int:pk>/statement/', AccountStatementView.as_view(), name='account_statement'),
+    path('transfers/async/', TransferAsyncCreateView.as_view(), name='transfer_async_create'),
+    path('transfers/requests/<int:pk>/', TransferRequestView.as_view(), name='transfer_request'),
+    path('transfers/batch/', TransferBatchView.as_view(), name='transfer_batch'),
     path('transfers/create/', TransferCreateView.as_view(), name='transfer_create'),
-    path('transfers/', TransferListView.as_view(), name='transfer_list'),
+    path('transfers/', async_view(TransferListView), name='transfer_list'),
 ]
\ No newline at end of file
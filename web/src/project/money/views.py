@@ -1,33 +1,124 @@
 import sys
 import logging
 import json
+from datetime import datetime
 from rest_framework import serializers, permissions, status 
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from rest_framework.parsers import JSONParser
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.urls import reverse
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.utils.urls import replace_query_param
 from django.core.exceptions import ObjectDoesNotExist
 from django.db.models import Q
-from money.models import Currency, Course, Account, Transfer
-from money.serializers import CurrencySerializer, CourseSerializer, AccountForOwnerSerializer, AccountSerializer, TransferCreateSerializer, TransferSerializer
-from users.models import User
+from money.models import Currency, Course, Account, Transfer, TransferRequest
+from money.engine import execute_transfer_batch, TransferError, TransferBatchError
+from money.parsers import NDJSONParser
+from money.pagination import keyset_page, iterate_keyset, get_page_size, stream_ndjson, stream_json_array
+from money.statements import statement_page
+from money.ledger import balance_at
+from money.pipeline import submit_transfer, wait_for_transfer_request
+from money.idempotency import idempotent_response
+from money.rates import get_rate_table
+from money.revaluation import revaluation
+from money.summaries import get_summary, summary_total
+from money.exports import export_stream
+from project.routers import ReplicaReadMixin, read_alias
+from project.querybudget import query_budget
+from money.caching import rates_cached_response
+from money.serializers import CurrencySerializer, CourseSerializer, AccountForOwnerSerializer, AccountSerializer, AccountCreateSerializer, TransferCreateSerializer, TransferSerializer, StatementSerializer, TransferRequestSerializer
+from users.authentication import get_full_user
 
 info_logger = logging.getLogger('info')
 
+def get_date_param(request, name):
+    """Datetime from query parameter in format yyyy-mm-dd or yyyy-mm-ddThh:mm:ss, None if parameter is absent"""
+    value = request.query_params.get(name, None)
+    if not value:
+        return None
+    try:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            parsed = parse_date(value)
+            if parsed is not None:
+                parsed = datetime(parsed.year, parsed.month, parsed.day)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValueError('Bad value of parameter %s' % name)
+    return parsed
+
+@query_budget(1)
 class CurrencyListView(APIView):
-    """View for getting list of currencies in the system"""
+    """View for getting list of currencies in the system, response is cached by the rates version"""
     permission_classes = [permissions.IsAuthenticated]
     def get(self, request):
-        currency_list = Currency.objects.all()
+        return rates_cached_response(request, 'currencies', self.build)
+
+    def build(self, request):
+        currency_list = Currency.objects.order_by('pk')
         serializer = CurrencySerializer(currency_list, many=True)
-        return Response(data=serializer.data, status=status.HTTP_200_OK)
+        return serializer.data, {}
 
+@query_budget(1)
 class CourseListView(APIView):
-    """View for getting list of courses of currencies in the system"""
+    """View for getting list of courses of currencies in the system, response is cached by the rates version.
+
+    Query parameter latest=true returns only the latest course of every pair of currencies,
+    date_from and date_to limit dates of courses (date_to is not included). Courses are sorted by date in descending order
+    and paginated by cursor: query parameters "cursor" and "limit", cursor of the next page is passed in Link header.
+    """
     permission_classes = [permissions.IsAuthenticated]
     def get(self, request):
-        course_list = Course.objects.all()
+        return rates_cached_response(request, 'courses', self.build)
+
+    def build(self, request):
+        course_list = Course.objects.select_related('currency', 'base_currency')
+        try:
+            date_from = get_date_param(request, 'date_from')
+            date_to = get_date_param(request, 'date_to')
+        except ValueError as e:
+            return Response(data={'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if date_from:
+            course_list = course_list.filter(date__gte=date_from)
+        if date_to:
+            course_list = course_list.filter(date__lt=date_to)
+        headers = {}
+        if request.query_params.get('latest', None) == 'true':
+            course_list = course_list.order_by('base_currency_id', 'currency_id', '-date').distinct('base_currency_id', 'currency_id')
+        else:
+            try:
+                limit = get_page_size(request, settings.COURSE_PAGE_SIZE, settings.COURSE_PAGE_MAX_SIZE)
+                course_list, next_cursor = keyset_page(course_list, request.query_params.get('cursor', None), limit, field='date')
+            except ValueError as e:
+                return Response(data={'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            if next_cursor:
+                headers['Link'] = '<%s>; rel="next"' % replace_query_param(request.build_absolute_uri(), 'cursor', next_cursor)
         serializer = CourseSerializer(course_list, many=True)
-        return Response(data=serializer.data, status=status.HTTP_200_OK)
+        return serializer.data, headers
 
+@query_budget(1)
+class RateMatrixView(APIView):
+    """View for getting cross-rate matrix of all currencies.
+    Rate from currencies[i] to currencies[j] is matrix[i * len(currencies) + j].
+    ETag is the version of the rates, so clients revalidate their copy by If-None-Match.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    def get(self, request):
+        table = get_rate_table()
+        etag = '"%s"' % table.version if table.version is not None else None
+        if etag and etag in [tag.strip() for tag in request.META.get('HTTP_IF_NONE_MATCH', '').split(',')]:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(data=table.as_dict(), status=status.HTTP_200_OK)
+        if etag:
+            response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+@query_budget(5)
 class AccountListForOwnerView(APIView):
     """This view is intended for owner's of the accounts.
     Owner is able to see list of its accounts with balance information,
@@ -35,12 +126,12 @@ class AccountListForOwnerView(APIView):
     """
     permission_classes = [permissions.IsAuthenticated]
     def get(self, request):
-        account_list = Account.objects.filter(user=request.user)
+        account_list = Account.objects.filter(user_id=request.user.pk).select_related('currency').prefetch_related('shard_balances')
         serializer = AccountForOwnerSerializer(account_list, many=True)
         return Response(data=serializer.data, status=status.HTTP_200_OK)
         
     def post(sef, request):
-        serializer = AccountCreateSerializer(data=request.data, context={'owner': request.user})
+        serializer = AccountCreateSerializer(data=request.data, context={'owner': get_full_user(request.user)})
         if not serializer.is_valid():
             return Response(data=serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         try:
@@ -50,56 +141,309 @@ class AccountListForOwnerView(APIView):
         serializer = AccountForOwnerSerializer(new_account)
         return Response(data=serializer.data, status=status.HTTP_201_CREATED)
 
-class AccountListView(APIView):
+@query_budget(2)
+class AccountListView(ReplicaReadMixin, APIView):
     """Administrators of the system can see accounts of all users"""
     permission_classes = [permissions.IsAdminUser]
     def get(self, request):
-        account_list = Account.objects.all().order_by('user')
+        account_list = Account.objects.select_related('user', 'currency').order_by('user')
         serializer = AccountSerializer(account_list, many=True)
         return Response(data=serializer.data, status=status.HTTP_200_OK)
 
+@query_budget(3)
 class AccountListOfUserView(APIView):
-    """View for owners of accounts and admins"""
+    """View for owners of accounts and admins, accounts are read from the summary of the user's accounts"""
     permission_classes = [permissions.IsAuthenticated]
     def get(self, request, pk):
-        try:
-            user = User.objects.get(pk=int(pk))
-        except ObjectDoesNotExist:
+        summary = get_summary(int(pk))
+        if summary is None:
             return Response(data={'error': 'User not found!'}, status=status.HTTP_404_NOT_FOUND)
-        try:
-            account_list = Account.objects.filter(user=user)
-        except:
-            return Response(data={'error': 'User has not accounts!'}, status=status.HTTP_406_NOT_ACCEPTABLE)
         #Browsing balance values of the accounts is only available 
-        #for admins and account's owner through AccountForOwnerSerializer view.
-        if request.user == user or request.user.is_staff:
-            serializer = AccountForOwnerSerializer(account_list, many=True)
+        #for admins and account's owner, summary has fields of AccountForOwnerSerializer.
+        if request.user.pk == summary['user']['pk'] or request.user.is_staff:
+            data = summary['accounts']
         else:
-            #account info without balance value for other's clients
-            serializer = AccountSerializer(account_list, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+            #account info without balance value for other's clients, fields of AccountSerializer
+            data = [{'pk': account['pk'], 'user': summary['user'], 'currency': account['currency']} for account in summary['accounts']]
+        return Response(data, status=status.HTTP_200_OK)
+
+@query_budget(3)
+class AccountSummaryView(APIView):
+    """View for getting accounts of the user with total balance in the currency passed by query parameter "currency"
+    (SUMMARY_CURRENCY by default). Available for the user and admins.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    def get(self, request, pk):
+        if request.user.pk != pk and not request.user.is_staff:
+            return Response(data={'error': 'It is not yours summary!'}, status=status.HTTP_403_FORBIDDEN)
+        summary = get_summary(pk)
+        if summary is None:
+            return Response(data={'error': 'User not found!'}, status=status.HTTP_404_NOT_FOUND)
+        currency = request.query_params.get('currency', settings.SUMMARY_CURRENCY)
+        try:
+            total = summary_total(summary, currency)
+        except Exception as e:
+            return Response(data={'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(data=dict(summary, currency=currency, total=total), status=status.HTTP_200_OK)
 
+@query_budget(12)
 class TransferCreateView(APIView):
-    """View for creating transfers"""
+    """View for creating transfers.
+    Optional header Idempotency-Key makes retries of the client safe: repeated request gets the original response.
+    """
     permission_classes = [permissions.IsAuthenticated]
     def post(self, request):
-        serializer = TransferCreateSerializer(data=request.data, context={'owner': request.user})
+        return idempotent_response(request, self.create)
+
+    def create(self, request):
+        context = {'owner': request.user, 'idempotency_key': request.META.get('HTTP_IDEMPOTENCY_KEY', None)}
+        serializer = TransferCreateSerializer(data=request.data, context=context)
         if not serializer.is_valid():
             return Response(data=serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         try:
             new_transfer = serializer.save()
+        except serializers.ValidationError as e:
+            return Response(data={'error': e.detail}, status=status.HTTP_400_BAD_REQUEST)
         except:
             return Response(data={'error': sys.exc_info()[0]}, status=status.HTTP_400_BAD_REQUEST)
         serializer = TransferSerializer(new_transfer)
         return Response(data=serializer.data, status=status.HTTP_201_CREATED)
             
-class TransferListView(APIView):
-    """View for getting transfer list of current user"""
+@query_budget(3)
+class TransferAsyncCreateView(APIView):
+    """View for submitting transfers for asynchronous execution.
+    Header Idempotency-Key is required, repeated requests with the same key return the same transfer request.
+    Response 202 contains primary key of the transfer request, its status is available by TransferRequestView.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    def post(self, request):
+        idempotency_key = request.META.get('HTTP_IDEMPOTENCY_KEY', None)
+        if not idempotency_key or len(idempotency_key) > 64:
+            return Response(data={'error': 'Header Idempotency-Key is required, up to 64 characters'}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = TransferCreateSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(data=serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
+        transfer_request, created = submit_transfer(request.user, idempotency_key, data['sender_account'], data['receiver_account'], data['amount'])
+        if not created and (transfer_request.sender_account_pk, transfer_request.receiver_account_pk, transfer_request.amount) != \
+                (data['sender_account'], data['receiver_account'], data['amount']):
+            return Response(data={'error': 'Idempotency-Key was already used for another transfer'}, status=status.HTTP_409_CONFLICT)
+        response = Response(data=TransferRequestSerializer(transfer_request).data, status=status.HTTP_202_ACCEPTED)
+        response['Location'] = reverse('transfer_request', kwargs={'pk': transfer_request.pk})
+        return response
+
+@query_budget(2)
+class TransferRequestView(APIView):
+    """View for getting status of asynchronous transfer.
+    Query parameter wait (seconds) holds the request until the transfer is processed (long polling).
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    def get(self, request, pk):
+        try:
+            wait = min(float(request.query_params.get('wait', 0)), settings.TRANSFER_REQUEST_MAX_WAIT)
+        except ValueError:
+            return Response(data={'error': 'Bad wait value'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            transfer_request = TransferRequest.objects.get(pk=pk, owner_id=request.user.pk)
+        except ObjectDoesNotExist:
+            return Response(data={'error': 'Transfer request not found!'}, status=status.HTTP_404_NOT_FOUND)
+        if transfer_request.status == TransferRequest.PENDING and wait > 0:
+            wait_for_transfer_request(transfer_request.pk, wait)
+            transfer_request.refresh_from_db()
+        return Response(data=TransferRequestSerializer(transfer_request).data, status=status.HTTP_200_OK)
+
+class TransferBatchView(APIView):
+    """View for creating many transfers from one sender's account by one request.
+    Body is JSON array or NDJSON stream of transfers,
+    query parameter mode is "atomic" (all-or-nothing, default) or "best_effort".
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    parser_classes = [JSONParser, NDJSONParser]
+    def post(self, request):
+        mode = request.query_params.get('mode', 'atomic')
+        if mode not in ('atomic', 'best_effort'):
+            return Response(data={'error': 'Unknown mode "%s"' % mode}, status=status.HTTP_400_BAD_REQUEST)
+        items = request.data
+        if not isinstance(items, list) or not items:
+            return Response(data={'error': 'Transfer list is empty!'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > settings.TRANSFER_BATCH_MAX_SIZE:
+            return Response(data={'error': 'Too many transfers, maximum is %s' % settings.TRANSFER_BATCH_MAX_SIZE}, status=status.HTTP_400_BAD_REQUEST)
+        #every transfer is validated separately to report errors per item
+        results = [None] * len(items)
+        indices = []
+        transfers = []
+        sender_account_pk = None
+        for i, item in enumerate(items):
+            serializer = TransferCreateSerializer(data=item)
+            if not serializer.is_valid():
+                results[i] = serializer.errors
+                continue
+            data = serializer.validated_data
+            if sender_account_pk is None:
+                sender_account_pk = data['sender_account']
+            elif sender_account_pk != data['sender_account']:
+                results[i] = {'error': 'All transfers must be sent from the same account'}
+                continue
+            indices.append(i)
+            transfers.append((data['receiver_account'], data['amount']))
+        rolled_back = mode == 'atomic' and len(transfers) < len(items)
+        if transfers and not rolled_back:
+            try:
+                applied = execute_transfer_batch(request.user, sender_account_pk, transfers, atomic=mode == 'atomic')
+            except TransferBatchError as e:
+                applied = e.results
+                rolled_back = True
+            for i, result in zip(indices, applied):
+                results[i] = result
+        data = [self.get_item_result(i, result, rolled_back) for i, result in enumerate(results)]
+        return Response(data=data, status=status.HTTP_400_BAD_REQUEST if rolled_back else status.HTTP_201_CREATED)
+
+    def get_item_result(self, index, result, rolled_back):
+        if isinstance(result, TransferError):
+            return {'index': index, 'status': 'error', 'error': str(result)}
+        if isinstance(result, dict):
+            return {'index': index, 'status': 'error', 'error': result}
+        if rolled_back or result is None:
+            return {'index': index, 'status': 'rolled_back'}
+        return {'index': index, 'status': 'created', 'pk': result.pk, 'amount': result.amount, 'created': result.created}
+
+@query_budget(2)
+class TransferListView(ReplicaReadMixin, APIView):
+    """View for getting transfer list of current user.
+
+    Transfers are sorted by field "created" in descending order and paginated by cursor:
+    query parameters "cursor" and "limit", cursor of the next page is passed in Link header.
+    Query parameter stream=ndjson or stream=json returns all transfers as a streamed response.
+    Query parameters date_from and date_to limit dates of transfers (date_to is not included), only partitions of these months are read,
+    cursor of the page limits the dates of the next pages.
+    """
     permission_classes = [permissions.IsAuthenticated]
     def get(self, request):
+        try:
+            date_from, date_to = get_date_param(request, 'date_from'), get_date_param(request, 'date_to')
+        except ValueError as e:
+            return Response(data={'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         #all accounts of the current user
-        accounts_pk = [account.pk for account in Account.objects.filter(user=request.user)]
-        #all transfers of current user sorted by field "created" in descending order
-        transfers = Transfer.objects.filter(sender_account__in=accounts_pk).order_by('-created')
+        accounts_pk = list(Account.objects.filter(user_id=request.user.pk).values_list('pk', flat=True))
+        transfers = Transfer.objects.filter(sender_account__in=accounts_pk)\
+            .select_related('sender_account__user', 'sender_account__currency', 'receiver_account__user', 'receiver_account__currency')
+        if date_from:
+            transfers = transfers.filter(created__gte=date_from)
+        if date_to:
+            transfers = transfers.filter(created__lt=date_to)
+        stream = request.query_params.get('stream', None)
+        if stream:
+            return self.get_stream(transfers, stream)
+        try:
+            limit = get_page_size(request, settings.TRANSFER_PAGE_SIZE, settings.TRANSFER_PAGE_MAX_SIZE)
+            transfers, next_cursor = keyset_page(transfers, request.query_params.get('cursor', None), limit)
+        except ValueError as e:
+            return Response(data={'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         serializer = TransferSerializer(transfers, many=True)
-        return Response(data=serializer.data, status=status.HTTP_200_OK)
\ No newline at end of file
+        response = Response(data=serializer.data, status=status.HTTP_200_OK)
+        if next_cursor:
+            response['Link'] = '<%s>; rel="next"' % replace_query_param(request.build_absolute_uri(), 'cursor', next_cursor)
+        return response
+
+    def get_stream(self, transfers, stream):
+        """Streams all transfers, rows are fetched by chunks from server-side cursor (by keyset pages behind PgBouncer), so memory usage is flat"""
+        #rows are fetched after the view has returned, so the database is chosen now
+        transfers = transfers.using(read_alias.get() or 'default')
+        if settings.PGBOUNCER:
+            rows = iterate_keyset(transfers, settings.STREAM_CHUNK_SIZE)
+        else:
+            rows = transfers.order_by('-created', '-pk').iterator(chunk_size=settings.STREAM_CHUNK_SIZE)
+        serialize = lambda transfer: TransferSerializer(transfer).data
+        if stream == 'ndjson':
+            return StreamingHttpResponse(stream_ndjson(rows, serialize), content_type='application/x-ndjson')
+        if stream == 'json':
+            return StreamingHttpResponse(stream_json_array(rows, serialize), content_type='application/json')
+        return Response(data={'error': 'Unknown stream format "%s"' % stream}, status=status.HTTP_400_BAD_REQUEST)
+
+@query_budget(3)
+class AccountStatementView(ReplicaReadMixin, APIView):
+    """View for getting incoming and outgoing transfers of the account.
+    Available for account's owner and admins.
+
+    Query parameters: date_from, date_to, counterparty (account id), cursor and limit,
+    cursor of the next page is passed in Link header.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    def get(self, request, pk):
+        try:
+            account = Account.objects.select_related('user', 'currency').get(pk=pk)
+        except ObjectDoesNotExist:
+            return Response(data={'error': 'Account not found!'}, status=status.HTTP_404_NOT_FOUND)
+        if account.user_id != request.user.pk and not request.user.is_staff:
+            return Response(data={'error': 'It is not yours account!'}, status=status.HTTP_403_FORBIDDEN)
+        try:
+            counterparty = request.query_params.get('counterparty', None)
+            counterparty = int(counterparty) if counterparty else None
+            limit = get_page_size(request, settings.TRANSFER_PAGE_SIZE, settings.TRANSFER_PAGE_MAX_SIZE)
+            transfers, next_cursor = statement_page(account, request.query_params.get('cursor', None), limit,
+                date_from=get_date_param(request, 'date_from'), date_to=get_date_param(request, 'date_to'), counterparty=counterparty)
+        except ValueError as e:
+            return Response(data={'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = StatementSerializer(transfers, many=True, context={'account': account})
+        response = Response(data=serializer.data, status=status.HTTP_200_OK)
+        if next_cursor:
+            response['Link'] = '<%s>; rel="next"' % replace_query_param(request.build_absolute_uri(), 'cursor', next_cursor)
+        return response
+
+@query_budget(4)
+class AccountBalanceView(APIView):
+    """View for getting balance of the account at the moment passed by query parameter "at".
+    Current balance is returned without parameter "at". Available for account's owner and admins.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    def get(self, request, pk):
+        try:
+            account = Account.objects.select_related('currency').get(pk=pk)
+        except ObjectDoesNotExist:
+            return Response(data={'error': 'Account not found!'}, status=status.HTTP_404_NOT_FOUND)
+        if account.user_id != request.user.pk and not request.user.is_staff:
+            return Response(data={'error': 'It is not yours account!'}, status=status.HTTP_403_FORBIDDEN)
+        try:
+            moment = get_date_param(request, 'at')
+        except ValueError as e:
+            return Response(data={'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        balance = account.total_balance if moment is None else balance_at(account, moment)
+        return Response(data={'pk': account.pk, 'currency': account.currency.name, 'balance': balance, 'at': moment}, status=status.HTTP_200_OK)
+
+@query_budget(3)
+class RevaluationView(ReplicaReadMixin, APIView):
+    """View for getting holdings of all accounts revalued into the reporting currency, for admins.
+
+    Query parameters: currency (EUR by default), date of historical courses, users=true adds totals per user.
+    """
+    permission_classes = [permissions.IsAdminUser]
+    def get(self, request):
+        try:
+            data = revaluation(request.query_params.get('currency', 'EUR'), date=get_date_param(request, 'date'),
+                by_user=request.query_params.get('users', None) == 'true')
+        except Exception as e:
+            return Response(data={'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(data=data, status=status.HTTP_200_OK)
+
+@query_budget(1)
+class ExportView(ReplicaReadMixin, APIView):
+    """View for exporting all accounts or transfers, for admins.
+
+    Query parameters: output=csv|ndjson, gzip=true, date_from and date_to of creation,
+    after=id of the last received row resumes interrupted export. Rows are sorted by id.
+    """
+    permission_classes = [permissions.IsAdminUser]
+    def get(self, request, name):
+        try:
+            after = request.query_params.get('after', None)
+            compress = request.query_params.get('gzip', None) == 'true'
+            output = request.query_params.get('output', 'csv')
+            #rows are fetched after the view has returned, so the database is chosen now
+            body, content_type = export_stream(name, output, compress=compress,
+                date_from=get_date_param(request, 'date_from'), date_to=get_date_param(request, 'date_to'),
+                after=int(after) if after else None, using=read_alias.get() or 'default')
+        except ValueError as e:
+            return Response(data={'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        response = StreamingHttpResponse(body, content_type=content_type)
+        response['Content-Disposition'] = 'attachment; filename="%s.%s%s"' % (name, output, '.gz' if compress else '')
+        return response
@@ -0,0 +1,32 @@
+import os
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
+django.setup(set_prefix=False)
+
+from project.async_views import StreamingASGIHandler
+
+#the same as get_asgi_application, streamed responses are read chunk by chunk in a worker thread
+django_application = StreamingASGIHandler()
+
+from money.streams import rates_stream_app
+
+#long-lived streaming endpoints are served by the event loop directly, the others by Django
+routes = {
+    '/api/money/rates/stream/': rates_stream_app,
+}
+
+async def application(scope, receive, send):
+    """ASGI entry point, it is run by uvicorn or by gunicorn with uvicorn workers"""
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+    app = routes.get(scope['path'], django_application)
+    await app(scope, receive, send)
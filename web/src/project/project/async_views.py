@@ -0,0 +1,85 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.core.handlers.asgi import ASGIHandler
+from project.querybudget import count_queries
+
+def run_view(view, request, *args, **kwargs):
+    """Runs sync view in a thread of the pool and renders its response there.
+
+    Connections of the thread are checked before and after the view like request_started
+    and request_finished signals do for requests of regular threads.
+    Streamed body is not read here, StreamingASGIHandler sends it chunk by chunk.
+    Queries of the view are counted by QueryBudgetMiddleware in this thread.
+    """
+    close_old_connections()
+    count_queries()
+    try:
+        response = view(request, *args, **kwargs)
+        if hasattr(response, 'render') and callable(response.render):
+            response = response.render()
+        return response
+    finally:
+        close_old_connections()
+
+def close_streamed(response):
+    """Closes the response and database connections of the thread which has read its body"""
+    try:
+        response.close()
+    finally:
+        connections.close_all()
+
+class StreamingASGIHandler(ASGIHandler):
+    """ASGI handler reading streamed bodies in a worker thread.
+
+    Django 3.1 iterates streaming_content in the event loop, so a body read from a database cursor
+    blocks all requests of the process. Here every chunk is read by one thread dedicated to the response
+    (the cursor stays in the thread which has opened it) and sent as soon as it is ready.
+    """
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+        response_headers = []
+        for header, value in response.items():
+            if isinstance(header, str):
+                header = header.encode('ascii')
+            if isinstance(value, str):
+                value = value.encode('latin1')
+            response_headers.append((bytes(header), bytes(value)))
+        for c in response.cookies.values():
+            response_headers.append((b'Set-Cookie', c.output(header='').encode('ascii').strip()))
+        await send({'type': 'http.response.start', 'status': response.status_code, 'headers': response_headers})
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=1)
+        parts = iter(response)
+        try:
+            while True:
+                part = await loop.run_in_executor(executor, next, parts, None)
+                if part is None:
+                    break
+                for chunk, _ in self.chunk_bytes(part):
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body'})
+        finally:
+            await loop.run_in_executor(executor, close_streamed, response)
+            executor.shutdown(wait=False)
+
+def async_view(view_class, **initkwargs):
+    """Async variant of DRF view for ASGI deployment.
+
+    Django runs sync views under ASGI one at a time in a single thread per process,
+    async variant runs the view in the thread pool, so slow requests do not block the others.
+    Under WSGI (ASYNC_VIEWS is off) the regular sync view is returned.
+    """
+    view = view_class.as_view(**initkwargs)
+    if not settings.ASYNC_VIEWS:
+        return view
+    async def async_wrapper(request, *args, **kwargs):
+        return await sync_to_async(run_view, thread_sensitive=False)(view, request, *args, **kwargs)
+    async_wrapper.csrf_exempt = True
+    async_wrapper.cls = view_class
+    async_wrapper.__name__ = view.__name__
+    async_wrapper.__doc__ = view.__doc__
+    return async_wrapper
@@ -0,0 +1,79 @@
+import time
+import logging
+import threading
+import psycopg2
+import psycopg2.extras
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+info_logger = logging.getLogger('info')
+
+#counters of the current process, they are shown by the database stats endpoint
+stats = {
+    'connections_created': 0,
+    'health_checks': 0,
+    'unusable_closed': 0,
+}
+stats_lock = threading.Lock()
+
+def count(name):
+    with stats_lock:
+        stats[name] += 1
+
+@receiver(connection_created)
+def on_connection_created(sender, connection, **kwargs):
+    connection.checked_at = time.monotonic()
+    count('connections_created')
+
+def check_connections(**kwargs):
+    """Health check of persistent connections of the current thread before the request or the task.
+
+    Connection which was idle longer than DB_HEALTH_CHECK_INTERVAL seconds is checked by a trivial query,
+    broken one (restarted server or PgBouncer, closed by firewall) is closed and the request opens a new one
+    instead of failing on its first query.
+    """
+    for connection in connections.all():
+        if connection.connection is None or connection.in_atomic_block:
+            continue
+        if time.monotonic() - getattr(connection, 'checked_at', 0) < settings.DB_HEALTH_CHECK_INTERVAL:
+            continue
+        count('health_checks')
+        if not connection.is_usable():
+            info_logger.info('check_connections: connection %s is not usable' % connection.alias)
+            count('unusable_closed')
+            connection.close()
+        else:
+            connection.checked_at = time.monotonic()
+
+request_started.connect(check_connections, dispatch_uid='project.db.check_connections')
+
+def get_connection_stats():
+    """Persistent connections of the current thread and counters of the process"""
+    with stats_lock:
+        result = dict(stats)
+    result['connections'] = [{
+        'alias': connection.alias,
+        'open': connection.connection is not None,
+        'max_age': connection.settings_dict['CONN_MAX_AGE'],
+        'close_at': connection.close_at,
+    } for connection in connections.all()]
+    return result
+
+def get_pgbouncer_stats():
+    """Pools of PgBouncer by SHOW POOLS of its admin console, None if PgBouncer is not used"""
+    if not settings.PGBOUNCER:
+        return None
+    database = settings.DATABASES['default']
+    admin = psycopg2.connect(dbname='pgbouncer', user=database['USER'], password=database.get('PASSWORD', ''),
+        host=database['HOST'], port=database['PORT'], connect_timeout=3)
+    try:
+        #admin console does not support transactions
+        admin.autocommit = True
+        with admin.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+            cursor.execute('SHOW POOLS')
+            return [dict(row) for row in cursor.fetchall()]
+    finally:
+        admin.close()
@@ -0,0 +1,98 @@
+import asyncio
+import logging
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import connections
+
+info_logger = logging.getLogger('info')
+
+#counter of queries of the current request, sync_to_async copies it to the thread running the view
+current_counter = ContextVar('query_counter', default=None)
+
+class QueryBudgetExceeded(Exception):
+    """View made more queries than its declared budget"""
+
+def query_budget(queries):
+    """Class decorator declaring the maximum count of database queries of one request to the view.
+    Budget does not depend on the count of returned rows, so a view with N+1 queries exceeds it
+    as soon as the result is larger than the budget.
+    """
+    def decorate(view_class):
+        view_class.query_budget = queries
+        return view_class
+    return decorate
+
+class QueryCounter:
+    """Count of queries of all database connections of the request"""
+    def __init__(self):
+        self.count = 0
+
+def count_query(execute, sql, params, many, context):
+    """execute_wrapper adding the query to the counter of the current request"""
+    counter = current_counter.get()
+    if counter is not None:
+        counter.count += 1
+    return execute(sql, params, many, context)
+
+def count_queries():
+    """Installs count_query on connections of the current thread.
+    Connections belong to threads, so it is called in the thread running the view: the middleware
+    and its process_view run there for sync views, run_view for async views.
+    """
+    if current_counter.get() is None:
+        return
+    for connection in connections.all():
+        if count_query not in connection.execute_wrappers:
+            connection.execute_wrappers.append(count_query)
+
+class QueryBudgetMiddleware:
+    """Counts queries of every request and compares the count with the budget of its view.
+
+    Exceeded budget raises QueryBudgetExceeded when QUERY_BUDGET_STRICT is on (tests),
+    otherwise it is logged. Queries of streamed bodies are made after the view returns and are not counted.
+    Under ASGI the middleware is async, so it does not make Django run the requests one at a time.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            #the handler awaits the middleware like MiddlewareMixin
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        counter = QueryCounter()
+        token = current_counter.set(counter)
+        count_queries()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_counter.reset(token)
+        self.check_budget(request, counter)
+        return response
+
+    async def __acall__(self, request):
+        counter = QueryCounter()
+        token = current_counter.set(counter)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_counter.reset(token)
+        self.check_budget(request, counter)
+        return response
+
+    def check_budget(self, request, counter):
+        budget = getattr(request, 'query_budget', None)
+        if budget is not None and counter.count > budget:
+            message = '%s %s made %s queries, budget is %s' % (request.method, request.path, counter.count, budget)
+            if settings.QUERY_BUDGET_STRICT:
+                raise QueryBudgetExceeded(message)
+            info_logger.info('QueryBudgetMiddleware: %s' % message)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+        request.query_budget = getattr(view_class, 'query_budget', getattr(view_func, 'query_budget', None))
+        count_queries()
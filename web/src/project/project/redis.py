@@ -0,0 +1,12 @@
+import redis
+from django.conf import settings
+
+#one connection pool per worker process and Redis URL, shared by all its threads
+pools = {}
+
+def get_redis():
+    """Returns Redis client working through the shared connection pool of REDIS0"""
+    pool = pools.get(settings.REDIS0)
+    if pool is None:
+        pool = pools.setdefault(settings.REDIS0, redis.ConnectionPool.from_url(settings.REDIS0))
+    return redis.Redis(connection_pool=pool)
@@ -0,0 +1,112 @@
+import time
+import logging
+import threading
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import connections, transaction, DatabaseError
+from redis import RedisError
+from project.redis import get_redis
+
+info_logger = logging.getLogger('info')
+
+REPLICA = 'replica'
+
+#alias of the database for reads of the current request, None means primary
+read_alias = ContextVar('read_alias', default=None)
+
+class ReplicaRouter:
+    """Sends reads of the request to the replica when the view has chosen it (see ReplicaReadMixin),
+    all writes and all other reads go to the primary"""
+    def db_for_read(self, model, **hints):
+        return read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        #replica is a physical copy of the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == REPLICA:
+            return False
+        return None
+
+def sticky_key(user_pk):
+    return 'replica:sticky:%s' % user_pk
+
+def mark_written(user_pk):
+    """Reads of the user go to the primary for REPLICA_STICKY_SECONDS after the commit of the current transaction,
+    so users see their own transfers although the replica has not replayed them yet"""
+    if not has_replica():
+        return
+    def mark():
+        try:
+            get_redis().set(sticky_key(user_pk), 1, ex=settings.REPLICA_STICKY_SECONDS)
+        except RedisError:
+            info_logger.info('mark_written: Redis is not available')
+    transaction.on_commit(mark)
+
+def is_sticky(user_pk):
+    try:
+        return bool(get_redis().exists(sticky_key(user_pk)))
+    except RedisError:
+        #without the marker reads of the user may be stale, primary is safe
+        return True
+
+def has_replica():
+    return REPLICA in settings.DATABASES
+
+_lag = None
+_lag_checked_at = 0
+_lag_lock = threading.Lock()
+
+def get_replica_lag():
+    """Replication lag of the replica in seconds, None if the replica is not available.
+    It is checked not more often than once per REPLICA_LAG_CHECK_INTERVAL seconds in the process.
+    """
+    global _lag, _lag_checked_at
+    if time.monotonic() - _lag_checked_at < settings.REPLICA_LAG_CHECK_INTERVAL:
+        return _lag
+    with _lag_lock:
+        if time.monotonic() - _lag_checked_at < settings.REPLICA_LAG_CHECK_INTERVAL:
+            return _lag
+        try:
+            with connections[REPLICA].cursor() as cursor:
+                #replayed everything received means no lag, even if the primary has been idle for long
+                cursor.execute('SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+                    'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END')
+                lag = cursor.fetchone()[0]
+            _lag = float(lag) if lag is not None else None
+        except DatabaseError as e:
+            info_logger.info('get_replica_lag: %s' % e)
+            connections[REPLICA].close()
+            _lag = None
+        _lag_checked_at = time.monotonic()
+    return _lag
+
+def use_replica(user):
+    """Reads of the request may go to the replica: the replica is configured, its lag is under
+    REPLICA_MAX_LAG seconds and the user did not write recently"""
+    if not has_replica():
+        return False
+    lag = get_replica_lag()
+    if lag is None or lag > settings.REPLICA_MAX_LAG:
+        return False
+    return not (user.is_authenticated and is_sticky(user.pk))
+
+class ReplicaReadMixin:
+    """Mixin of read-only views (lists, statements, reports): safe requests read from the replica.
+    Replica is chosen after authentication, so the user is known for read-your-writes check.
+    """
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in ('GET', 'HEAD', 'OPTIONS') and use_replica(request.user):
+            self.read_alias_token = read_alias.set(REPLICA)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, 'read_alias_token', None)
+        if token is not None:
+            read_alias.reset(token)
+            self.read_alias_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
@@ -1,4 +1,5 @@
 import os
+import sys
 from datetime import timedelta
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
@@ -24,8 +25,8 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'api',
-    'users',
+    'api.apps.ApiConfig',
+    'users.apps.UsersConfig',
     'money',
     'rest_framework',
     'rest_framework_simplejwt',    
@@ -106,6 +107,23 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+#the first hasher makes new hashes, the others verify old ones, which are rehashed on login
+PASSWORD_HASHERS = [
+    'users.hashing.ConfiguredArgon2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+]
+if os.getenv('PASSWORD_HASHER', 'argon2') == 'pbkdf2':
+    PASSWORD_HASHERS.insert(0, PASSWORD_HASHERS.pop(1))
+ARGON2_TIME_COST = int(os.getenv('ARGON2_TIME_COST', 2))
+ARGON2_MEMORY_COST = int(os.getenv('ARGON2_MEMORY_COST', 102400))
+ARGON2_PARALLELISM = int(os.getenv('ARGON2_PARALLELISM', 1))
+AUTHENTICATION_BACKENDS = ['users.hashing.PooledModelBackend']
+#concurrent password hashes of the worker process and requests waiting for them
+PASSWORD_HASHING_WORKERS = int(os.getenv('PASSWORD_HASHING_WORKERS', 2))
+PASSWORD_HASHING_QUEUE = int(os.getenv('PASSWORD_HASHING_QUEUE', 16))
+PASSWORD_HASHING_WAIT = 2
+
 # Internationalization
 # https://docs.djangoproject.com/en/2.2/topics/i18n/
 LANGUAGE_CODE = 'en-us'
@@ -164,20 +182,24 @@ REDIS_PORT = 6379
 REDIS0 = 'redis://' + REDIS_HOST + ':' + str(REDIS_PORT) + '/0'
 BROKER_URL = REDIS0
 CELERY_RESULT_BACKEND = REDIS0
+#tests use their own Redis database, it is flushed before and after the run (project.testing.TestRunner)
+REDIS_TEST = 'redis://' + REDIS_HOST + ':' + str(REDIS_PORT) + '/' + os.getenv('REDIS_TEST_DB', '15')
+TEST_RUNNER = 'project.testing.TestRunner'
 
 AUTH_USER_MODEL = 'users.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.StatelessJWTAuthentication',
     )
 }
 
 SIMPLE_JWT = {
-    'ACCESS_TOKEN_LIFETIME': timedelta(minutes=5),
-    'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
-    'ROTATE_REFRESH_TOKENS': False,
-    'BLACKLIST_AFTER_ROTATION': True,
+    'ACCESS_TOKEN_LIFETIME': timedelta(minutes=int(os.getenv('ACCESS_TOKEN_LIFETIME_MINUTES', 5))),
+    'REFRESH_TOKEN_LIFETIME': timedelta(days=int(os.getenv('REFRESH_TOKEN_LIFETIME_DAYS', 7))),
+    #used refresh token is revoked in Redis by TokenRefreshCheckedSerializer
+    'ROTATE_REFRESH_TOKENS': True,
+    'BLACKLIST_AFTER_ROTATION': False,
 
     'ALGORITHM': 'HS256',
     'SIGNING_KEY': SECRET_KEY,
@@ -200,4 +222,106 @@ SIMPLE_JWT = {
 }
 
 FETCH_COURSES_URL = 'https://api.exchangeratesapi.io/latest'
-FETCH_COURSES_FREQUENCY_IN_SECONDS = 180
\ No newline at end of file
+#all providers of courses, every one is fetched by update_courses task
+FETCH_COURSES_URLS = [FETCH_COURSES_URL]
+#connect and read timeouts of requests to providers, in seconds
+FETCH_COURSES_TIMEOUT = (3.05, 10)
+FETCH_COURSES_FREQUENCY_IN_SECONDS = 180
+#how often workers check rates version in Redis to refresh in-memory rate table
+RATES_VERSION_CHECK_INTERVAL = 5
+
+#batch transfers are applied by chunks, each chunk is one bulk UPDATE and one bulk INSERT
+TRANSFER_BATCH_CHUNK_SIZE = 1000
+TRANSFER_BATCH_MAX_SIZE = 50000
+
+#asynchronous transfers are partitioned by sender's account between Celery queues transfers.0 ... transfers.N-1
+TRANSFER_QUEUE_PARTITIONS = int(os.getenv('TRANSFER_QUEUE_PARTITIONS', 4))
+#the longest wait of the client for the result of asynchronous transfer, in seconds
+TRANSFER_REQUEST_MAX_WAIT = 10
+#responses of requests with Idempotency-Key header are kept in Redis for this time, in seconds
+IDEMPOTENCY_KEY_TTL = 24 * 3600
+#the longest wait of concurrent duplicate for the response of the first request, in seconds
+IDEMPOTENCY_WAIT = 5
+#marker of the request in progress expires after the request timeout of gunicorn, so a killed worker does not block the key
+IDEMPOTENCY_PENDING_TTL = int(os.getenv('GUNICORN_TIMEOUT', 30))
+
+#cursor pagination of transfers
+TRANSFER_PAGE_SIZE = 100
+TRANSFER_PAGE_MAX_SIZE = 1000
+#count of rows fetched at once by streamed responses
+STREAM_CHUNK_SIZE = 2000
+
+#how often balances of accounts are saved to checkpoints of the ledger
+BALANCE_CHECKPOINT_FREQUENCY_IN_SECONDS = 3600
+#the largest difference of clocks of the hosts writing transfers and checkpoints, in seconds
+LEDGER_CLOCK_SKEW = int(os.getenv('LEDGER_CLOCK_SKEW', 60))
+#how often sub-balances of sharded accounts are moved to their balances
+SHARD_CONSOLIDATION_FREQUENCY_IN_SECONDS = 60
+
+#time to live of cached responses of currencies and courses, in seconds
+RATES_CACHE_TTL = 24*3600
+#page size of course list
+COURSE_PAGE_SIZE = 100
+COURSE_PAGE_MAX_SIZE = 1000
+
+#count of the last rate updates kept in Redis stream for resuming clients of the rates stream
+RATES_EVENTS_MAXLEN = 1000
+#events buffered for one client of the rates stream, slower clients are disconnected
+RATES_STREAM_QUEUE_SIZE = 100
+#seconds between heartbeat comments of the rates stream
+RATES_STREAM_HEARTBEAT = 15
+
+#read-heavy views run in the thread pool of the event loop, it is turned on for ASGI deployment
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', '0') == '1'
+
+#persistent database connections: seconds of reuse of a connection (0 - new connection per request)
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', 300))
+#persistent connection idle longer than this is checked before the request
+DB_HEALTH_CHECK_INTERVAL = int(os.getenv('DB_HEALTH_CHECK_INTERVAL', 30))
+#connections go through local PgBouncer in transaction mode
+PGBOUNCER = os.getenv('PGBOUNCER', '0') == '1'
+for database in DATABASES.values():
+    database['CONN_MAX_AGE'] = DB_CONN_MAX_AGE
+    if PGBOUNCER:
+        database['HOST'] = os.getenv('PGBOUNCER_HOST', '127.0.0.1')
+        database['PORT'] = int(os.getenv('PGBOUNCER_PORT', 6432))
+        #named cursors do not survive the end of transaction in transaction mode
+        database['DISABLE_SERVER_SIDE_CURSORS'] = True
+
+#read-only views read from the replica when REPLICA_HOST is set
+if os.getenv('REPLICA_HOST'):
+    DATABASES['replica'] = dict(DATABASES['default'], HOST=os.getenv('REPLICA_HOST'), PORT=int(os.getenv('REPLICA_PORT', 5432)), TEST={'MIRROR': 'default'})
+DATABASE_ROUTERS = ['project.routers.ReplicaRouter']
+#replica lagging more than this (seconds) is not used
+REPLICA_MAX_LAG = float(os.getenv('REPLICA_MAX_LAG', 2))
+#how often lag of the replica is checked by the worker process
+REPLICA_LAG_CHECK_INTERVAL = 1
+#reads of the user go to the primary for this time after the user's transfer
+REPLICA_STICKY_SECONDS = 10
+
+#per-process LRU of full users loaded for authenticated requests
+AUTH_USER_CACHE_SIZE = 1024
+AUTH_USER_CACHE_TTL = 60
+
+#views declare query budgets by project.querybudget.query_budget, exceeded budget fails tests and is logged otherwise
+QUERY_BUDGET_ENABLED = os.getenv('QUERY_BUDGET_ENABLED', '1' if DEBUG else '0') == '1'
+QUERY_BUDGET_STRICT = 'test' in sys.argv[1:2]
+if QUERY_BUDGET_ENABLED or QUERY_BUDGET_STRICT:
+    MIDDLEWARE.append('project.querybudget.QueryBudgetMiddleware')
+
+#decimal places of currencies having less than 4 of them, for example {'JPY': 0}
+CURRENCY_SCALES = {}
+
+#summaries of users' accounts live in Redis ACCOUNT_SUMMARY_TTL seconds, totals are in SUMMARY_CURRENCY by default
+ACCOUNT_SUMMARY_TTL = int(os.getenv('ACCOUNT_SUMMARY_TTL', 24 * 3600))
+SUMMARY_CURRENCY = os.getenv('SUMMARY_CURRENCY', 'EUR')
+
+#exports fetch EXPORT_CHUNK_SIZE rows at once and write the body by chunks of EXPORT_BUFFER_SIZE characters
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', 5000))
+EXPORT_BUFFER_SIZE = int(os.getenv('EXPORT_BUFFER_SIZE', 64 * 1024))
+
+#transfers are partitioned by month: partitions of TRANSFER_PARTITIONS_AHEAD next months are created in advance,
+#partitions of transfers and ledger entries older than TRANSFER_PARTITIONS_KEEP_MONTHS months are detached for archiving (0 keeps all of them)
+TRANSFER_PARTITIONS_FREQUENCY_IN_SECONDS = 24*3600
+TRANSFER_PARTITIONS_AHEAD = int(os.getenv('TRANSFER_PARTITIONS_AHEAD', 3))
+TRANSFER_PARTITIONS_KEEP_MONTHS = int(os.getenv('TRANSFER_PARTITIONS_KEEP_MONTHS', 0))
@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+from project.redis import get_redis
+
+class TestRunner(DiscoverRunner):
+    """Runs tests with REDIS0 pointing to REDIS_TEST database, so tests never write or delete keys
+    of the published rates, summaries and idempotency records. Only this database is flushed.
+    """
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.redis_settings = override_settings(REDIS0=settings.REDIS_TEST)
+        self.redis_settings.enable()
+        get_redis().flushdb()
+
+    def teardown_test_environment(self, **kwargs):
+        get_redis().flushdb()
+        self.redis_settings.disable()
+        super().teardown_test_environment(**kwargs)
@@ -3,3 +3,10 @@ from django.apps import AppConfig
 
 class UsersConfig(AppConfig):
     name = 'users'
+
+    def ready(self):
+        from django.db.models.signals import pre_save, post_save
+        from users.authentication import check_rights_changed, revoke_changed_user_tokens
+        #changes of is_staff or is_active by any save (views, admin, shell) revoke tokens of the user
+        pre_save.connect(check_rights_changed, sender=self.get_model('User'), dispatch_uid='users.authentication.check_rights_changed')
+        post_save.connect(revoke_changed_user_tokens, sender=self.get_model('User'), dispatch_uid='users.authentication.revoke_changed_user_tokens')
@@ -0,0 +1,151 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from django.db import transaction
+from redis import RedisError
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from project.redis import get_redis
+from users.models import User
+
+info_logger = logging.getLogger('info')
+
+#claims of the user added to tokens by TokenObtainPairWithClaimsSerializer
+USER_PK_CLAIM = 'uid'
+IS_STAFF_CLAIM = 'is_staff'
+ISSUED_AT_CLAIM = 'iat'
+
+def revoked_key(jti):
+    return 'users:revoked:%s' % jti
+
+def revoked_before_key(user_pk):
+    return 'users:revoked_before:%s' % user_pk
+
+def revoke_token(token):
+    """Adds token to the revocation list until its expiration"""
+    ttl = int(token['exp'] - time.time())
+    if ttl > 0:
+        get_redis().set(revoked_key(token[settings.SIMPLE_JWT['JTI_CLAIM']]), 1, ex=ttl)
+
+def revoke_user_tokens(user_pk):
+    """Revokes all tokens of the user issued before the current second (password, rights or activity of the user are changed).
+    Marker lives as long as refresh tokens, older tokens are expired anyway."""
+    ttl = int(settings.SIMPLE_JWT['REFRESH_TOKEN_LIFETIME'].total_seconds())
+    get_redis().set(revoked_before_key(user_pk), int(time.time()), ex=ttl)
+    user_cache.forget(user_pk)
+
+#fields of the user carried by the claims of tokens or checked by authentication
+REVOKING_FIELDS = ('is_staff', 'is_active')
+
+def check_rights_changed(sender, instance, update_fields=None, **kwargs):
+    """pre_save receiver of User: marks the user whose is_staff or is_active is changed by the save"""
+    instance._rights_changed = False
+    if instance.pk is None or (update_fields is not None and not set(update_fields) & set(REVOKING_FIELDS)):
+        return
+    stored = User.objects.filter(pk=instance.pk).values_list(*REVOKING_FIELDS).first()
+    instance._rights_changed = stored is not None and stored != tuple(getattr(instance, name) for name in REVOKING_FIELDS)
+
+def revoke_changed_user_tokens(sender, instance, **kwargs):
+    """post_save receiver of User: tokens with old is_staff claim or of deactivated user are revoked after the commit"""
+    if not getattr(instance, '_rights_changed', False):
+        return
+    instance._rights_changed = False
+    def revoke():
+        try:
+            revoke_user_tokens(instance.pk)
+        except RedisError:
+            info_logger.info('revoke_changed_user_tokens: tokens of user %s are not revoked' % instance.pk)
+    transaction.on_commit(revoke)
+
+def is_revoked(token):
+    """Token is revoked by itself or by revocation of all tokens of its user, checked by one MGET"""
+    user_pk = token.get(USER_PK_CLAIM, None)
+    keys = [revoked_key(token[settings.SIMPLE_JWT['JTI_CLAIM']])]
+    if user_pk is not None:
+        keys.append(revoked_before_key(user_pk))
+    try:
+        values = get_redis().mget(keys)
+    except RedisError:
+        #revocation list is not available, tokens are short-lived
+        info_logger.info('is_revoked: Redis is not available')
+        return False
+    if values[0] is not None:
+        return True
+    return len(values) > 1 and values[1] is not None and token.get(ISSUED_AT_CLAIM, 0) < int(values[1])
+
+class UserCache:
+    """Per-process LRU of full User objects with time to live"""
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.users = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, user_pk):
+        now = time.monotonic()
+        with self.lock:
+            cached = self.users.get(user_pk)
+            if cached is not None and cached[0] > now:
+                self.users.move_to_end(user_pk)
+                return cached[1]
+        user = User.objects.get(pk=user_pk)
+        with self.lock:
+            self.users[user_pk] = (now + self.ttl, user)
+            self.users.move_to_end(user_pk)
+            while len(self.users) > self.size:
+                self.users.popitem(last=False)
+        return user
+
+    def forget(self, user_pk):
+        with self.lock:
+            self.users.pop(user_pk, None)
+
+user_cache = UserCache(settings.AUTH_USER_CACHE_SIZE, settings.AUTH_USER_CACHE_TTL)
+
+class ClaimsUser:
+    """Lightweight user built from signed claims of access token, without database query.
+    Full User object is loaded through the per-process LRU only when it is needed (get_user).
+    """
+    is_active = True
+    is_authenticated = True
+    is_anonymous = False
+    is_superuser = False
+
+    def __init__(self, token):
+        self.token = token
+        self.pk = self.id = token[USER_PK_CLAIM]
+        self.email = token[settings.SIMPLE_JWT['USER_ID_CLAIM']]
+        self.is_staff = bool(token.get(IS_STAFF_CLAIM, False))
+
+    def __str__(self):
+        return self.email
+
+    def __eq__(self, other):
+        return isinstance(other, (ClaimsUser, User)) and self.pk == other.pk
+
+    def __hash__(self):
+        return hash(self.pk)
+
+    def get_user(self):
+        return user_cache.get(self.pk)
+
+def get_full_user(user):
+    """User model object of authenticated user"""
+    return user.get_user() if isinstance(user, ClaimsUser) else user
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """JWT authentication without per-request user query: user is built from claims
+    (id, email, is_staff) of the token checked against the revocation list in Redis.
+    Tokens issued without these claims fall back to the database lookup.
+    """
+    def get_user(self, validated_token):
+        if is_revoked(validated_token):
+            raise AuthenticationFailed('Token is revoked', code='token_revoked')
+        if USER_PK_CLAIM not in validated_token:
+            return super().get_user(validated_token)
+        try:
+            return ClaimsUser(validated_token)
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
@@ -0,0 +1,70 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.hashers import Argon2PasswordHasher, check_password, make_password
+
+class HashingPoolBusy(Exception):
+    """All slots of the hashing pool are taken, the client should retry later"""
+
+class HashingPool:
+    """Bounded pool of password hashing.
+
+    At most PASSWORD_HASHING_WORKERS hashes are computed at once and at most PASSWORD_HASHING_QUEUE
+    more wait for them, so login spikes can not take all CPU of the worker process. Requests over
+    the bound wait PASSWORD_HASHING_WAIT seconds for a slot and are rejected.
+    Hashers release GIL (OpenSSL PBKDF2, argon2-cffi), so threads hash in parallel.
+    """
+    def __init__(self, workers, queue_size):
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix='password-hashing')
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+
+    def run(self, fn, *args):
+        if not self.slots.acquire(timeout=settings.PASSWORD_HASHING_WAIT):
+            raise HashingPoolBusy('Too many concurrent logins')
+        try:
+            return self.executor.submit(fn, *args).result()
+        finally:
+            self.slots.release()
+
+hashing_pool = HashingPool(settings.PASSWORD_HASHING_WORKERS, settings.PASSWORD_HASHING_QUEUE)
+
+def verify_password(password, encoded):
+    """Checks password and rehashes it if its hash is made by not preferred hasher or parameters
+
+    :returns: tuple (valid flag, new encoded password or None)
+    """
+    updated = []
+    valid = check_password(password, encoded, setter=lambda raw_password: updated.append(make_password(raw_password)))
+    return valid, updated[0] if updated else None
+
+class ConfiguredArgon2PasswordHasher(Argon2PasswordHasher):
+    """Argon2 with parameters from settings, hashes with other parameters are updated on login"""
+    time_cost = settings.ARGON2_TIME_COST
+    memory_cost = settings.ARGON2_MEMORY_COST
+    parallelism = settings.ARGON2_PARALLELISM
+
+class PooledModelBackend(ModelBackend):
+    """ModelBackend hashing passwords in the bounded pool.
+    User is read and the updated hash is saved in the thread of the request, only hashing goes to the pool.
+    """
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        UserModel = get_user_model()
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = UserModel._default_manager.get_by_natural_key(username)
+        except UserModel.DoesNotExist:
+            #the same work as for existing user, so response time does not disclose registered emails
+            hashing_pool.run(make_password, password)
+            return None
+        valid, encoded = hashing_pool.run(verify_password, password, user.password)
+        if not valid or not self.user_can_authenticate(user):
+            return None
+        if encoded is not None:
+            user.password = encoded
+            user.save(update_fields=['password'])
+        return user
@@ -0,0 +1,58 @@
+import time
+import threading
+import requests
+from django.contrib.auth.hashers import get_hashers, check_password
+from django.core.management.base import BaseCommand, CommandError
+from users.hashing import hashing_pool
+
+class Command(BaseCommand):
+    help = ('Benchmark of logins/sec: password checks of every configured hasher through the hashing pool, '
+        'and with --url full token requests of the running service.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=8, help='Count of concurrent clients (threads)')
+        parser.add_argument('--logins', type=int, default=50, help='Count of logins of every client')
+        parser.add_argument('--url', help='Base URL of the service, for example http://127.0.0.1:8000')
+        parser.add_argument('--email', help='Email of existing user for --url')
+        parser.add_argument('--password', default='bench-password', help='Password of the user')
+
+    def handle(self, *args, **options):
+        for hasher in get_hashers():
+            encoded = hasher.encode(options['password'], hasher.salt())
+            elapsed, errors = self.run_clients(options['clients'], options['logins'],
+                lambda: hashing_pool.run(check_password, options['password'], encoded))
+            self.report(hasher.algorithm, options, elapsed, errors)
+        if options['url']:
+            if not options['email']:
+                raise CommandError('--email is required for --url')
+            url = options['url'].rstrip('/') + '/api/token/'
+            data = {'email': options['email'], 'password': options['password']}
+            def login():
+                response = requests.post(url, json=data, timeout=30)
+                if response.status_code != 200:
+                    raise Exception(response.status_code)
+            elapsed, errors = self.run_clients(options['clients'], options['logins'], login)
+            self.report('http %s' % url, options, elapsed, errors)
+
+    def report(self, name, options, elapsed, errors):
+        count = options['clients'] * options['logins']
+        self.stdout.write('%-40s clients=%s logins=%s errors=%s elapsed=%.2fs throughput=%.1f logins/s' % (
+            name, options['clients'], count, errors, elapsed, (count - errors) / elapsed))
+
+    def run_clients(self, clients, logins, login):
+        errors = [0]
+        lock = threading.Lock()
+        def client():
+            for _ in range(logins):
+                try:
+                    login()
+                except Exception:
+                    with lock:
+                        errors[0] += 1
+        started = time.monotonic()
+        threads = [threading.Thread(target=client) for _ in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.monotonic() - started, errors[0]
@@ -1,10 +1,15 @@
 import sys
+import time
 import logging
 from django.core.exceptions import ObjectDoesNotExist
 from django.contrib.auth.hashers import check_password
 from django.contrib.auth.password_validation import validate_password
 from rest_framework import serializers
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.tokens import RefreshToken
 from users.models import User
+from users.authentication import USER_PK_CLAIM, IS_STAFF_CLAIM, ISSUED_AT_CLAIM, is_revoked, revoke_token
+from users.hashing import hashing_pool
 from money.models import Account, Currency
 
 info_logger = logging.getLogger('info')
@@ -43,7 +48,7 @@ class UserCreateSerializer(serializers.Serializer):
         except:
             raise Exception(sys.exc_info()[0])
         try:
-            Account.create(user=user, currency=currency, balance=balance_value)
+            Account.create(user=user, currency=currency, balance=balance_value).save()
         except:
             raise Exception(sys.exc_info()[0])
         return user
@@ -64,7 +69,7 @@ class UserUpdateSerializer(serializers.Serializer):
         except ObjectDoesNotExist:
             raise Exception('User %s is not found!' % email)
         current_password_encoded = user.password
-        if check_password(current_password, current_password_encoded):
+        if hashing_pool.run(check_password, current_password, current_password_encoded):
             validate_password(new_password)  
             if not new_username:
                 raise Exception('Incorrect new username!')
@@ -80,4 +85,27 @@ class UserUpdateSerializer(serializers.Serializer):
             instance.save()
         except:
             raise Exception(sys.exc_info()[0])
-        return instance
\ No newline at end of file
+        return instance
+
+class TokenObtainPairWithClaimsSerializer(TokenObtainPairSerializer):
+    """Tokens carry id and rights of the user, so StatelessJWTAuthentication does not query the user.
+    Access tokens made from the refresh token inherit its claims."""
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token[USER_PK_CLAIM] = user.pk
+        token[IS_STAFF_CLAIM] = user.is_staff
+        token[ISSUED_AT_CLAIM] = int(time.time())
+        return token
+
+class TokenRefreshCheckedSerializer(TokenRefreshSerializer):
+    """Revoked refresh tokens can not be used to get new access tokens,
+    with rotation the used refresh token is revoked, so it can be used only once"""
+    def validate(self, attrs):
+        refresh = RefreshToken(attrs['refresh'])
+        if is_revoked(refresh):
+            raise serializers.ValidationError('Token is revoked')
+        data = super().validate(attrs)
+        if 'refresh' in data:
+            revoke_token(refresh)
+        return data
@@ -1,14 +1,16 @@
 from django.urls import re_path, path
 from django.conf.urls import url
+from project.async_views import async_view
 from users.views import UserListView, UserDetailsView, UserCreateUpdateView
-from money.views import AccountListForOwnerView, AccountListOfUserView
+from money.views import AccountListForOwnerView, AccountListOfUserView, AccountSummaryView
 
 urlpatterns = [
     path('create/', UserCreateUpdateView.as_view(), name='user_create'),
     path('<int:pk>/edit/', UserCreateUpdateView.as_view(), name='user_edit'),
+    path('<int:pk>/summary/', AccountSummaryView.as_view(), name='account_summary'),
     path('<int:pk>/accounts/', AccountListOfUserView.as_view(), name='account_list_of_user'),
     path('<int:pk>/', UserDetailsView.as_view(), name='user_details'),
-    path('accounts/create/', AccountListForOwnerView.as_view(), name='account_create'),
-    path('accounts/', AccountListForOwnerView.as_view(), name='my_accounts'),
-    path('', UserListView.as_view(), name='user_list'),
+    path('accounts/create/', async_view(AccountListForOwnerView), name='account_create'),
+    path('accounts/', async_view(AccountListForOwnerView), name='my_accounts'),
+    path('', async_view(UserListView), name='user_list'),
 ]
\ No newline at end of file
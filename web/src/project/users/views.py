@@ -5,13 +5,28 @@ from rest_framework import authentication, permissions, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.parsers import JSONParser
+from redis import RedisError
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.views import TokenObtainPairView
+from rest_framework_simplejwt.exceptions import TokenError
+from project.routers import ReplicaReadMixin
+from project.querybudget import query_budget
+from users.authentication import revoke_token, revoke_user_tokens
+from users.hashing import HashingPoolBusy
 from users.models import User
 from users.serializers import UserCreateSerializer, UserUpdateSerializer, UserSerializer
-from money.serializers import UserAccountListSerializer
+from money.summaries import get_summary
 
 info_logger = logging.getLogger('info')
 
-class UserListView(APIView):
+def hashing_pool_busy_response(e):
+    """503 response to requests checking passwords over the capacity of the hashing pool"""
+    response = Response(data={'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    response['Retry-After'] = '1'
+    return response
+
+@query_budget(1)
+class UserListView(ReplicaReadMixin, APIView):
     """View for getting all users"""
     permission_classes = [permissions.IsAuthenticated]
     def get(self, request):
@@ -20,18 +35,20 @@ class UserListView(APIView):
         serializer = UserSerializer(users, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
+@query_budget(3)
 class UserAccountListView(APIView):
-    """View for getting user information and its accounts"""
+    """View for getting user information and its accounts from the summary of the user's accounts"""
     permission_classes = [permissions.IsAuthenticated]
     def get(self, request, pk):
         info_logger.info('UserAccountListView')
-        try:
-            user = User.objects.get(pk=pk)
-        except:
-            return Response(data={'error': sys.exc_info()[0]}, status=status.HTTP_400_BAD_REQUEST)
-        serializer = UserAccountListSerializer(user)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        summary = get_summary(pk)
+        if summary is None:
+            return Response(data={'error': 'User not found!'}, status=status.HTTP_400_BAD_REQUEST)
+        #fields of UserAccountListSerializer
+        accounts = [{'pk': account['pk'], 'user': summary['user'], 'currency': account['currency']} for account in summary['accounts']]
+        return Response(dict(summary['user'], accounts=accounts), status=status.HTTP_200_OK)
 
+@query_budget(1)
 class UserDetailsView(APIView):
     """View for getting one particular user"""
     permission_classes = [permissions.IsAuthenticated]
@@ -62,11 +79,44 @@ class UserCreateUpdateView(APIView):
         """PATCH method for editing user's name and password"""
         instance = User.objects.get(pk=pk)
         serializer = UserUpdateSerializer(instance, data=request.data, partial=True)
-        if not serializer.is_valid():
+        #the current password is checked in the hashing pool
+        try:
+            valid = serializer.is_valid()
+        except HashingPoolBusy as e:
+            return hashing_pool_busy_response(e)
+        if not valid:
             return Response(data=serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         try:
             new_user = serializer.save()
         except:
             return Response(data={'error': sys.exc_info()[0]}, status=status.HTTP_400_BAD_REQUEST)
+        #tokens issued with the old password are not valid anymore
+        try:
+            revoke_user_tokens(new_user.pk)
+        except RedisError:
+            info_logger.info('UserCreateUpdateView: tokens of user %s are not revoked' % new_user.pk)
         serializer = UserSerializer(new_user)
-        return Response(data=serializer.data, status=status.HTTP_202_ACCEPTED)
\ No newline at end of file
+        return Response(data=serializer.data, status=status.HTTP_202_ACCEPTED)
+
+class TokenRevokeView(APIView):
+    """View for logout: revokes access token of the request and refresh token passed in field "refresh" """
+    permission_classes = [permissions.IsAuthenticated]
+    def post(self, request):
+        try:
+            if request.auth is not None:
+                revoke_token(request.auth)
+            if request.data.get('refresh', None):
+                revoke_token(RefreshToken(request.data['refresh']))
+        except TokenError as e:
+            return Response(data={'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except RedisError:
+            return Response(data={'error': 'Revocation list is not available'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+class TokenObtainView(TokenObtainPairView):
+    """Token obtaining, logins over the capacity of the password hashing pool get 503"""
+    def post(self, request, *args, **kwargs):
+        try:
+            return super().post(request, *args, **kwargs)
+        except HashingPoolBusy as e:
+            return hashing_pool_busy_response(e)